@@ -0,0 +1,174 @@
+import asyncio
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import orjson
+from starlette.routing import BaseRoute, Match
+
+# Requests served at once per pool, and requests allowed to wait for a slot.
+# Together the pools should stay within the Mongo connection pool
+# (MONGO_MAX_POOL_SIZE) so admitted requests do not queue on connections.
+CHEAP_LIMIT = int(os.environ.get('ADMISSION_CHEAP_LIMIT', 64))
+CHEAP_QUEUE = int(os.environ.get('ADMISSION_CHEAP_QUEUE', 256))
+HEAVY_LIMIT = int(os.environ.get('ADMISSION_HEAVY_LIMIT', 16))
+HEAVY_QUEUE = int(os.environ.get('ADMISSION_HEAVY_QUEUE', 32))
+# Longest a queued request waits before it is turned away
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_SECONDS', 2))
+RETRY_AFTER_SECONDS = int(os.environ.get('ADMISSION_RETRY_AFTER_SECONDS', 1))
+
+# Routes that scan or aggregate many documents; everything else is a point
+# lookup or a page of an index and runs in the cheap pool. /products/all
+# reads the registry's ids from its index, so it is cheap too
+HEAVY_ROUTES = {
+    '/price-history/{platform}/{item_id}',
+    '/product-reviews/{platform}/{product_id}',
+    '/products/batch',
+    '/price-history/batch',
+    '/product-reviews/batch',
+    '/search',
+    '/compare/{global_id}',
+    '/analytics/summary',
+    '/analytics/distribution',
+    '/analytics/quantiles',
+    '/export/{platform}',
+}
+# Never limited: scrapes must keep working while the API is overloaded, and
+# long-lived streams would hold a slot for hours (they cap their own subscribers)
+EXEMPT_ROUTES = {'/metrics', '/stream/price-changes'}
+# Tighter per-route limits inside a pool: (concurrency, queue)
+ROUTE_LIMITS = {
+    '/export/{platform}': (2, 0),
+    '/analytics/summary': (2, 8),
+    '/analytics/distribution': (2, 8),
+    '/product-reviews/{platform}/{product_id}': (8, 16),
+}
+
+class Limiter:
+    """
+    A concurrency limit with a bounded, time-limited wait queue
+    """
+    def __init__(self, name: str, limit: int, queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self, timeout: float) -> bool:
+        """
+        Take a slot, waiting up to `timeout` if the queue has room; False when rejected
+        """
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+            self.active += 1
+            return True
+        if self.waiting >= self.queue:
+            self.rejected += 1
+            return False
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+            self.active += 1
+            return True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        self.active -= 1
+        self.semaphore.release()
+
+POOLS = {
+    'cheap': Limiter('cheap', CHEAP_LIMIT, CHEAP_QUEUE),
+    'heavy': Limiter('heavy', HEAVY_LIMIT, HEAVY_QUEUE),
+}
+ROUTE_LIMITERS = {path: Limiter(path, limit, queue) for path, (limit, queue) in ROUTE_LIMITS.items()}
+
+def limiters_for(path: str) -> List[Limiter]:
+    """
+    Limiters a route must pass, narrowest first
+    """
+    if path in EXEMPT_ROUTES:
+        return []
+    pool = POOLS['heavy' if path in HEAVY_ROUTES else 'cheap']
+    route = ROUTE_LIMITERS.get(path)
+    return [route, pool] if route is not None else [pool]
+
+def render_metrics() -> str:
+    """
+    In-flight, queued and rejected requests per limiter, in Prometheus text format
+    """
+    limiters: List[Tuple[str, str, Limiter]] = [('pool', name, limiter) for name, limiter in POOLS.items()]
+    limiters += [('route', path, limiter) for path, limiter in ROUTE_LIMITERS.items()]
+    lines = []
+    for metric, kind, read in (
+        ('admission_in_flight', 'gauge', lambda limiter: limiter.active),
+        ('admission_queued', 'gauge', lambda limiter: limiter.waiting),
+        ('admission_rejected_total', 'counter', lambda limiter: limiter.rejected),
+    ):
+        lines.append(f"# TYPE {metric} {kind}")
+        lines += [f'{metric}{{{label}="{name}"}} {read(limiter)}' for label, name, limiter in limiters]
+    return '\n'.join(lines) + '\n'
+
+REJECTION_BODY = orjson.dumps({'detail': "Server busy, retry later"})
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that bounds concurrent requests per route and per pool.
+
+    Heavy aggregations and cheap lookups draw from separate pools, so a
+    flood of one never takes the slots of the other. Over the limit a
+    request waits in a short queue; once the queue is full, or the wait
+    times out, it is answered 503 with Retry-After straight away.
+    """
+    def __init__(self, app, routes: Sequence[BaseRoute]):
+        self.app = app
+        self.routes = routes
+
+    def match(self, scope) -> Optional[BaseRoute]:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = self.match(scope)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        # Lets outer middleware label rejected requests by route too
+        scope['route'] = route
+
+        acquired: List[Limiter] = []
+        try:
+            for limiter in limiters_for(route.path):
+                if not await limiter.acquire(QUEUE_TIMEOUT_SECONDS):
+                    await self.reject(send)
+                    return
+                acquired.append(limiter)
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
+    async def reject(self, send) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(REJECTION_BODY)).encode('latin-1')),
+                (b'retry-after', str(RETRY_AFTER_SECONDS).encode('latin-1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': REJECTION_BODY})
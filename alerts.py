@@ -0,0 +1,475 @@
+import argparse
+import logging
+import os
+import smtplib
+import statistics
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+import requests
+import yaml
+from pymongo import CursorType, ReplaceOne
+from pymongo.errors import BulkWriteError
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+import price_changes
+import registry
+
+COLLECTION = 'alerts'
+STATE_COLLECTION = 'alert_state'
+CHECKPOINT_COLLECTION = 'alert_checkpoints'
+CHECKPOINT_ID = 'engine'
+
+# Price observations kept per item for the rolling min and median
+DEFAULT_WINDOW = 30
+CHECKPOINT_SECONDS = float(os.environ.get('ALERT_CHECKPOINT_SECONDS', 30))
+# Alerts written (and notified) per round trip
+ALERT_BATCH_SIZE = 500
+
+def ensure_collection(db) -> None:
+    db[COLLECTION].create_index([('platform', 1), ('item_id', 1), ('scraped_timestamp', -1)])
+    db[COLLECTION].create_index([('rule', 1), ('scraped_timestamp', -1)])
+    # Only alerts stored but not yet sent are indexed; there are none outside a crash
+    db[COLLECTION].create_index('notified', partialFilterExpression={'notified': False})
+
+class ItemState:
+    """
+    Rolling state of one item: last price and stock, and its recent prices
+    """
+    __slots__ = ('price', 'stock', 'prices')
+
+    def __init__(self, window: int, price=None, stock=None, prices: Iterable[Tuple[datetime, float]] = ()):
+        self.price = price
+        self.stock = stock
+        self.prices: Deque[Tuple[datetime, float]] = deque(prices, maxlen=window)
+
+    def observe(self, event: Dict[str, Any]) -> None:
+        # Stock-only moves would repeat the price and narrow the window
+        if event['new_price'] is not None and (event['new_price'] != self.price or not self.prices):
+            self.prices.append((event['scraped_timestamp'], event['new_price']))
+        self.price, self.stock = event['new_price'], event['new_stock']
+
+    def rolling_min(self) -> Optional[float]:
+        return min(price for _, price in self.prices) if self.prices else None
+
+    def rolling_median(self) -> Optional[float]:
+        return statistics.median(price for _, price in self.prices) if self.prices else None
+
+    def to_document(self, key: str) -> Dict[str, Any]:
+        return {'_id': key, 'price': self.price, 'stock': self.stock, 'prices': [list(point) for point in self.prices]}
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any], window: int) -> 'ItemState':
+        return cls(window, document.get('price'), document.get('stock'),
+                   (tuple(point) for point in document.get('prices', [])))
+
+class Rule(ABC):
+    """
+    A condition checked on every change event against the item's state
+    before the event. Returns alert details, or None.
+    """
+    name = ''
+
+    @abstractmethod
+    def evaluate(self, state: ItemState, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        ...
+
+def is_cut(event: Dict[str, Any]) -> bool:
+    return event['old_price'] is not None and event['new_price'] is not None and event['new_price'] < event['old_price']
+
+class PriceDropRule(Rule):
+    """
+    The price fell by at least `min_drop_pct` in one step
+    """
+    name = 'price_drop'
+
+    def __init__(self, min_drop_pct: float = 15):
+        self.min_drop_pct = min_drop_pct
+
+    def evaluate(self, state, event):
+        if is_cut(event) and -(event['change_pct'] or 0) >= self.min_drop_pct:
+            return {'message': f"Price dropped {-event['change_pct']:.1f}%"}
+        return None
+
+class NewLowRule(Rule):
+    """
+    The price went below every price in the window
+    """
+    name = 'new_low'
+
+    def __init__(self, min_samples: int = 5):
+        self.min_samples = min_samples
+
+    def evaluate(self, state, event):
+        if len(state.prices) < self.min_samples or event['new_price'] is None:
+            return None
+        low = state.rolling_min()
+        if event['new_price'] < low:
+            return {'message': f"Lowest price in {len(state.prices)} observations", 'previous_low': low}
+        return None
+
+class FakeDiscountRule(Rule):
+    """
+    A cut that only undoes a recent raise: within `within_days` the price
+    went up by at least `raise_pct` from a base, and the "discounted" price
+    is still no lower than that base (less `tolerance_pct`)
+    """
+    name = 'fake_discount'
+
+    def __init__(self, raise_pct: float = 10, within_days: float = 30, tolerance_pct: float = 2):
+        self.raise_pct = raise_pct
+        self.within = timedelta(days=within_days)
+        self.tolerance_pct = tolerance_pct
+
+    def evaluate(self, state, event):
+        if not is_cut(event):
+            return None
+        since = event['scraped_timestamp'] - self.within
+        recent = [price for timestamp, price in state.prices if timestamp >= since]
+        if len(recent) < 2:
+            return None
+
+        peak_index = max(range(len(recent)), key=recent.__getitem__)
+        before_peak = recent[:peak_index]
+        if not before_peak:
+            return None
+        base, peak = min(before_peak), recent[peak_index]
+        raised = peak >= base * (1 + self.raise_pct / 100)
+        if raised and event['old_price'] >= base * (1 + self.raise_pct / 100) \
+                and event['new_price'] >= base * (1 - self.tolerance_pct / 100):
+            return {
+                'message': f"Cut to {event['new_price']:,.0f} after a raise from {base:,.0f} to {peak:,.0f}",
+                'base_price': base,
+                'peak_price': peak,
+            }
+        return None
+
+class StockOutRule(Rule):
+    """
+    Stock ran out
+    """
+    name = 'stock_out'
+
+    def evaluate(self, state, event):
+        if event['old_stock'] and event['new_stock'] == 0:
+            return {'message': f"Out of stock (had {event['old_stock']})"}
+        return None
+
+class PriceAnomalyRule(Rule):
+    """
+    The price is at least `deviation_pct` away from the rolling median
+    """
+    name = 'price_anomaly'
+
+    def __init__(self, deviation_pct: float = 40, min_samples: int = 5):
+        self.deviation_pct = deviation_pct
+        self.min_samples = min_samples
+
+    def evaluate(self, state, event):
+        if len(state.prices) < self.min_samples or event['new_price'] is None:
+            return None
+        median = state.rolling_median()
+        if not median:
+            return None
+        deviation = (event['new_price'] - median) / median * 100
+        if abs(deviation) >= self.deviation_pct:
+            return {'message': f"{deviation:+.0f}% from the rolling median", 'median': median}
+        return None
+
+RULES = {rule.name: rule for rule in (PriceDropRule, NewLowRule, FakeDiscountRule, StockOutRule, PriceAnomalyRule)}
+
+def load_rules(path: Optional[str]) -> Tuple[List[Rule], int]:
+    """
+    Read rules and the window size from a YAML file; every rule with its defaults otherwise
+    """
+    if path is None:
+        return [rule() for rule in RULES.values()], DEFAULT_WINDOW
+    with open(path, 'r', encoding='utf-8') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader) or {}
+
+    rules = []
+    for entry in config.get('rules', []):
+        params = dict(entry)
+        name = params.pop('rule', None)
+        if name not in RULES:
+            raise ValueError(f"Unknown rule {name!r}, use one of: {', '.join(RULES)}")
+        rules.append(RULES[name](**params))
+    return rules, int(config.get('window', DEFAULT_WINDOW))
+
+class Notifier(ABC):
+    """
+    Receives every batch of new alerts; subclass to deliver them elsewhere.
+
+    `notify` returns once the batch is delivered and raises when it is not,
+    so the batch is offered again later.
+    """
+    @property
+    def name(self) -> str:
+        # Recorded on each alert it delivered; must be stable across restarts
+        return type(self).__name__
+
+    @abstractmethod
+    def notify(self, alerts: List[Dict[str, Any]]) -> None:
+        ...
+
+class LogNotifier(Notifier):
+    def notify(self, alerts):
+        for alert in alerts:
+            logging.info(f"{alert['rule']} {alert['platform']}:{alert['item_id']}: {alert['message']}")
+
+class WebhookNotifier(Notifier):
+    """
+    POSTs each batch as JSON, e.g. to a Slack or Discord incoming webhook relay
+    """
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+
+    @property
+    def name(self) -> str:
+        return f"webhook:{self.url}"
+
+    def notify(self, alerts):
+        payload = orjson.dumps(alerts, default=price_changes.encode_default)
+        requests.post(self.url, data=payload, timeout=self.timeout,
+                      headers={'Content-Type': 'application/json'}).raise_for_status()
+
+class EmailNotifier(Notifier):
+    """
+    Mails one digest per batch through the SMTP server in ALERT_SMTP_* settings
+    """
+    def __init__(self, to: str):
+        self.to = to
+        self.host = os.environ.get('ALERT_SMTP_HOST', 'smtp.gmail.com')
+        self.port = int(os.environ.get('ALERT_SMTP_PORT', 465))
+        self.user = os.environ.get('ALERT_SMTP_USER')
+        self.password = os.environ.get('ALERT_SMTP_PASSWORD')
+
+    @property
+    def name(self) -> str:
+        return f"email:{self.to}"
+
+    def notify(self, alerts):
+        lines = [f"[{alert['rule']}] {alert['platform']}:{alert['item_id']} {alert['message']}" for alert in alerts]
+        message = MIMEText('\n'.join(lines), 'plain', 'utf-8')
+        message['Subject'] = f"{len(alerts)} price alerts"
+        message['From'] = self.user or self.to
+        message['To'] = self.to
+        with smtplib.SMTP_SSL(self.host, self.port, timeout=30) as server:
+            if self.user:
+                server.login(self.user, self.password)
+            server.send_message(message)
+
+class AlertEngine:
+    """
+    Evaluates rules over the price_changes feed.
+
+    Item state lives in memory; every CHECKPOINT_SECONDS the items that
+    changed and the id of the last event processed are saved, so a restart
+    resumes where the checkpoint left off. Alert ids are derived from the
+    event and rule, so events replayed after a crash do not alert twice.
+    Alerts are stored with `notified: False`; each notifier that delivers
+    them is added to `notified_by`, and they are flagged once every notifier
+    has had them. Alerts stored just before a crash or a failed notification
+    are sent on restart, to the notifiers that missed them only.
+    """
+    def __init__(self, db, rules: List[Rule], notifiers: List[Notifier], window: int = DEFAULT_WINDOW):
+        self.db = db
+        self.rules = rules
+        self.notifiers = notifiers
+        self.window = window
+        self.states: Dict[str, ItemState] = {}
+        self.dirty: set = set()
+        self.pending: List[Dict[str, Any]] = []
+        self.last_id = None
+        self.processed = 0
+
+    def load(self) -> None:
+        for document in self.db[STATE_COLLECTION].find():
+            self.states[document['_id']] = ItemState.from_document(document, self.window)
+        checkpoint = self.db[CHECKPOINT_COLLECTION].find_one({'_id': CHECKPOINT_ID})
+        self.last_id = checkpoint['last_id'] if checkpoint else None
+        logging.info(f"Loaded {len(self.states)} item states, resuming after {self.last_id}")
+        self.resend()
+
+    def resend(self) -> None:
+        """
+        Send the alerts stored before a crash or a failed notifier cut their notification short
+        """
+        unsent = list(self.db[COLLECTION].find({'notified': False}, {'notified': 0}).sort('_id', 1))
+        for start in range(0, len(unsent), ALERT_BATCH_SIZE):
+            alerts = unsent[start:start + ALERT_BATCH_SIZE]
+            logging.info(f"Resending {len(alerts)} alerts stored before their notification")
+            self.notify(alerts)
+
+    def notify(self, alerts: List[Dict[str, Any]]) -> None:
+        """
+        Offer the alerts to every notifier that has not delivered them yet.
+
+        A failing notifier does not stop the others; the alerts stay
+        unflagged and the first failure is raised once all were tried.
+        """
+        delivered = {alert['_id']: set(alert.get('notified_by', ())) for alert in alerts}
+        error = None
+        for notifier in self.notifiers:
+            pending = [alert for alert in alerts if notifier.name not in delivered[alert['_id']]]
+            if not pending:
+                continue
+            try:
+                notifier.notify(pending)
+            except Exception as e:
+                logging.error(f"{notifier.name} failed to send {len(pending)} alerts: {e}")
+                error = error or e
+                continue
+            ids = [alert['_id'] for alert in pending]
+            self.db[COLLECTION].update_many({'_id': {'$in': ids}}, {'$addToSet': {'notified_by': notifier.name}})
+            for alert_id in ids:
+                delivered[alert_id].add(notifier.name)
+
+        names = {notifier.name for notifier in self.notifiers}
+        done = [alert_id for alert_id, sent in delivered.items() if names <= sent]
+        if done:
+            self.db[COLLECTION].update_many({'_id': {'$in': done}}, {'$set': {'notified': True}})
+        if error is not None:
+            raise error
+
+    def process(self, event: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Evaluate one change event, then fold it into the item's state
+        """
+        key = registry.registry_key(event['platform'], event['item_id'])
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = ItemState(self.window)
+
+        alerts = []
+        for rule in self.rules:
+            detail = rule.evaluate(state, event)
+            if detail is not None:
+                alerts.append({
+                    '_id': f"{rule.name}:{event['_id']}",
+                    'rule': rule.name,
+                    'platform': event['platform'],
+                    'item_id': event['item_id'],
+                    'old_price': event['old_price'],
+                    'new_price': event['new_price'],
+                    'old_stock': event['old_stock'],
+                    'new_stock': event['new_stock'],
+                    'scraped_timestamp': event['scraped_timestamp'],
+                    'at': datetime.utcnow(),
+                    **detail,
+                })
+
+        state.observe(event)
+        self.dirty.add(key)
+        self.last_id = event['_id']
+        self.processed += 1
+        self.pending += alerts
+        return alerts
+
+    def flush(self) -> None:
+        """
+        Store and send the alerts raised since the last flush
+        """
+        if not self.pending:
+            return
+        alerts, self.pending = self.pending, []
+        try:
+            self.db[COLLECTION].insert_many([{**alert, 'notified': False} for alert in alerts], ordered=False)
+            new = alerts
+        except BulkWriteError as e:
+            # Duplicates come from events replayed after a restart; resend() already sent them
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            duplicates = {error['op']['_id'] for error in e.details['writeErrors']}
+            new = [alert for alert in alerts if alert['_id'] not in duplicates]
+        if new:
+            self.notify(new)
+
+    def checkpoint(self) -> None:
+        self.flush()
+        if self.dirty:
+            self.db[STATE_COLLECTION].bulk_write(
+                [ReplaceOne({'_id': key}, self.states[key].to_document(key), upsert=True) for key in self.dirty],
+                ordered=False
+            )
+            self.dirty = set()
+        if self.last_id is not None:
+            self.db[CHECKPOINT_COLLECTION].update_one(
+                {'_id': CHECKPOINT_ID},
+                {'$set': {'last_id': self.last_id, 'at': datetime.utcnow(), 'processed': self.processed}},
+                upsert=True
+            )
+
+    def run(self, from_start: bool = False) -> None:
+        """
+        Follow the feed until interrupted, checkpointing on the way out
+        """
+        feed = self.db[price_changes.COLLECTION]
+        if self.last_id is None and not from_start:
+            latest = feed.find_one({}, {'_id': 1}, sort=[('$natural', -1)])
+            self.last_id = latest['_id'] if latest else None
+        elif self.last_id is not None:
+            oldest = feed.find_one({}, {'_id': 1}, sort=[('$natural', 1)])
+            if oldest is not None and oldest['_id'] > self.last_id:
+                logging.warning(f"{price_changes.COLLECTION} rolled over since the checkpoint; some changes were missed")
+
+        last_checkpoint = time.monotonic()
+        try:
+            while True:
+                query = {'_id': {'$gt': self.last_id}} if self.last_id is not None else {}
+                cursor = feed.find(query, cursor_type=CursorType.TAILABLE_AWAIT).max_await_time_ms(1000)
+                while cursor.alive:
+                    event = cursor.try_next()
+                    if event is not None:
+                        self.process(event)
+                        if len(self.pending) >= ALERT_BATCH_SIZE:
+                            self.flush()
+                    else:
+                        self.flush()
+                    if time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                        self.checkpoint()
+                        last_checkpoint = time.monotonic()
+                # Tailable cursors on an empty collection die at once
+                time.sleep(1)
+        finally:
+            self.checkpoint()
+
+def main():
+    parser = argparse.ArgumentParser(description="Raise price-drop, fake-discount, stock-out and anomaly alerts")
+    parser.add_argument('--rules', help="YAML rules file (default: every rule with its defaults)")
+    parser.add_argument('--from-start', action='store_true',
+                        help="Without a checkpoint, process the whole feed instead of only new changes")
+    parser.add_argument('--webhook', action='append', default=[], help="POST alerts to this URL (repeatable)")
+    parser.add_argument('--email', action='append', default=[], help="Mail alerts to this address (repeatable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+    ensure_collection(db)
+
+    rules, window = load_rules(args.rules)
+    notifiers: List[Notifier] = [LogNotifier()]
+    notifiers += [WebhookNotifier(url) for url in args.webhook]
+    notifiers += [EmailNotifier(address) for address in args.email]
+
+    engine = AlertEngine(db, rules, notifiers, window)
+    engine.load()
+    try:
+        engine.run(args.from_start)
+    except KeyboardInterrupt:
+        logging.info(f"Stopped after {engine.processed} changes")
+
+if __name__ == "__main__":
+    main()
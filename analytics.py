@@ -0,0 +1,124 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from export import CANONICAL_PROJECTIONS
+from platforms import PLATFORMS
+
+# Fields /analytics/distribution can bucket
+DISTRIBUTION_FIELDS = ('price', 'rating', 'review_count')
+
+def time_match(start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    scraped: Dict[str, Any] = {}
+    if start is not None:
+        scraped['$gte'] = start
+    if end is not None:
+        scraped['$lt'] = end
+    return {'scraped_timestamp': scraped} if scraped else {}
+
+def snapshot_stages(platform: str, start: Optional[datetime], end: Optional[datetime]) -> List[Dict[str, Any]]:
+    """
+    Reduce one platform's snapshots to the canonical record (one row per snapshot, as in fact_sales)
+    """
+    return [
+        {'$match': time_match(start, end)},
+        {'$project': {
+            '_id': 0,
+            'platform': {'$literal': platform},
+            'item_id': CANONICAL_PROJECTIONS[platform]['item_id'],
+            'price': CANONICAL_PROJECTIONS[platform]['price'],
+            'rating': CANONICAL_PROJECTIONS[platform]['rating'],
+            'review_count': CANONICAL_PROJECTIONS[platform]['review_count'],
+        }},
+    ]
+
+def union_pipeline(platforms: List[str], start: Optional[datetime], end: Optional[datetime]) -> List[Dict[str, Any]]:
+    """
+    Stages run on the first platform's collection that stream every requested platform's rows
+    """
+    pipeline = snapshot_stages(platforms[0], start, end)
+    for platform in platforms[1:]:
+        pipeline.append({'$unionWith': {'coll': platform, 'pipeline': snapshot_stages(platform, start, end)}})
+    return pipeline
+
+def summary_group(key: Any, medians: bool = True) -> Dict[str, Any]:
+    group = {
+        '_id': key,
+        'snapshots': {'$sum': 1},
+        'price_mean': {'$avg': '$price'},
+        'price_std': {'$stdDevPop': '$price'},
+        'price_min': {'$min': '$price'},
+        'price_max': {'$max': '$price'},
+        'review_count_mean': {'$avg': '$review_count'},
+        'review_count_max': {'$max': '$review_count'},
+        'rating_mean': {'$avg': '$rating'},
+    }
+    # $median is new in MongoDB 7.0; older servers get null medians (see summary_pipeline)
+    if medians:
+        group['price_median'] = {'$median': {'input': '$price', 'method': 'approximate'}}
+        group['rating_median'] = {'$median': {'input': '$rating', 'method': 'approximate'}}
+    return {'$group': group}
+
+SUMMARY_SHAPE = {
+    '$project': {
+        '_id': 1,
+        'snapshots': 1,
+        'price': {
+            'mean': '$price_mean', 'median': {'$ifNull': ['$price_median', None]}, 'std': '$price_std',
+            'min': '$price_min', 'max': '$price_max',
+        },
+        'review_count': {'mean': '$review_count_mean', 'max': '$review_count_max'},
+        'rating': {'mean': '$rating_mean', 'median': {'$ifNull': ['$rating_median', None]}},
+    }
+}
+
+# Distinct (platform, item) pairs: one group row per item, so memory does not grow with a
+# per-group set of ids and the stage can spill to disk
+ITEM_STAGE = {'$group': {'_id': {'platform': '$platform', 'item_id': '$item_id'}}}
+
+def summary_pipeline(start: Optional[datetime], end: Optional[datetime], medians: bool = True) -> List[Dict[str, Any]]:
+    """
+    Per-platform and overall statistics, computed in a single $facet pass.
+
+    Medians need MongoDB 7.0; pass `medians=False` on older servers.
+    """
+    return union_pipeline(list(PLATFORMS), start, end) + [
+        {'$facet': {
+            'platforms': [summary_group('$platform', medians), SUMMARY_SHAPE, {'$sort': {'_id': 1}}],
+            'overall': [summary_group(None, medians), SUMMARY_SHAPE],
+            'platform_items': [ITEM_STAGE, {'$group': {'_id': '$_id.platform', 'items': {'$sum': 1}}}],
+            'overall_items': [ITEM_STAGE, {'$count': 'items'}],
+        }},
+    ]
+
+def format_summary(row: Dict[str, Any]) -> Dict[str, Any]:
+    def strip(stats: Dict[str, Any], items: int) -> Dict[str, Any]:
+        stats = {key: value for key, value in stats.items() if key != '_id'}
+        return {'snapshots': stats.pop('snapshots', 0), 'items': items, **stats}
+
+    platform_items = {row['_id']: row['items'] for row in row.get('platform_items', [])}
+    overall = row.get('overall') or [{}]
+    overall_items = row.get('overall_items') or [{}]
+    return {
+        'platforms': {stats['_id']: strip(stats, platform_items.get(stats['_id'], 0))
+                      for stats in row.get('platforms', [])},
+        'overall': strip(overall[0], overall_items[0].get('items', 0)),
+    }
+
+def distribution_pipeline(field: str, buckets: int, platforms: List[str],
+                          start: Optional[datetime], end: Optional[datetime]) -> List[Dict[str, Any]]:
+    """
+    Histogram of one field per platform, each facet bucketed independently
+    """
+    if field not in DISTRIBUTION_FIELDS:
+        raise ValueError(f"Invalid field, use one of: {', '.join(DISTRIBUTION_FIELDS)}")
+
+    def histogram(platform: str) -> List[Dict[str, Any]]:
+        return [
+            {'$match': {'platform': platform, field: {'$type': 'number'}}},
+            {'$bucketAuto': {'groupBy': f'${field}', 'buckets': buckets}},
+            {'$project': {'_id': 0, 'min': '$_id.min', 'max': '$_id.max', 'count': 1}},
+        ]
+
+    return union_pipeline(platforms, start, end) + [
+        {'$facet': {platform: histogram(platform) for platform in platforms}},
+    ]
@@ -1,17 +1,26 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from bson import ObjectId
-import json
+from contextlib import asynccontextmanager
+from bson.raw_bson import RawBSONDocument
 from typing import Dict, Any
-from config import URI
+from database import DATABASE, create_async_client
+from serialization import RAW_BSON, PrerenderedJSONResponse, decode_raw
+
+client = create_async_client()
+db = client[DATABASE]
+raw_db = client.get_database(DATABASE, codec_options=RAW_BSON)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await client.close()
 
 app = FastAPI(
     title="Product API",
     description="API for retrieving product details from MongoDB",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -22,24 +31,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = MongoClient(URI, server_api=ServerApi('1'))
-db = client['datashop']
-
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super().default(obj)
-
-def serialize_document(document: Dict[str, Any]) -> Dict[str, Any]:
+def serialize_document(document: RawBSONDocument) -> Dict[str, Any]:
     """
-    Serialize MongoDB document to JSON with proper handling of nested documents
+    Decode a raw MongoDB document and merge responseBody into the top level
     """
     if document is None:
         return None
     
-    # Convert to JSON-compatible format
-    serialized = json.loads(json.dumps(document, cls=JSONEncoder))
+    serialized = decode_raw(document)
     
     # If responseBody exists, merge it carefully
     if 'responseBody' in serialized:
@@ -54,7 +53,7 @@ def serialize_document(document: Dict[str, Any]) -> Dict[str, Any]:
 @app.get("/products")
 async def get_product_list():
     try:
-        product_ids = list(db['lazada'].distinct('responseBody.itemId'))
+        product_ids = await db['lazada'].distinct('responseBody.itemId')
         if not product_ids:
             raise HTTPException(status_code=404, detail="No products found")
         return {"product_ids": product_ids}
@@ -67,7 +66,7 @@ async def get_product_details(item_id: str):
         # Convert item_id to integer if it's numeric
         query_id = int(item_id) if item_id.isdigit() else item_id
         
-        product = db['lazada'].find_one({"responseBody.itemId": query_id})
+        product = await raw_db['lazada'].find_one({"responseBody.itemId": query_id})
         if not product:
             raise HTTPException(
                 status_code=404,
@@ -76,7 +75,7 @@ async def get_product_details(item_id: str):
         
         # Use the improved serialize_document function
         serialized_result = serialize_document(product)
-        return serialized_result
+        return PrerenderedJSONResponse(serialized_result)
 
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid item ID format")
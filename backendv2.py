@@ -1,22 +1,73 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from math import ceil
 from fastapi import Query
+from pydantic import BaseModel, Field
 
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from contextlib import asynccontextmanager
 from bson import ObjectId
-import json
-from typing import Dict, Any, List, Union
-from config import URI
+from bson.errors import InvalidId
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import OperationFailure
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from database import DATABASE, create_async_client
+from platforms import ITEM_ID_FIELDS, PLATFORMS, TITLE_FIELDS, get_item_id, get_title, parse_item_id
+from price_history_daily import group_days, start_of_day
+from serialization import RAW_BSON, PrerenderedJSONResponse, decode_raw, dumps
+from cache import CacheInvalidator, ResponseCache, SingleFlight, make_key
+from etag import etag_matches, make_etag, not_modified, with_etag
+from compression import COMPRESSION_MIN_SIZE, CompressionMiddleware, compress, negotiate
+from profiling import CommandTimer, ProfilingMiddleware, render_metrics
+from diagnostics import SlowOpRecorder
+from admission import AdmissionMiddleware, render_metrics as render_admission_metrics
+import export
+import reviews
+import search
+import matching
+import analytics
+import registry
+import price_points
+import price_changes
+import sketches
+
+# Explains and records slow reads in the diagnostics collection
+slow_ops = SlowOpRecorder()
+# CommandTimer charges Mongo round trips to the request that made them (Server-Timing, /metrics)
+client = create_async_client(event_listeners=[CommandTimer(), slow_ops])
+slow_ops.attach(client)
+db = client[DATABASE]
+# Pass-through reads (product and review documents) skip decoding in the driver
+raw_db = client.get_database(DATABASE, codec_options=RAW_BSON)
+
+cache = ResponseCache()
+# Identical requests that miss the cache together share one computation
+flights = SingleFlight()
+invalidator = CacheInvalidator(db, cache)
+broadcaster = price_changes.ChangeBroadcaster(db)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    invalidator.start()
+    await slow_ops.start(db)
+    broadcaster.start()
+    yield
+    await broadcaster.stop()
+    await slow_ops.stop()
+    await invalidator.stop()
+    await client.close()
 
 app = FastAPI(
     title="Multi-Platform Product API",
     description="API for retrieving product details from multiple e-commerce platforms",
-    version="0.2.0"
+    version="0.2.0",
+    lifespan=lifespan
 )
 
+# Innermost, so rejections still get CORS headers
+app.add_middleware(AdmissionMiddleware, routes=app.router.routes)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:8050"],
@@ -24,70 +75,74 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+# Added last so it is outermost and times the whole request
+app.add_middleware(ProfilingMiddleware)
 
-client = MongoClient(URI, server_api=ServerApi('1'))
-db = client['datashop']
-
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super().default(obj)
-
-def serialize_document(document: Dict[str, Any], platform: str) -> Dict[str, Any]:
+async def cached_response(key: str, tags: List[str], compute: Callable[[], Awaitable[Any]],
+                          request: Optional[Request] = None) -> PrerenderedJSONResponse:
     """
-    Serialize MongoDB document to JSON with platform-specific handling
+    Serve a rendered body from the response cache, computing and storing it on a miss.
+
+    Concurrent misses for the same key wait for a single computation.
+    Entries served again are also kept compressed in the client's encoding,
+    so hot entries are not recompressed on every hit.
     """
-    if document is None:
-        return None
-    
-    serialized = json.loads(json.dumps(document, cls=JSONEncoder))
-    
-    if platform == 'lazada':
-        if 'responseBody' in serialized:
-            response_body = serialized.pop('responseBody')
-            serialized.update(response_body)
-    elif platform == 'shopee':
-        if 'responseBody' in serialized and 'data' in serialized['responseBody']:
-            serialized.update(serialized['responseBody']['data'])
-    
-    return serialized
+    version = cache.version
+    body = await cache.get(key)
+    if body is None:
+        async def fill() -> bytes:
+            rendered = dumps(await compute())
+            await cache.set(key, rendered, tags, version)
+            return rendered
 
-def get_lazada_pdp(product: Dict[str, Any]) -> Dict[str, Any]:
+        # Keyed by version too: requests arriving after an invalidation must not join an older flight
+        body = await flights.do(f"{key}@{version}", fill)
+        return PrerenderedJSONResponse(body)
+
+    encoding = negotiate(request.headers.get('accept-encoding')) if request is not None else None
+    if encoding is None or len(body) < COMPRESSION_MIN_SIZE:
+        return PrerenderedJSONResponse(body)
+
+    variant_key = f"{key}#{encoding}"
+    compressed = await cache.get(variant_key)
+    if compressed is None:
+        compressed = compress(body, encoding)
+        await cache.set(variant_key, compressed, tags, version)
+    return PrerenderedJSONResponse(compressed, headers={'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+
+def get_lazada_pdp(product: RawBSONDocument) -> Dict[str, Any]:
     """
     Process Lazada PDP data structure
     """
-    if not product or 'responseBody' not in product:
+    if product is None:
         return None
     
-    response_body = product['responseBody']
-    result = {**product, **response_body}
-    result['_id'] = str(result['_id'])
-    del result['responseBody']
-    return result
+    result = decode_raw(product)
+    # Absent when a `fields` projection only selected top-level fields
+    response_body = result.pop('responseBody', {})
+    return {**result, **response_body}
 
-def get_tiki_pdp(product: Dict[str, Any]) -> Dict[str, Any]:
+def get_tiki_pdp(product: RawBSONDocument) -> Dict[str, Any]:
     """
     Process Tiki PDP data structure
     """
-    if not product:
+    if product is None:
         return None
     
-    product['_id'] = str(product['_id'])
-    return product
+    return decode_raw(product)
 
-def get_shopee_pdp(product: Dict[str, Any]) -> Dict[str, Any]:
+def get_shopee_pdp(product: RawBSONDocument) -> Dict[str, Any]:
     """
     Process Shopee PDP data structure
     """
-    if not product or 'responseBody' not in product:
+    if product is None:
         return None
     
-    response_body = product['responseBody']
+    result = decode_raw(product)
+    response_body = result.pop('responseBody', {})
     data = response_body.get('data', {}).get('item', {})
-    del product['responseBody']
-    product['_id'] = str(product['_id'])
-    return {**product, **data}
+    return {**result, **data}
 
 def get_platform_product_id(platform: str, document: Dict[str, Any]) -> Union[str, int]:
     """
@@ -101,54 +156,203 @@ def get_platform_product_id(platform: str, document: Dict[str, Any]) -> Union[st
         return document.get('id')
     return None
 
-@app.get("/products/all", response_model=Dict[str, List[Union[str, int]]])
-async def get_all_products():
+async def load_all_products() -> Dict[str, List[Union[str, int]]]:
+    """
+    Collect product IDs from all platforms with one covered scan of the registry
+    """
+    result = {platform: [] for platform in PLATFORMS}
+    async for row in db[registry.COLLECTION].find({}, registry.ID_PROJECTION).sort(registry.ID_SORT):
+        result[row['platform']].append(row['item_id'])
+    
+    # Check if any platform has products
+    if not any(result.values()):
+        raise HTTPException(status_code=404, detail="No products found in any platform")
+        
+    return result
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+async def load_product_page(platform: Optional[str], limit: int, after: Optional[Any] = None) -> List[Dict[str, Any]]:
+    """
+    Read one page of (platform, item_id) rows in ascending order, starting after `after`.
+
+    The registry's (platform, item_id) index answers the filter, sort and
+    projection on its own, so no document is fetched.
+    """
+    return await db[registry.COLLECTION].find(
+        registry.page_filter(platform, after), registry.ID_PROJECTION
+    ).sort(registry.ID_SORT).limit(limit).to_list()
+
+def parse_products_cursor(after: str) -> tuple:
+    """
+    Split a `/products/all` cursor of the form `<platform>:<item id>`
+    """
+    platform, _, item_id = after.partition(':')
+    if platform not in PLATFORMS or not item_id:
+        raise ValueError(f"Invalid cursor {after!r}")
+    return platform, parse_item_id(item_id)
+
+async def load_all_products_page(limit: int, after: Optional[str]) -> Dict[str, Any]:
+    """
+    Page through the ids of every platform in turn, lazada first
+    """
+    rows = await load_product_page(None, limit, parse_products_cursor(after) if after is not None else None)
+    products: Dict[str, List[Union[str, int]]] = {}
+    for row in rows:
+        products.setdefault(row['platform'], []).append(row['item_id'])
+
+    last = rows[-1] if len(rows) == limit else None
+    return {"product_ids": products, "next_after": f"{last['platform']}:{last['item_id']}" if last else None}
+
+@app.get("/products/all")
+async def get_all_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for every id"),
+    after: Optional[str] = Query(None, description="`next_after` of the previous page")
+):
     """
     Retrieve product IDs from all platforms
     """
     try:
-        result = {
-            'lazada': list(db['lazada'].distinct('responseBody.itemId')),
-            'shopee': list(db['shopee'].distinct('responseBody.data.item.item_id')),
-            'tiki': list(db['tiki'].distinct('id'))
-        }
-        
-        # Check if any platform has products
-        if not any(result.values()):
-            raise HTTPException(status_code=404, detail="No products found in any platform")
-            
-        return result
+        if limit is None and after is None:
+            return await cached_response(make_key('products/all'), ['products'], load_all_products, request)
+
+        limit = limit or DEFAULT_PAGE_SIZE
+        return await cached_response(
+            make_key('products/all', limit=limit, after=after),
+            ['products'],
+            lambda: load_all_products_page(limit, after),
+            request
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+async def load_platform_products(platform: str) -> Dict[str, Any]:
+    """
+    Collect product IDs for a specific platform
+    """
+    products = [
+        row['item_id'] async for row in
+        db[registry.COLLECTION].find({'platform': platform}, registry.ID_PROJECTION).sort(registry.ID_SORT)
+    ]
+        
+    if not products:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No products found for {platform}"
+        )
+        
+    return {"platform": platform, "product_ids": products}
+
+async def load_platform_products_page(platform: str, limit: int, after: Optional[str]) -> Dict[str, Any]:
+    rows = await load_product_page(platform, limit, parse_item_id(after) if after is not None else None)
+    products = [row['item_id'] for row in rows]
+    if not products and after is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No products found for {platform}"
+        )
+
+    next_after = products[-1] if len(products) == limit else None
+    return {"platform": platform, "product_ids": products, "next_after": next_after}
+
 @app.get("/products/{platform}")
-async def get_platform_products(platform: str):
+async def get_platform_products(
+    platform: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for every id"),
+    after: Optional[str] = Query(None, description="`next_after` of the previous page")
+):
     """
-    Retrieve product IDs for a specific platform
+    Retrieve product IDs for a specific platform.
+
+    With `limit` or `after` the ids come back in ascending pages; pass the
+    returned `next_after` to fetch the next one until it is null.
     """
     if platform not in ['lazada', 'shopee', 'tiki']:
         raise HTTPException(status_code=400, detail="Invalid platform")
     
     try:
-        if platform == 'lazada':
-            products = list(db['lazada'].distinct('responseBody.itemId'))
-        elif platform == 'shopee':
-            products = list(db['shopee'].distinct('responseBody.data.item.item_id'))
-        else:  # tiki
-            products = list(db['tiki'].distinct('id'))
-            
-        if not products:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No products found for {platform}"
+        if limit is None and after is None:
+            return await cached_response(
+                make_key('products', platform=platform),
+                [f'products:{platform}'],
+                lambda: load_platform_products(platform),
+                request
             )
-            
-        return {"platform": platform, "product_ids": products}
+
+        limit = limit or DEFAULT_PAGE_SIZE
+        return await cached_response(
+            make_key('products', platform=platform, limit=limit, after=after),
+            [f'products:{platform}'],
+            lambda: load_platform_products_page(platform, limit, after),
+            request
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+PDP_HANDLERS = {
+    'lazada': get_lazada_pdp,
+    'shopee': get_shopee_pdp,
+    'tiki': get_tiki_pdp,
+}
+
+# Where each platform's PDP handler lifts fields from before flattening them
+PDP_FIELD_PREFIXES = {
+    'lazada': ['', 'responseBody.'],
+    'shopee': ['', 'responseBody.data.item.'],
+    'tiki': [''],
+}
+
+def pdp_projection(platform: str, fields: Optional[str]) -> Optional[Dict[str, int]]:
+    """
+    Turn `fields=title,price` on the flattened PDP into a Mongo projection.
+
+    Dotted names such as `skus.salePrice` select nested fields.
+    """
+    selected = export.parse_fields(fields)
+    if not selected:
+        return None
+    projection = {prefix + field: 1 for field in selected for prefix in PDP_FIELD_PREFIXES[platform]}
+    if '_id' not in selected:
+        projection['_id'] = 0
+    return projection
+
+async def get_snapshot_version(platform: str, query_id: Union[str, int]) -> Optional[Dict[str, Any]]:
+    """
+    Read the _id and scraped_timestamp of an item's latest snapshot.
+
+    Snapshots are never modified, so the _id doubles as a version stamp.
+    The registry keeps a pointer to it; items it has not seen yet fall back
+    to the (item id, scraped_timestamp) index.
+    """
+    entry = await db[registry.COLLECTION].find_one(
+        {'_id': registry.registry_key(platform, query_id)},
+        {'snapshot_id': 1, 'last_seen': 1}
+    )
+    if entry is not None:
+        return {'_id': entry['snapshot_id'], 'scraped_timestamp': entry['last_seen']}
+
+    return await db[platform].find_one(
+        {ITEM_ID_FIELDS[platform]: query_id},
+        {'scraped_timestamp': 1},
+        sort=[('scraped_timestamp', -1)]
+    )
+
 @app.get("/product/{platform}/{item_id}")
-async def get_product_details(platform: str, item_id: str):
+async def get_product_details(
+    platform: str,
+    item_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated PDP fields to return")
+):
     """
     Retrieve detailed product information with platform-specific PDP handling
     """
@@ -158,260 +362,205 @@ async def get_product_details(platform: str, item_id: str):
     try:
         query_id = int(item_id) if item_id.isdigit() else item_id
         
-        # Platform-specific queries and PDP processing
-        if platform == 'lazada':
-            product = db['lazada'].find_one({"responseBody.itemId": query_id})
-            if product:
-                return get_lazada_pdp(product)
-                
-        elif platform == 'shopee':
-            product = db['shopee'].find_one({'responseBody.data.item.item_id': query_id})
-            if product:
-                return get_shopee_pdp(product)
-                
-        else:  # tiki
-            product = db['tiki'].find_one({'id': query_id})
-            if product:
-                return get_tiki_pdp(product)
-        
-        raise HTTPException(
-            status_code=404,
-            detail=f"Product with ID {item_id} not found on {platform}"
-        )
+        version = await get_snapshot_version(platform, query_id)
+        if version is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Product with ID {item_id} not found on {platform}"
+            )
+
+        etag = make_etag('product', platform, version['_id'], fields)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        # Platform-specific PDP processing of the latest snapshot
+        product = await raw_db[platform].find_one({'_id': version['_id']}, pdp_projection(platform, fields))
+        # The snapshot can be removed between the two reads
+        if product is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Product with ID {item_id} not found on {platform}"
+            )
+        return with_etag(PrerenderedJSONResponse(PDP_HANDLERS[platform](product)), etag)
             
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid item ID format")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-def get_shopee_price_history(item_id: Union[str, int]):
+# Daily row fields each platform exposes in /price-history
+PRICE_HISTORY_FIELDS = {
+    'lazada': {'sku_id': 'skuId'},
+    'shopee': {},
+    'tiki': {'stock': 'stock_qty'},
+}
+
+async def get_latest_title(platform: str, query_id: Union[str, int]) -> Optional[str]:
     """
-    Retrieve price history for Shopee products with corrected query structure
+    Read the title from the most recent snapshot using the (item id, scraped_timestamp) index
     """
-    query_id = int(item_id) if isinstance(item_id, str) and item_id.isdigit() else item_id
-    
-    pipeline = [
-        {
-            "$match": {
-                "responseBody.data.item.item_id": query_id
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "itemId": "$responseBody.data.item.item_id",
-                "title": "$responseBody.data.item.title",
-                "salePrice": {
-                    "$divide": ["$responseBody.data.item.price", 100000]
-                },
-                "scraped_timestamp": {
-                    "$toDate": "$scraped_timestamp"
-                }
-            }
-        },
-        {
-            "$project": {
-                "itemId": 1,
-                "title": 1,
-                "salePrice": 1,
-                "scraped_timestamp": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d",
-                        "date": "$scraped_timestamp"
-                    }
-                }
-            }
-        },
-        {
-            "$sort": {
-                "scraped_timestamp": 1
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "itemId": "$itemId",
-                    "scraped_timestamp": "$scraped_timestamp"
-                },
-                "title": {"$first": "$title"},
-                "salePrice": {"$first": "$salePrice"}
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "itemId": "$_id.itemId",
-                "scraped_timestamp": "$_id.scraped_timestamp",
-                "title": 1,
-                "salePrice": 1
-            }
-        }
-    ]
-    
-    return list(db['shopee'].aggregate(pipeline))
+    snapshot = await db[platform].find_one(
+        {ITEM_ID_FIELDS[platform]: query_id},
+        {TITLE_FIELDS[platform]: 1},
+        sort=[('scraped_timestamp', -1)]
+    )
+    return get_title(platform, snapshot) if snapshot else None
+
+def history_projection(platform: str) -> Dict[str, int]:
+    return {"_id": 0, "item_id": 1, "day": 1, "price": 1, **{field: 1 for field in PRICE_HISTORY_FIELDS[platform]}}
 
-def get_lazada_price_history(item_id: Union[str, int]):
+def format_history_rows(platform: str, query_id: Union[str, int], title: Optional[str], rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Retrieve price history for Lazada products
+    Shape price_history_daily rows into /price-history entries
     """
-    query_id = int(item_id) if isinstance(item_id, str) and item_id.isdigit() else item_id
-    
-    pipeline = [
+    fields = PRICE_HISTORY_FIELDS[platform]
+    return [
         {
-            "$match": {
-                "responseBody.itemId": query_id
-            }
-        },
-        {
-            "$unwind": "$responseBody.skus"
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "itemId": "$responseBody.itemId",
-                "skuId": "$responseBody.skus.skuId",
-                "salePrice": "$responseBody.skus.salePrice",
-                "scraped_timestamp": {
-                    "$toDate": "$scraped_timestamp"
-                },
-                "title": "$responseBody.title"
-            }
-        },
-        {
-            "$project": {
-                "itemId": 1,
-                "skuId": 1,
-                "salePrice": 1,
-                "scraped_timestamp": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d",
-                        "date": "$scraped_timestamp"
-                    }
-                },
-                "title": 1
-            }
-        },
-        {
-            "$sort": {
-                "scraped_timestamp": 1
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "itemId": "$itemId",
-                    "scraped_timestamp": "$scraped_timestamp"
-                },
-                "title": {"$first": "$title"},
-                "prices": {
-                    "$push": {
-                        "skuId": "$skuId",
-                        "salePrice": "$salePrice"
-                    }
-                }
-            }
-        },
-        {
-            "$unwind": "$prices"
-        },
-        {
-            "$group": {
-                "_id": {
-                    "itemId": "$_id.itemId",
-                    "scraped_timestamp": "$_id.scraped_timestamp"
-                },
-                "title": {"$first": "$title"},
-                "skuId": {"$first": "$prices.skuId"},
-                "salePrice": {"$first": "$prices.salePrice"}
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "itemId": "$_id.itemId",
-                "scraped_timestamp": "$_id.scraped_timestamp",
-                "title": 1,
-                "skuId": 1,
-                "salePrice": 1
-            }
+            "itemId": query_id,
+            "title": title,
+            "scraped_timestamp": row["day"].strftime("%Y-%m-%d"),
+            "salePrice": row["price"],
+            **{name: row.get(field) for field, name in fields.items()}
         }
+        for row in rows
     ]
-    
-    return list(db['lazada'].aggregate(pipeline))
 
-def get_tiki_price_history(item_id: Union[str, int]):
+async def get_daily_price_history(platform: str, item_id: Union[str, int], start: Optional[datetime] = None, end: Optional[datetime] = None):
     """
-    Retrieve price history for Tiki products
+    Retrieve the daily price history of a product from the price_history_daily view
     """
-    query_id = int(item_id) if isinstance(item_id, str) and item_id.isdigit() else item_id
-    
-    pipeline = [
-        {
-            "$match": {
-                "id": query_id
-            }
-        },
-        {
-            "$unwind": "$stock_item"
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "itemId": "$id",
-                "title": "$name",
-                "salePrice": "$price",
-                "stock_qty": "$stock_item.qty",
-                "scraped_timestamp": {
-                    "$toDate": "$scraped_timestamp"
-                }
-            }
-        },
-        {
-            "$project": {
-                "itemId": 1,
-                "title": 1,
-                "salePrice": 1,
-                "stock_qty": 1,
-                "scraped_timestamp": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d",
-                        "date": "$scraped_timestamp"
-                    }
-                }
-            }
-        },
-        {
-            "$sort": {
-                "scraped_timestamp": 1
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "itemId": "$itemId",
-                    "scraped_timestamp": "$scraped_timestamp"
-                },
-                "title": {"$first": "$title"},
-                "salePrice": {"$first": "$salePrice"},
-                "stock_qty": {"$first": "$stock_qty"}
-            }
+    query_id = parse_item_id(item_id)
+
+    query = {"platform": platform, "item_id": query_id}
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start_of_day(start)
+    if end is not None:
+        date_range["$lt"] = end
+    if date_range:
+        query["day"] = date_range
+
+    rows = await db['price_history_daily'].find(
+        query,
+        history_projection(platform)
+    ).sort("day", 1).to_list()
+    if not rows:
+        return []
+
+    title = await get_latest_title(platform, query_id)
+    return format_history_rows(platform, query_id, title, rows)
+
+# Platforms whose price_points backfill finished; a finished backfill stays finished
+backfilled_platforms = set()
+
+async def history_backfilled(platform: str) -> bool:
+    """
+    Whether price_history_daily covers the snapshots stored before ingest wrote price points
+    """
+    if platform not in backfilled_platforms:
+        checkpoint = await db['migrations'].find_one({'_id': price_points.backfill_id(platform)}, {'done': 1})
+        if checkpoint and checkpoint.get('done'):
+            backfilled_platforms.add(platform)
+    return platform in backfilled_platforms
+
+async def get_snapshot_price_history(platform: str, item_id: Union[str, int], start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Build the daily price history from raw snapshots, for platforms whose backfill has not finished
+    """
+    query_id = parse_item_id(item_id)
+
+    query: Dict[str, Any] = {ITEM_ID_FIELDS[platform]: query_id}
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start_of_day(start)
+    if end is not None:
+        date_range["$lt"] = end
+    if date_range:
+        query["scraped_timestamp"] = date_range
+
+    snapshots = await db[platform].find(
+        query,
+        {**price_points.SNAPSHOT_PROJECTIONS[platform], TITLE_FIELDS[platform]: 1}
+    ).sort("scraped_timestamp", 1).to_list()
+    points = [price_points.primary_point(platform, snapshot) for snapshot in snapshots]
+    rows = group_days([point for point in points if point])
+    if not rows:
+        return []
+
+    title = get_title(platform, snapshots[-1])
+    return format_history_rows(platform, query_id, title, rows)
+
+async def get_item_price_history(platform: str, item_id: Union[str, int], start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Read the daily view once the backfill has finished, the raw snapshots before
+    """
+    if await history_backfilled(platform):
+        return await get_daily_price_history(platform, item_id, start, end)
+    return await get_snapshot_price_history(platform, item_id, start, end)
+
+async def get_history_version(platform: str, query_id: Union[str, int]) -> Optional[Dict[str, Any]]:
+    """
+    Read the latest refreshed_at over all of an item's daily rows.
+
+    A refresh stamps every day it regroups, older days rewritten by late
+    scrapes included, so the maximum moves whenever any row changes.
+    """
+    return await db['price_history_daily'].find_one(
+        {'platform': platform, 'item_id': query_id},
+        {'_id': 0, 'refreshed_at': 1},
+        sort=[('refreshed_at', -1)]
+    )
+
+def summarize_price_history(platform: str, history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Wrap daily history entries with product info and summary statistics
+    """
+    result = {
+        "product_info": {
+            "itemId": history[0]["itemId"],
+            "title": history[0]["title"],
+            "platform": platform
         },
-        {
-            "$project": {
-                "_id": 0,
-                "itemId": "$_id.itemId",
-                "scraped_timestamp": "$_id.scraped_timestamp",
-                "title": 1,
-                "salePrice": 1,
-                "stock_qty": 1
-            }
+        "price_history": history,
+        "statistics": {
+            "lowest_price": min(entry["salePrice"] for entry in history),
+            "highest_price": max(entry["salePrice"] for entry in history),
+            "latest_price": history[-1]["salePrice"],
+            "first_recorded_date": history[0]["scraped_timestamp"],
+            "last_recorded_date": history[-1]["scraped_timestamp"],
+            "total_records": len(history)
         }
-    ]
+    }
+    # Add stock information for Tiki products
+    if platform == 'tiki':
+        result["statistics"]["current_stock"] = history[-1]["stock_qty"]
     
-    return list(db['tiki'].aggregate(pipeline))
+    return result
+
+async def build_price_history(platform: str, item_id: str, start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    """
+    Build the price history response body with summary statistics
+    """
+    history = await get_item_price_history(platform, item_id, start, end)
+        
+    if not history:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No price history found for product {item_id} on {platform}"
+        )
+        
+    return summarize_price_history(platform, history)
 
 @app.get("/price-history/{platform}/{item_id}")
-async def get_price_history(platform: str, item_id: str):
+async def get_price_history(
+    platform: str,
+    item_id: str,
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Only include snapshots scraped at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only include snapshots scraped before this time")
+):
     """
     Retrieve price history for a specific product from the specified platform
     """
@@ -419,139 +568,124 @@ async def get_price_history(platform: str, item_id: str):
         raise HTTPException(status_code=400, detail="Invalid platform or platform not supported")
         
     try:
-        if platform == 'lazada':
-            history = get_lazada_price_history(item_id)
-        elif platform == 'shopee':
-            history = get_shopee_price_history(item_id)
-        else:  # tiki
-            history = get_tiki_price_history(item_id)
+        query_id = parse_item_id(item_id)
 
-            
-        if not history:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No price history found for product {item_id} on {platform}"
+        snapshot, history_version = await asyncio.gather(
+            get_snapshot_version(platform, query_id),
+            get_history_version(platform, query_id)
+        )
+        etag = None
+        if history_version is not None:
+            etag = make_etag(
+                'price-history', platform, query_id, start, end,
+                history_version['refreshed_at'], snapshot['_id'] if snapshot else None
             )
-            
-        # Process the results to include additional statistics
-        result = {
-            "product_info": {
-                "itemId": history[0]["itemId"],
-                "title": history[0]["title"],
-                "platform": platform
-            },
-            "price_history": history,
-            "statistics": {
-                "lowest_price": min(entry["salePrice"] for entry in history),
-                "highest_price": max(entry["salePrice"] for entry in history),
-                "latest_price": history[-1]["salePrice"],
-                "first_recorded_date": history[0]["scraped_timestamp"],
-                "last_recorded_date": history[-1]["scraped_timestamp"],
-                "total_records": len(history)
-            }
-        }
-                # Add stock information for Tiki products
-        if platform == 'tiki':
-            result["statistics"]["current_stock"] = history[-1]["stock_qty"]
-        
-        return result
-        
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        response = await cached_response(
+            make_key('price-history', platform=platform, item_id=query_id, start=start, end=end),
+            ['history', f'history:{platform}:{query_id}'],
+            lambda: build_price_history(platform, item_id, start, end),
+            request
+        )
+        return with_etag(response, etag) if etag else response
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid item ID format")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Custom JSON encoder for MongoDB ObjectId
-def serialize_mongo_document(doc):
+DEFAULT_REVIEW_PAGE_SIZE = 20
+MAX_REVIEW_PAGE_SIZE = 100
+
+async def get_review_page(platform: str, item_id: Union[str, int], sort: str, limit: int, after: Optional[str]) -> Dict[str, Any]:
     """
-    Convert MongoDB document with ObjectId to a JSON-serializable dictionary
+    Read one page of an item's reviews from the per-review collection.
+
+    Every sort order is an index range scan on (platform, item_id, ...), so
+    a page costs the same whatever the size of the catalog.
     """
-    if doc is None:
-        return None
-    
-    # Create a copy of the document to avoid modifying the original
-    serialized_doc = doc.copy()
-    
-    # Convert ObjectId to string
-    for key, value in serialized_doc.items():
-        if isinstance(value, ObjectId):
-            serialized_doc[key] = str(value)
-        
-        # If the value is a list or dict, recursively convert ObjectIds
-        elif isinstance(value, list):
-            serialized_doc[key] = [
-                str(item) if isinstance(item, ObjectId) else item 
-                for item in value
-            ]
-        elif isinstance(value, dict):
-            serialized_doc[key] = {
-                k: str(v) if isinstance(v, ObjectId) else v 
-                for k, v in value.items()
-            }
-    
-    return serialized_doc
+    query, order = reviews.page_query(platform, item_id, sort, after)
+    page = await db[reviews.COLLECTION].find(query, reviews.PAGE_PROJECTION).sort(order).limit(limit).to_list()
+    return {"reviews": page, "next_after": reviews.next_cursor(sort, page, limit)}
 
-def get_shopee_tiki_reviews(product_id: str):
+def format_review_summary(platform: str, item_id: Union[str, int], source: Optional[Dict[str, Any]], total: int) -> Optional[Dict[str, Any]]:
     """
-    Retrieve reviews for Shopee or Tiki products from the reviews collection
+    Shape the `review` object from the item's summary source and stored review count
     """
-    # First try with the original ID format
-    result = db['review'].find_one({'id': str(product_id)})
-    
-    # If not found, try with zero-padded format (common for Tiki products)
-    
-    if not result:
+    if source is None and not total:
         return None
-        
-    return result
+    if platform == 'lazada':
+        rating_summary = (source or {}).get('responseBody', {}).get('ratingCountByScore')
+        return {"_id": item_id, "total_reviews": total, "rating_summary": rating_summary}
+    return {**(source or {}), "total_reviews": total}
 
-def get_lazada_reviews(product_id: Union[str, int]):
+async def get_review_summary(platform: str, item_id: Union[str, int]) -> Optional[Dict[str, Any]]:
     """
-    Retrieve reviews for Lazada products using aggregation pipeline
+    Totals and rating breakdown for the `review` object of /product-reviews.
+
+    Shopee and Tiki keep their raw review response without the review list;
+    Lazada gets the `_id` / `rating_summary` shape its old aggregation
+    returned. `total_reviews` is the number of stored reviews.
     """
-    query_id = int(product_id) if isinstance(product_id, str) and product_id.isdigit() else product_id
-    
-    pipeline = [
-        {
-            "$unwind": "$responseBody.reviews"
-        },
-        {
-            "$group": {
-                "_id": "$responseBody.itemId",
-                "reviews": {
-                    "$push": "$responseBody.reviews"
-                },
-                "total_reviews": {
-                    "$sum": 1
-                },
-                "rating_summary": {
-                    "$first": "$responseBody.ratingCountByScore"
-                }
-            }
-        },
-        {
-            "$match": {
-                "_id": query_id
-            }
-        },
-        {
-            "$sort": {
-                "total_reviews": -1
-            }
+    total = await db[reviews.COLLECTION].count_documents({'platform': platform, 'item_id': item_id})
+    if platform == 'lazada':
+        source = await db['lazada'].find_one(
+            {ITEM_ID_FIELDS['lazada']: item_id},
+            reviews.LAZADA_SUMMARY_PROJECTION,
+            sort=[('scraped_timestamp', -1)]
+        )
+    else:
+        source = await db[reviews.SOURCE_COLLECTION].find_one({'id': str(item_id)}, reviews.SUMMARY_PROJECTIONS[platform])
+    return format_review_summary(platform, item_id, source, total)
+
+async def get_review_summaries(platform: str, ids: List[Union[str, int]]) -> Dict[Union[str, int], Dict[str, Any]]:
+    """
+    get_review_summary for many items of one platform, with one query per source
+    """
+    cursor = await db[reviews.COLLECTION].aggregate([
+        {'$match': {'platform': platform, 'item_id': {'$in': ids}}},
+        {'$group': {'_id': '$item_id', 'total': {'$sum': 1}}},
+    ])
+    totals = {row['_id']: row['total'] async for row in cursor}
+    if platform == 'lazada':
+        sources = await get_latest_snapshots(
+            'lazada', ids, {**reviews.LAZADA_SUMMARY_PROJECTION, ITEM_ID_FIELDS['lazada']: 1}
+        )
+    else:
+        sources = {
+            parse_item_id(source['id']): source async for source in db[reviews.SOURCE_COLLECTION].find(
+                {'id': {'$in': [str(item_id) for item_id in ids]}}, reviews.SUMMARY_PROJECTIONS[platform]
+            )
         }
-    ]
-    
-    result = list(db['lazada'].aggregate(pipeline))
-    return result[0] if result else None
+
+    summaries = {}
+    for item_id in ids:
+        summary = format_review_summary(platform, item_id, sources.get(item_id), totals.get(item_id, 0))
+        if summary is not None:
+            summaries[item_id] = summary
+    return summaries
 
 @app.get("/product-reviews/{platform}/{product_id}")
-async def get_product_reviews(platform: str, product_id: str):
+async def get_product_reviews(
+    platform: str,
+    product_id: str,
+    sort: str = Query('newest', description="newest, oldest, highest or lowest"),
+    limit: int = Query(DEFAULT_REVIEW_PAGE_SIZE, ge=1, le=MAX_REVIEW_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="`next_after` of the previous page")
+):
     """
     Retrieve product reviews from specified platform
     
     Parameters:
     - platform: str - The e-commerce platform (lazada, shopee, or tiki)
     - product_id: str - The product ID to lookup
+    - sort: str - Page order; ties are broken by review time
+    - limit / after: keyset pagination, pass `next_after` back as `after`
+
+    `review` holds the item's totals and rating breakdown; `reviews` is the page.
     """
     platform = platform.lower().strip()
     supported_platforms = {'lazada', 'shopee', 'tiki'}
@@ -563,36 +697,517 @@ async def get_product_reviews(platform: str, product_id: str):
         )
         
     try:
-        if platform == 'lazada':
-            review_data = get_lazada_reviews(product_id)
-        else:  # shopee or tiki
-            review_data = get_shopee_tiki_reviews(product_id)
+        item_id = parse_item_id(product_id)
+        page, summary = await asyncio.gather(
+            get_review_page(platform, item_id, sort, limit, after),
+            get_review_summary(platform, item_id)
+        )
             
-        if not review_data:
+        if summary is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"No reviews found for product {product_id} on {platform}"
             )
         
-        # Serialize the document to handle ObjectId
-        serialized_review_data = serialize_mongo_document(review_data)
-            
         result = {
             "product_id": product_id,
             "platform": platform,
-            "review": serialized_review_data
+            "sort": sort,
+            "review": summary,
+            **page
         }
         
-        return result
+        return PrerenderedJSONResponse(result)
         
-    except ValueError:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid product ID format. Please provide a valid product ID."
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Upper bound on (platform, id) pairs accepted by one batch request
+MAX_BATCH_ITEMS = 500
+
+class BatchItem(BaseModel):
+    platform: str
+    id: Union[int, str]
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
+def group_batch_ids(items: List[BatchItem]) -> Dict[str, List[Union[str, int]]]:
+    """
+    Collect the distinct parsed ids requested for each supported platform
+    """
+    grouped: Dict[str, List[Union[str, int]]] = {}
+    for item in items:
+        if item.platform in ITEM_ID_FIELDS:
+            ids = grouped.setdefault(item.platform, [])
+            query_id = parse_item_id(item.id)
+            if query_id not in ids:
+                ids.append(query_id)
+    return grouped
+
+def batch_results(items: List[BatchItem], found: Dict[tuple, Any], what: str) -> List[Dict[str, Any]]:
+    """
+    Lay results out in request order with a per-item status
+    """
+    results = []
+    for item in items:
+        entry = {"platform": item.platform, "id": item.id}
+        if item.platform not in ITEM_ID_FIELDS:
+            entry.update(status=400, error="Invalid platform")
+        else:
+            data = found.get((item.platform, parse_item_id(item.id)))
+            if data is None:
+                entry.update(status=404, error=f"No {what} found for product {item.id} on {item.platform}")
+            else:
+                entry.update(status=200, data=data)
+        results.append(entry)
+    return results
+
+async def get_latest_snapshots(platform: str, query_ids: List[Union[str, int]], projection: Optional[Dict[str, int]] = None) -> Dict[Union[str, int], Any]:
+    """
+    Fetch the latest snapshot of many items with two indexed queries.
+
+    The first groups the (item id, scraped_timestamp) index to find each
+    item's newest timestamp without touching documents; the second fetches
+    exactly those snapshots.
+    """
+    id_field = ITEM_ID_FIELDS[platform]
+    cursor = await db[platform].aggregate([
+        {"$match": {id_field: {"$in": query_ids}}},
+        {"$sort": {id_field: -1, "scraped_timestamp": -1}},
+        {"$group": {"_id": f"${id_field}", "scraped_timestamp": {"$first": "$scraped_timestamp"}}}
+    ])
+    latest = await cursor.to_list()
+    if not latest:
+        return {}
+
+    snapshots = {}
+    async for snapshot in raw_db[platform].find(
+        {"$or": [{id_field: row["_id"], "scraped_timestamp": row["scraped_timestamp"]} for row in latest]},
+        projection
+    ):
+        snapshots.setdefault(get_item_id(platform, snapshot), snapshot)
+    return snapshots
+
+@app.post("/products/batch")
+async def get_products_batch(batch: BatchRequest):
+    """
+    Retrieve the latest product details for many (platform, id) pairs
+    """
+    try:
+        grouped = group_batch_ids(batch.items)
+        per_platform = await asyncio.gather(*(
+            get_latest_snapshots(platform, ids) for platform, ids in grouped.items()
+        ))
+
+        found = {}
+        for platform, snapshots in zip(grouped, per_platform):
+            for query_id, snapshot in snapshots.items():
+                found[(platform, query_id)] = PDP_HANDLERS[platform](snapshot)
+
+        return PrerenderedJSONResponse(batch_results(batch.items, found, "product"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+@app.post("/price-history/batch")
+async def get_price_history_batch(batch: BatchRequest):
+    """
+    Retrieve the daily price history of many (platform, id) pairs
+    """
+    async def load(platform: str, ids: List[Union[str, int]]) -> Dict[tuple, Any]:
+        if not await history_backfilled(platform):
+            histories = await asyncio.gather(*(get_snapshot_price_history(platform, query_id) for query_id in ids))
+            return {
+                (platform, query_id): summarize_price_history(platform, history)
+                for query_id, history in zip(ids, histories) if history
+            }
+
+        rows, snapshots = await asyncio.gather(
+            db['price_history_daily'].find(
+                {"platform": platform, "item_id": {"$in": ids}},
+                history_projection(platform)
+            ).sort([("item_id", 1), ("day", 1)]).to_list(),
+            get_latest_snapshots(platform, ids, {TITLE_FIELDS[platform]: 1, ITEM_ID_FIELDS[platform]: 1})
         )
+        rows_by_item: Dict[Union[str, int], List[Dict[str, Any]]] = {}
+        for row in rows:
+            rows_by_item.setdefault(row["item_id"], []).append(row)
+
+        histories = {}
+        for query_id, item_rows in rows_by_item.items():
+            snapshot = snapshots.get(query_id)
+            title = get_title(platform, snapshot) if snapshot else None
+            history = format_history_rows(platform, query_id, title, item_rows)
+            histories[(platform, query_id)] = summarize_price_history(platform, history)
+        return histories
+
+    try:
+        found = {}
+        for histories in await asyncio.gather(*(
+            load(platform, ids) for platform, ids in group_batch_ids(batch.items).items()
+        )):
+            found.update(histories)
+
+        return PrerenderedJSONResponse(batch_results(batch.items, found, "price history"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/product-reviews/batch")
+async def get_product_reviews_batch(batch: BatchRequest):
+    """
+    Retrieve reviews for many (platform, id) pairs.
+
+    Each item has the shape of /product-reviews with the default sort and
+    page size; it is not found only when it has neither a summary nor reviews.
+    """
+    async def load_pages(platform: str, ids: List[Union[str, int]]) -> Dict[Union[str, int], List[Dict[str, Any]]]:
+        # Newest page of each item; $topN keeps the group bounded per item
+        cursor = await db[reviews.COLLECTION].aggregate([
+            {'$match': {'platform': platform, 'item_id': {'$in': ids}}},
+            {'$group': {
+                '_id': '$item_id',
+                'reviews': {'$topN': {
+                    'n': DEFAULT_REVIEW_PAGE_SIZE,
+                    'sortBy': dict(reviews.SORTS['newest']),
+                    'output': {field: f'${field}' for field in reviews.REVIEW_FIELDS},
+                }},
+            }},
+        ])
+        return {row['_id']: row['reviews'] async for row in cursor}
+
+    async def load(platform: str, ids: List[Union[str, int]]) -> Dict[tuple, Any]:
+        pages, summaries = await asyncio.gather(load_pages(platform, ids), get_review_summaries(platform, ids))
+        found = {}
+        for item_id, summary in summaries.items():
+            page = pages.get(item_id, [])
+            found[(platform, item_id)] = {
+                "product_id": str(item_id),
+                "platform": platform,
+                "sort": 'newest',
+                "review": summary,
+                "reviews": page,
+                "next_after": reviews.next_cursor('newest', page, DEFAULT_REVIEW_PAGE_SIZE),
+            }
+        return found
+
+    try:
+        found = {}
+        for pages in await asyncio.gather(*(
+            load(platform, ids) for platform, ids in group_batch_ids(batch.items).items()
+        )):
+            found.update(pages)
+
+        return PrerenderedJSONResponse(batch_results(batch.items, found, "reviews"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+async def run_search(q: str, platform: Optional[str], limit: int, after: Optional[str]) -> Dict[str, Any]:
+    cursor = await db[search.COLLECTION].aggregate(search.search_pipeline(q, platform, limit, after))
+    rows = await cursor.to_list()
+    return {
+        "query": q,
+        "results": [{key: row.get(key) for key in ('platform', 'item_id', 'title', 'global_id', 'score')} for row in rows],
+        "next_after": search.next_cursor(rows, limit),
+    }
+
+@app.get("/search")
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Words to look for in product titles"),
+    platform: Optional[str] = Query(None, description="Restrict results to one platform"),
+    limit: int = Query(DEFAULT_SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="`next_after` of the previous page")
+):
+    """
+    Search product titles across platforms, best matches first.
+
+    Titles must contain every word; accents are ignored, so "dien thoai"
+    matches "Điện thoại".
+    """
+    if platform is not None and platform not in ['lazada', 'shopee', 'tiki']:
+        raise HTTPException(status_code=400, detail="Invalid platform")
+    if not search.fold(q):
+        raise HTTPException(status_code=400, detail="Query has no searchable words")
+
+    try:
+        return await cached_response(
+            make_key('search', q=search.fold(q), platform=platform, limit=limit, after=after),
+            ['products'],
+            lambda: run_search(q, platform, limit, after),
+            request
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+async def load_comparison(global_id: str) -> Dict[str, Any]:
+    products = await db[matching.COLLECTION].find(
+        {'global_id': global_id},
+        {'_id': 0, 'platform': 1, 'item_id': 1, 'title': 1, 'brand': 1, 'price': 1, 'stock': 1, 'scraped_timestamp': 1}
+    ).to_list()
+    if not products:
+        raise HTTPException(status_code=404, detail=f"No products found for global id {global_id}")
+
+    priced = [product for product in products if product.get('price') is not None]
+    products.sort(key=lambda product: (product.get('price') is None, product.get('price') or 0))
+    cheapest = priced and min(priced, key=lambda product: product['price'])
+    return {
+        "global_id": global_id,
+        "products": products,
+        "cheapest": {"platform": cheapest['platform'], "item_id": cheapest['item_id'], "price": cheapest['price']} if cheapest else None,
+    }
+
+@app.get("/compare/{global_id}")
+async def compare_product(global_id: str, request: Request):
+    """
+    Current price of one product on every platform that lists it.
+
+    `global_id` comes from /search results; all listings of a product share
+    it, so this is a single indexed lookup.
+    """
+    try:
+        return await cached_response(
+            make_key('compare', global_id=global_id),
+            ['products'],
+            lambda: load_comparison(global_id),
+            request
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def load_summary(start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    try:
+        cursor = await db[PLATFORMS[0]].aggregate(analytics.summary_pipeline(start, end), allowDiskUse=True)
+        rows = await cursor.to_list()
+    except OperationFailure as e:
+        # Servers before MongoDB 7.0 have no $median; answer without medians
+        if '$median' not in str(e):
+            raise
+        cursor = await db[PLATFORMS[0]].aggregate(analytics.summary_pipeline(start, end, medians=False), allowDiskUse=True)
+        rows = await cursor.to_list()
+    return {"start": start, "end": end, **analytics.format_summary(rows[0] if rows else {})}
+
+@app.get("/analytics/summary")
+async def get_analytics_summary(
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Only include snapshots scraped at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only include snapshots scraped before this time")
+):
+    """
+    Snapshot, price, review and rating statistics per platform and overall
+    """
+    try:
+        return await cached_response(
+            make_key('analytics/summary', start=start, end=end),
+            ['products'],
+            lambda: load_summary(start, end),
+            request
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def load_distribution(field: str, buckets: int, platforms: List[str],
+                            start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    cursor = await db[platforms[0]].aggregate(
+        analytics.distribution_pipeline(field, buckets, platforms, start, end), allowDiskUse=True
+    )
+    rows = await cursor.to_list()
+    return {"field": field, "buckets": buckets, "platforms": rows[0] if rows else {}}
+
+@app.get("/analytics/distribution")
+async def get_analytics_distribution(
+    request: Request,
+    field: str = Query('price', description="price, rating or review_count"),
+    buckets: int = Query(10, ge=1, le=100),
+    platform: Optional[str] = Query(None, description="Restrict to one platform"),
+    start: Optional[datetime] = Query(None, description="Only include snapshots scraped at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only include snapshots scraped before this time")
+):
+    """
+    Histogram of a snapshot field per platform, with evenly filled buckets
+    """
+    if platform is not None and platform not in ['lazada', 'shopee', 'tiki']:
+        raise HTTPException(status_code=400, detail="Invalid platform")
+    if field not in analytics.DISTRIBUTION_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid field, use one of: {', '.join(analytics.DISTRIBUTION_FIELDS)}")
+
+    platforms = [platform] if platform else list(PLATFORMS)
+    try:
+        return await cached_response(
+            make_key('analytics/distribution', field=field, buckets=buckets, platform=platform, start=start, end=end),
+            ['products'],
+            lambda: load_distribution(field, buckets, platforms, start, end),
+            request
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def load_quantiles(field: str, platforms: List[str], categories: Optional[List[Any]],
+                         start: Optional[datetime], end: Optional[datetime],
+                         fractions: List[float], bins: int) -> Dict[str, Any]:
+    cursor = db[sketches.COLLECTION].find(
+        sketches.sketch_filter(field, platforms, categories, start, end), sketches.SKETCH_PROJECTION
+    )
+    documents = await cursor.to_list()
+    return {"field": field, "bins": bins, **sketches.summarize(documents, fractions, bins)}
+
+@app.get("/analytics/quantiles")
+async def get_analytics_quantiles(
+    request: Request,
+    field: str = Query('price', description="price, rating or total_reviews"),
+    q: Optional[str] = Query(None, description="Comma-separated quantiles between 0 and 1"),
+    bins: int = Query(20, ge=1, le=100),
+    platform: Optional[str] = Query(None, description="Restrict to one platform"),
+    category: Optional[str] = Query(None, description="Comma-separated category ids"),
+    start: Optional[datetime] = Query(None, description="First day to include"),
+    end: Optional[datetime] = Query(None, description="Include days before this time")
+):
+    """
+    Approximate quantiles and equal-width histogram bins of a field, per
+    platform and overall, counting each item once per day like fact_sales.
+
+    Read from per platform/category/day sketches kept at ingest, so the cost
+    depends on the number of days and categories, not snapshots. Quantiles
+    are within about 1% in rank; the time range is resolved to whole days.
+    """
+    if platform is not None and platform not in ['lazada', 'shopee', 'tiki']:
+        raise HTTPException(status_code=400, detail="Invalid platform")
+    if field not in sketches.SKETCH_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid field, use one of: {', '.join(sketches.SKETCH_FIELDS)}")
+
+    try:
+        fractions = sketches.parse_quantiles(q)
+        platforms = [platform] if platform else list(PLATFORMS)
+        categories = [parse_item_id(value.strip()) for value in category.split(',') if value.strip()] if category else None
+        return await cached_response(
+            make_key('analytics/quantiles', field=field, q=q, bins=bins, platform=platform,
+                     category=category, start=start, end=end),
+            ['products'],
+            lambda: load_quantiles(field, platforms, categories, start, end, fractions, bins),
+            request
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@app.get("/stream/price-changes")
+async def stream_price_changes(
+    request: Request,
+    platform: Optional[str] = Query(None, description="Comma-separated platforms; omit for all"),
+    items: Optional[str] = Query(None, description="Comma-separated `platform:id` items; omit for all"),
+    min_change: float = Query(0.0, ge=0, description="Only price moves of at least this many percent")
+):
+    """
+    Server-Sent Events stream of price and stock changes as snapshots are ingested.
+
+    Each `price-change` event carries platform, item_id, old/new price and
+    stock and change_pct. Reconnecting with Last-Event-ID (EventSource does
+    this itself) replays the events missed in between, or sends a `reset`
+    event when more than 1000 were missed. A client too slow to
+    keep up gets an `overflow` event and should reconnect.
+    """
+    try:
+        platforms = set(platform.split(',')) if platform else None
+        if platforms and not platforms <= set(PLATFORMS):
+            raise HTTPException(status_code=400, detail="Invalid platform")
+        subscriber = price_changes.Subscriber(platforms, price_changes.parse_items(items), min_change)
+
+        last_event_id = request.headers.get('last-event-id')
+        after = ObjectId(last_event_id) if last_event_id else None
+    except HTTPException:
+        raise
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid items or Last-Event-ID")
+
+    if not broadcaster.subscribe(subscriber):
+        raise HTTPException(status_code=503, detail="Too many open streams", headers={'Retry-After': '30'})
+    return StreamingResponse(
+        price_changes.event_stream(broadcaster, subscriber, after),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Request, phase and MongoDB command latency histograms and admission
+    control state in Prometheus text format.
+
+    Each uvicorn worker keeps its own; scrape them individually.
+    """
+    return PlainTextResponse(render_metrics() + render_admission_metrics(), media_type="text/plain; version=0.0.4")
+
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+@app.get("/export/{platform}")
+async def export_platform(
+    platform: str,
+    format: str = Query('ndjson', description="ndjson or arrow"),
+    shape: str = Query('canonical', description="canonical records or raw documents"),
+    since: Optional[datetime] = Query(None, description="Only snapshots scraped after this time"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to include")
+):
+    """
+    Stream every snapshot of a platform, oldest first, straight from a Mongo cursor.
+
+    Rows are encoded and flushed in fixed-size chunks, so memory use does not
+    grow with the collection. Resume an incremental load by passing the last
+    scraped_timestamp received as `since`.
+    """
+    if platform not in ['lazada', 'shopee', 'tiki']:
+        raise HTTPException(status_code=400, detail="Invalid platform")
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid format, use ndjson or arrow")
+    if shape not in ('canonical', 'document'):
+        raise HTTPException(status_code=400, detail="Invalid shape, use canonical or document")
+    if format == 'arrow':
+        if shape != 'canonical':
+            raise HTTPException(status_code=400, detail="Arrow export needs the canonical shape")
+        if export.pa is None:
+            raise HTTPException(status_code=501, detail="Arrow export requires pyarrow")
+
+    selected = export.parse_fields(fields)
+    if shape == 'canonical':
+        unknown = sorted(set(selected) - set(export.CANONICAL_FIELDS))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    try:
+        if shape == 'canonical':
+            cursor = await db[platform].aggregate(
+                export.canonical_pipeline(platform, since, selected), batchSize=export.CHUNK_SIZE
+            )
+        else:
+            # Raw BSON is handed to orjson without building intermediate dicts
+            cursor = raw_db[platform].find(**export.document_query(since, selected), batch_size=export.CHUNK_SIZE)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    body = export.arrow_stream(cursor, selected) if format == 'arrow' else export.ndjson_stream(cursor)
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[format])
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
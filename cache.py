@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from platforms import PLATFORMS, get_item_id
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', 300))
+# Optional SQLite file shared by every uvicorn worker on the host
+CACHE_SHARED_PATH = os.environ.get('CACHE_SHARED_PATH')
+CACHE_POLL_SECONDS = float(os.environ.get('CACHE_POLL_SECONDS', 30))
+
+INGEST_LOG = 'ingest_log'
+# Written by ingest after the snapshots themselves (registry, search, matching,
+# sketches); every document names its platform, and all but sketches an item
+DERIVED_COLLECTIONS = ('products', 'product_search', 'product_matches', 'sketches')
+
+def make_key(endpoint: str, **params: Any) -> str:
+    """
+    Build a cache key from the endpoint name and its normalized parameters
+    """
+    parts = [f"{name}={params[name]}" for name in sorted(params) if params[name] is not None]
+    return endpoint + '?' + '&'.join(parts)
+
+class SharedStore:
+    """
+    SQLite-backed second level shared by the workers of one host
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        connection = self.connect()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS entry_tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key));
+        """)
+        connection.commit()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self.connect().execute(
+            'SELECT value FROM entries WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, tags: Iterable[str], expires: float) -> None:
+        connection = self.connect()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, value, expires))
+            connection.executemany('INSERT OR IGNORE INTO entry_tags VALUES (?, ?)', [(tag, key) for tag in tags])
+            # Expired rows are only skipped on read; sweep them now and then
+            self.writes += 1
+            if self.writes % 100 == 0:
+                connection.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+                connection.execute('DELETE FROM entry_tags WHERE key NOT IN (SELECT key FROM entries)')
+
+    def discard(self, key: str) -> None:
+        connection = self.connect()
+        with connection:
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def invalidate(self, tags: Iterable[str]) -> None:
+        connection = self.connect()
+        tags = list(tags)
+        with connection:
+            for tag in tags:
+                connection.execute(
+                    'DELETE FROM entries WHERE key IN (SELECT key FROM entry_tags WHERE tag = ?)', (tag,)
+                )
+                connection.execute('DELETE FROM entry_tags WHERE tag = ?', (tag,))
+
+    def clear(self) -> None:
+        connection = self.connect()
+        with connection:
+            connection.execute('DELETE FROM entries')
+            connection.execute('DELETE FROM entry_tags')
+
+class ResponseCache:
+    """
+    Bounded LRU + TTL cache of rendered response bodies.
+
+    Every entry carries tags (for example `products:lazada` or
+    `history:tiki:197665885`) so a data change evicts exactly the entries
+    built from it. An optional SharedStore lets workers reuse each other's
+    results; each worker still evicts its own LRU from its invalidator.
+    SQLite calls can wait on another worker's lock, so they run in a thread.
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS,
+                 shared_path: Optional[str] = CACHE_SHARED_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.tags: Dict[str, Set[str]] = {}
+        self.shared = SharedStore(shared_path) if shared_path else None
+        # Bumped by every invalidation so results computed before it are not stored
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, expires, _ = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.discard(key)
+
+        if self.shared is not None:
+            try:
+                value = await asyncio.to_thread(self.shared.get, key)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: bytes, tags: Iterable[str] = (), version: Optional[int] = None) -> None:
+        """
+        Store a value; pass the `version` read before computing it to drop
+        results that raced with an invalidation
+        """
+        if version is not None and version != self.version:
+            return
+        tags = frozenset(tags)
+        self.discard(key)
+        self.entries[key] = (value, time.monotonic() + self.ttl, tags)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+
+        while len(self.entries) > self.max_entries:
+            self.discard(next(iter(self.entries)))
+
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.set, key, value, tags, time.time() + self.ttl)
+                # An invalidation may have run while the write waited for its lock
+                if version is not None and version != self.version:
+                    await asyncio.to_thread(self.shared.discard, key)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared cache write failed: {e}")
+
+    def discard(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        tags = list(tags)
+        self.version += 1
+        for tag in tags:
+            for key in list(self.tags.get(tag, ())):
+                self.discard(key)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.invalidate, tags)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared cache invalidation failed: {e}")
+
+    async def clear(self) -> None:
+        self.version += 1
+        self.entries.clear()
+        self.tags.clear()
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.clear)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared cache clear failed: {e}")
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one computation.
+
+    The first caller starts the computation as its own task and later
+    callers await the same task, so a cold cache hit by a burst of
+    identical requests runs one query. The task is shielded: a caller
+    that disconnects does not cancel it for the others.
+    """
+    def __init__(self):
+        self.flights: Dict[str, asyncio.Task] = {}
+        self.collapsed = 0
+
+    async def do(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self.flights[key] = task
+            task.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(task)
+
+def snapshot_tags(platform: str, item_id: Any) -> List[str]:
+    """
+    Entries that depend on the snapshots of one item
+    """
+    tags = ['products', f'products:{platform}']
+    if item_id is not None:
+        tags += [f'product:{platform}:{item_id}', f'reviews:{platform}:{item_id}']
+    return tags
+
+def history_tags(platform: str, item_id: Any) -> List[str]:
+    # Every history entry also carries the plain `history` tag
+    if item_id is None:
+        return ['history']
+    return [f'history:{platform}:{item_id}']
+
+def review_tags(item_id: Any) -> List[str]:
+    # Shopee and Tiki reviews share the review collection, keyed only by id
+    if item_id is None:
+        return ['reviews']
+    return [f'reviews:shopee:{item_id}', f'reviews:tiki:{item_id}']
+
+def record_ingest(db, platform: str, item_ids: Iterable[Any], source: str = 'ingest') -> None:
+    """
+    Append an ingest watermark entry for invalidators that cannot use change streams
+    """
+    db[INGEST_LOG].insert_one({
+        'at': datetime.utcnow(),
+        'source': source,
+        'platform': platform,
+        'item_ids': sorted(set(item_ids), key=str),
+    })
+
+def ensure_ingest_log(db) -> None:
+    """
+    Keep the watermark log bounded; pollers only read its tail
+    """
+    if INGEST_LOG not in db.list_collection_names():
+        db.create_collection(INGEST_LOG, capped=True, size=16 * 1024 * 1024)
+    db[INGEST_LOG].create_index('at')
+
+def change_tags(change: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    Map a change stream event to the cache tags it invalidates.
+
+    Returns None when the event cannot be attributed to an item (deletes,
+    drops), in which case the whole cache is cleared.
+    """
+    if change.get('operationType') not in ('insert', 'update', 'replace'):
+        return None
+
+    collection = change.get('ns', {}).get('coll')
+    document = change.get('fullDocument')
+    if not document:
+        return None
+
+    if collection in PLATFORMS:
+        return snapshot_tags(collection, get_item_id(collection, document))
+    if collection == 'price_history_daily':
+        return history_tags(document.get('platform'), document.get('item_id'))
+    if collection == 'review':
+        return review_tags(document.get('id'))
+    if collection in DERIVED_COLLECTIONS:
+        return snapshot_tags(document.get('platform'), document.get('item_id'))
+    return []
+
+def ingest_log_tags(entry: Dict[str, Any]) -> List[str]:
+    """
+    Map an ingest_log entry to the cache tags it invalidates
+    """
+    platform = entry.get('platform')
+    item_ids = entry.get('item_ids') or [None]
+    tags = []
+    for item_id in item_ids:
+        if entry.get('source') == 'price_history_daily':
+            tags += history_tags(platform, item_id)
+        elif platform == 'review':
+            tags += review_tags(item_id)
+        else:
+            tags += snapshot_tags(platform, item_id)
+    return tags
+
+class CacheInvalidator:
+    """
+    Background task that evicts cache entries when their source data changes.
+
+    It follows a database change stream when the deployment supports one
+    (replica sets and Atlas) and otherwise polls the ingest_log watermark.
+    """
+    WATCHED = list(PLATFORMS) + ['review', 'price_history_daily', *DERIVED_COLLECTIONS]
+
+    def __init__(self, db, cache: ResponseCache, poll_seconds: float = CACHE_POLL_SECONDS):
+        self.db = db
+        self.cache = cache
+        self.poll_seconds = poll_seconds
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    # Server error codes meaning the deployment has no change streams
+    NO_CHANGE_STREAMS = (40573, 136)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.follow_change_stream()
+            except OperationFailure as e:
+                if e.code in self.NO_CHANGE_STREAMS:
+                    logging.info(f"Change streams unavailable, polling {INGEST_LOG} instead")
+                    break
+                logging.warning(f"Change stream failed: {e}")
+            except PyMongoError as e:
+                logging.warning(f"Change stream failed: {e}")
+            # Events may have been missed while the stream was down
+            await self.cache.clear()
+            await asyncio.sleep(self.poll_seconds)
+        await self.poll_ingest_log()
+
+    async def follow_change_stream(self) -> None:
+        pipeline = [{'$match': {'ns.coll': {'$in': self.WATCHED}}}]
+        async with await self.db.watch(pipeline, full_document='updateLookup') as stream:
+            async for change in stream:
+                tags = change_tags(change)
+                if tags is None:
+                    await self.cache.clear()
+                elif tags:
+                    await self.cache.invalidate(tags)
+
+    async def poll_ingest_log(self) -> None:
+        latest = await self.db[INGEST_LOG].find_one({}, sort=[('at', -1)])
+        watermark = latest['at'] if latest else datetime.utcnow()
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                entries = await self.db[INGEST_LOG].find({'at': {'$gt': watermark}}).sort('at', 1).to_list()
+            except PyMongoError as e:
+                logging.warning(f"Polling {INGEST_LOG} failed: {e}")
+                continue
+            for entry in entries:
+                await self.cache.invalidate(ingest_log_tags(entry))
+                watermark = entry['at']
@@ -0,0 +1,244 @@
+import gzip
+import os
+import zlib
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # br is only offered when the brotli package is installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is only offered when the zstandard package is installed
+    zstandard = None
+
+# Bodies smaller than this are sent as they are; compressing them costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+# Mid-range levels: close to the best ratio on JSON at a fraction of the CPU
+BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3))
+
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'application/vnd.apache.arrow.stream',
+    'text/',
+)
+
+def available_encodings() -> List[str]:
+    """
+    Supported content codings, most preferred first
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+ENCODINGS = available_encodings()
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the preferred coding the client accepts, honouring q-values
+    """
+    if not accept_encoding:
+        return None
+
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class StreamCompressor:
+    """
+    Incremental compressor that flushes after every chunk so streamed rows reach the client promptly
+    """
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'zstd':
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'zstd':
+            return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'zstd':
+            return self.compressor.flush()
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+def is_compressible(headers: Headers) -> bool:
+    content_type = headers.get('content-type', '')
+    # Event streams must reach the client message by message
+    if content_type.startswith('text/event-stream'):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def weaken_etag(headers: MutableHeaders) -> None:
+    # A strong ETag names exact bytes, which differ once the body is encoded
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = 'W/' + etag
+
+def sent_weak(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """
+    Whether the client revalidates with the weak form of `etag`, i.e. its copy was encoded
+    """
+    if not if_none_match or not etag or etag.startswith('W/'):
+        return False
+    return 'W/' + etag in {candidate.strip() for candidate in if_none_match.split(',')}
+
+def add_vary(headers: MutableHeaders) -> None:
+    vary = headers.get('vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['Vary'] = vary + ', Accept-Encoding'
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing JSON, NDJSON and Arrow responses.
+
+    Complete bodies above the size threshold are compressed in one go;
+    streamed bodies (the export endpoint) are compressed chunk by chunk.
+    Responses that already carry a Content-Encoding, such as pre-compressed
+    cache entries, are passed through untouched.
+    """
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = negotiate(headers.get('accept-encoding'))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, CompressingSend(send, encoding, self.minimum_size, headers.get('if-none-match')))
+
+class CompressingSend:
+    """
+    Wraps the ASGI `send` of one response, deciding on the first body chunk
+    """
+    def __init__(self, send, encoding: str, minimum_size: int, if_none_match: Optional[str] = None):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.if_none_match = if_none_match
+        self.start_message = None
+        self.compressor: Optional[StreamCompressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message) -> None:
+        if message['type'] == 'http.response.start':
+            # Held back until the first body chunk shows how large the response is
+            self.start_message = message
+            return
+
+        if message['type'] != 'http.response.body':
+            await self.flush_start()
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.start_message is not None:
+            await self.begin(body, more_body)
+            return
+
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        data = self.compressor.compress(body) if body else b''
+        if not more_body:
+            data += self.compressor.finish()
+        await self.send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+    async def flush_start(self) -> None:
+        if self.start_message is not None:
+            message, self.start_message = self.start_message, None
+            await self.send(message)
+
+    async def begin(self, body: bytes, more_body: bool) -> None:
+        start = self.start_message
+        headers = MutableHeaders(raw=start.setdefault('headers', []))
+
+        if 'content-encoding' in headers:
+            weaken_etag(headers)
+            self.passthrough = True
+        elif start['status'] == 304:
+            # Must match the ETag of the client's copy. A 304 has no body to
+            # measure; an ETag names one body, so the copy the client holds
+            # was encoded exactly when it revalidates with the weak form.
+            if sent_weak(self.if_none_match, headers.get('etag')):
+                weaken_etag(headers)
+            add_vary(headers)
+            self.passthrough = True
+        elif (start['status'] < 200 or start['status'] in (204, 304)
+              or not is_compressible(headers)
+              or (not more_body and len(body) < self.minimum_size)):
+            self.passthrough = True
+
+        if self.passthrough:
+            await self.flush_start()
+            await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+            return
+
+        headers['Content-Encoding'] = self.encoding
+        add_vary(headers)
+        weaken_etag(headers)
+
+        if not more_body:
+            data = compress(body, self.encoding)
+            headers['Content-Length'] = str(len(data))
+        else:
+            if 'content-length' in headers:
+                del headers['content-length']
+            self.compressor = StreamCompressor(self.encoding)
+            data = self.compressor.compress(body) if body else b''
+
+        await self.flush_start()
+        await self.send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
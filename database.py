@@ -0,0 +1,31 @@
+import os
+from typing import Sequence
+
+from pymongo import AsyncMongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+
+DATABASE = 'datashop'
+
+# One pool is shared by every request on a worker. Size it for the number of
+# in-flight requests a worker should serve, and make waiters fail fast instead
+# of queueing forever when Mongo is saturated.
+MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 10))
+MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+
+def create_async_client(event_listeners: Sequence = ()) -> AsyncMongoClient:
+    """
+    Create the asyncio MongoDB client used by the FastAPI backends
+    """
+    return AsyncMongoClient(
+        URI,
+        server_api=ServerApi('1'),
+        maxPoolSize=MAX_POOL_SIZE,
+        minPoolSize=MIN_POOL_SIZE,
+        maxIdleTimeMS=MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=list(event_listeners),
+    )
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bson import json_util
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from profiling import current_profile
+
+COLLECTION = 'diagnostics'
+
+# Operations slower than this are explained and recorded
+SLOW_OP_MS = float(os.environ.get('SLOW_OP_MS', 200))
+# The same operation shape is explained at most once per cooldown
+SLOW_OP_COOLDOWN_SECONDS = float(os.environ.get('SLOW_OP_COOLDOWN_SECONDS', 300))
+# Explains waiting to run; further slow ops are dropped while it is full
+MAX_PENDING = 100
+
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct'}
+
+# Session, cluster and API fields the driver adds; explain rejects or ignores them
+DRIVER_FIELDS = {
+    'lsid', '$db', '$clusterTime', 'txnNumber', 'autocommit', 'startTransaction',
+    '$readPreference', 'readConcern', 'apiVersion', 'apiStrict', 'apiDeprecationErrors', 'cursor',
+}
+
+# Capped: only recent plans matter
+COLLECTION_OPTIONS = {'capped': True, 'size': 64 * 1024 * 1024}
+
+def operation_shape(command_name: str, command: Dict[str, Any]) -> Tuple:
+    """
+    What makes two operations "the same" for deduplication: collection,
+    command and the fields or stages involved, not their values
+    """
+    collection = command.get(command_name)
+    if command_name == 'aggregate':
+        stages = tuple(next(iter(stage), '') for stage in command.get('pipeline', []))
+        return (command_name, collection, stages)
+    query = command.get('filter') or command.get('query') or {}
+    return (command_name, collection, tuple(sorted(query)), tuple(sorted(command.get('sort') or {})))
+
+def walk(node: Any) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield every (key, value) pair of a nested explain document
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield key, value
+            yield from walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from walk(value)
+
+def outermost(node: Any, name: str) -> Iterator[Any]:
+    """
+    Yield `name` from the shallowest documents holding it; totals nested
+    below (per shard, per input stage) are already part of those
+    """
+    if isinstance(node, dict):
+        if name in node:
+            yield node[name]
+            return
+        node = list(node.values())
+    if isinstance(node, list):
+        for value in node:
+            yield from outermost(value, name)
+
+def summarize_explain(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pull the figures that matter out of an executionStats explain.
+
+    Plans differ between find, aggregate, the classic engine and SBE, so the
+    whole document is walked instead of following one layout.
+    """
+    plan_stages, pipeline_stages, indexes = set(), [], set()
+    returned = None
+    for key, value in walk(explain):
+        if key == 'stage' and isinstance(value, str):
+            plan_stages.add(value)
+        elif key == 'indexName' and isinstance(value, str):
+            indexes.add(value)
+        elif key == 'nReturned' and isinstance(value, int) and returned is None:
+            returned = value
+        elif key == 'stages' and isinstance(value, list):
+            pipeline_stages += [next(iter(stage), '') for stage in value if isinstance(stage, dict)]
+
+    docs_examined = sum(value for value in outermost(explain, 'totalDocsExamined') if isinstance(value, int))
+    keys_examined = sum(value for value in outermost(explain, 'totalKeysExamined') if isinstance(value, int))
+
+    return {
+        'plan_stages': sorted(plan_stages),
+        'pipeline_stages': pipeline_stages,
+        'indexes': sorted(indexes),
+        'docs_examined': docs_examined,
+        'keys_examined': keys_examined,
+        'returned': returned,
+        'collscan': 'COLLSCAN' in plan_stages,
+        # A SORT plan stage, or a $sort the query layer could not absorb
+        'in_memory_sort': 'SORT' in plan_stages or '$sort' in pipeline_stages,
+    }
+
+class SlowOpRecorder(monitoring.CommandListener):
+    """
+    Explains slow reads in the background and stores their plans.
+
+    The listener only remembers commands and queues the slow ones; a task on
+    the API's event loop runs `explain` with executionStats and writes the
+    result, so requests never wait on diagnostics.
+    """
+    def __init__(self, threshold_ms: float = SLOW_OP_MS, cooldown: float = SLOW_OP_COOLDOWN_SECONDS):
+        self.threshold_ms = threshold_ms
+        self.cooldown = cooldown
+        self.client = None
+        self.pending: 'OrderedDict[int, tuple]' = OrderedDict()
+        self.explained: Dict[Tuple, float] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def attach(self, client) -> None:
+        self.client = client
+
+    def started(self, event) -> None:
+        if event.command_name not in EXPLAINABLE or self.queue is None:
+            return
+        profile = current_profile.get()
+        path = profile.path if profile is not None else None
+        self.pending[event.request_id] = (event.database_name, dict(event.command), path)
+        # Commands that never report back must not accumulate
+        while len(self.pending) > 1000:
+            self.pending.popitem(last=False)
+
+    def succeeded(self, event) -> None:
+        started = self.pending.pop(event.request_id, None)
+        if started is None or event.duration_micros / 1000 < self.threshold_ms:
+            return
+
+        database, command, path = started
+        shape = operation_shape(event.command_name, command)
+        now = time.monotonic()
+        if now - self.explained.get(shape, float('-inf')) < self.cooldown:
+            return
+        self.explained[shape] = now
+        try:
+            self.queue.put_nowait((database, event.command_name, command, path, event.duration_micros / 1000))
+        except asyncio.QueueFull:
+            pass
+
+    def failed(self, event) -> None:
+        self.pending.pop(event.request_id, None)
+
+    async def start(self, db) -> None:
+        try:
+            await db.create_collection(COLLECTION, **COLLECTION_OPTIONS)
+        except CollectionInvalid:
+            pass
+        await db[COLLECTION].create_index('at')
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.queue = None
+
+    async def run(self) -> None:
+        while True:
+            database, command_name, command, path, duration_ms = await self.queue.get()
+            try:
+                await self.record(database, command_name, command, path, duration_ms)
+            except PyMongoError as e:
+                logging.warning(f"Explaining slow {command_name} failed: {e}")
+
+    async def record(self, database: str, command_name: str, command: Dict[str, Any],
+                     path: Optional[str], duration_ms: float) -> None:
+        db = self.client[database]
+        explained = {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+        if command_name == 'aggregate':
+            explained['cursor'] = {}
+        explain = await db.command({'explain': explained, 'verbosity': 'executionStats'})
+
+        await db[COLLECTION].insert_one({
+            'at': datetime.utcnow(),
+            'command_name': command_name,
+            'collection': command.get(command_name),
+            'shape': repr(operation_shape(command_name, command)),
+            'path': path,
+            'duration_ms': duration_ms,
+            **summarize_explain(explain),
+            # Stored as Extended JSON: explain output has $-prefixed keys
+            'command': json_util.dumps(explained),
+            'plan': json_util.dumps(explain),
+        })
+
+def report(db, since: datetime, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Group recorded slow operations by shape, worst first
+    """
+    return list(db[COLLECTION].aggregate([
+        {'$match': {'at': {'$gte': since}}},
+        {'$sort': {'at': 1}},
+        {'$group': {
+            '_id': '$shape',
+            'command_name': {'$last': '$command_name'},
+            'collection': {'$last': '$collection'},
+            'paths': {'$addToSet': '$path'},
+            'count': {'$sum': 1},
+            'max_ms': {'$max': '$duration_ms'},
+            'avg_ms': {'$avg': '$duration_ms'},
+            'docs_examined': {'$last': '$docs_examined'},
+            'returned': {'$last': '$returned'},
+            'indexes': {'$last': '$indexes'},
+            'collscan': {'$max': '$collscan'},
+            'in_memory_sort': {'$max': '$in_memory_sort'},
+            'last_seen': {'$last': '$at'},
+        }},
+        {'$sort': {'collscan': -1, 'in_memory_sort': -1, 'max_ms': -1}},
+        {'$limit': limit},
+    ]))
+
+def print_report(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        print("No slow operations recorded")
+        return
+    for row in rows:
+        flags = [flag for flag, on in (('COLLSCAN', row['collscan']), ('IN-MEMORY SORT', row['in_memory_sort'])) if on]
+        print(f"{row['command_name']} {row['collection']}  {' '.join(flags) or 'ok'}")
+        print(f"  shape:    {row['_id']}")
+        print(f"  seen:     {row['count']}x, avg {row['avg_ms']:.0f} ms, max {row['max_ms']:.0f} ms, last {row['last_seen']:%Y-%m-%d %H:%M}")
+        print(f"  examined: {row['docs_examined']} docs for {row['returned']} returned")
+        print(f"  indexes:  {', '.join(row['indexes']) or 'none'}")
+        print(f"  paths:    {', '.join(path for path in row['paths'] if path) or '-'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report slow MongoDB operations recorded by the API")
+    parser.add_argument('--hours', type=float, default=24, help="Look back this many hours")
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+    print_report(report(db, datetime.utcnow() - timedelta(hours=args.hours), args.limit))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+def make_etag(*parts: Any) -> str:
+    """
+    Build a strong ETag from an endpoint name, its parameters and a version stamp
+    """
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Weak comparison of If-None-Match against the current ETag, as RFC 9110 requires
+    """
+    header: Optional[str] = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = {candidate.strip().removeprefix('W/') for candidate in header.split(',')}
+    return etag in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag})
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers['ETag'] = etag
+    return response
@@ -0,0 +1,140 @@
+import io
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from serialization import dumps
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow IPC export is optional
+    pa = None
+
+# Documents pulled from the cursor per network chunk / Arrow record batch
+CHUNK_SIZE = 500
+
+# Flat per-snapshot record shared by all platforms
+CANONICAL_FIELDS = [
+    'platform', 'item_id', 'title', 'brand', 'price', 'stock',
+    'rating', 'review_count', 'scraped_timestamp',
+]
+
+CANONICAL_PROJECTIONS = {
+    'lazada': {
+        'item_id': '$responseBody.itemId',
+        'title': '$responseBody.title',
+        'brand': '$responseBody.brandName',
+        'price': {'$arrayElemAt': ['$responseBody.skus.salePrice', 0]},
+        'stock': {'$arrayElemAt': ['$responseBody.skus.stock', 0]},
+        'rating': '$responseBody.ratingAverage',
+        'review_count': '$responseBody.reviewCount',
+    },
+    'shopee': {
+        'item_id': '$responseBody.data.item.item_id',
+        'title': '$responseBody.data.item.title',
+        'brand': '$responseBody.data.item.brand',
+        'price': {'$divide': ['$responseBody.data.item.price', 100000]},
+        'stock': '$responseBody.data.item.stock',
+        'rating': '$responseBody.data.item.item_rating.rating_star',
+        'review_count': {'$arrayElemAt': ['$responseBody.data.item.item_rating.rating_count', 0]},
+    },
+    'tiki': {
+        'item_id': '$id',
+        'title': '$name',
+        'brand': '$brand.name',
+        'price': '$price',
+        'stock': '$stock_item.qty',
+        'rating': '$rating_average',
+        'review_count': '$review_count',
+    },
+}
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    return [field.strip() for field in fields.split(',') if field.strip()] if fields else []
+
+def canonical_pipeline(platform: str, since: Optional[datetime], fields: List[str]) -> List[Dict[str, Any]]:
+    """
+    Project snapshots into canonical records, oldest first so `since` can resume a load.
+
+    `since` is exclusive: passing the last timestamp received does not send that record again.
+    """
+    match = {'scraped_timestamp': {'$gt': since}} if since else {}
+    project = {'_id': 0, 'platform': {'$literal': platform}, 'scraped_timestamp': 1, **CANONICAL_PROJECTIONS[platform]}
+    if fields:
+        project = {'_id': 0, **{field: project[field] for field in fields if field in project}}
+    return [
+        {'$match': match},
+        {'$sort': {'scraped_timestamp': 1}},
+        {'$project': project},
+    ]
+
+def document_query(since: Optional[datetime], fields: List[str]) -> Dict[str, Any]:
+    """
+    Filter and projection for raw document export, exclusive of `since` like canonical_pipeline
+    """
+    return {
+        'filter': {'scraped_timestamp': {'$gt': since}} if since else {},
+        'projection': {field: 1 for field in fields} or None,
+        'sort': [('scraped_timestamp', 1)],
+    }
+
+async def ndjson_stream(cursor) -> AsyncIterator[bytes]:
+    """
+    Encode cursor documents as newline-delimited JSON, a chunk of lines at a time
+    """
+    lines = []
+    try:
+        async for document in cursor:
+            lines.append(dumps(document))
+            if len(lines) >= CHUNK_SIZE:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+    finally:
+        # Also reached when the client disconnects mid-stream
+        await cursor.close()
+
+def arrow_schema(fields: List[str]):
+    types = {
+        'platform': pa.string(),
+        'item_id': pa.int64(),
+        'title': pa.string(),
+        'brand': pa.string(),
+        'price': pa.float64(),
+        'stock': pa.float64(),
+        'rating': pa.float64(),
+        'review_count': pa.int64(),
+        'scraped_timestamp': pa.timestamp('us'),
+    }
+    return pa.schema([(field, types[field]) for field in (fields or CANONICAL_FIELDS) if field in types])
+
+async def arrow_stream(cursor, fields: List[str]) -> AsyncIterator[bytes]:
+    """
+    Encode canonical records as an Arrow IPC stream, one record batch per chunk
+    """
+    schema = arrow_schema(fields)
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield drain()
+
+    rows = []
+    try:
+        async for record in cursor:
+            rows.append(record)
+            if len(rows) >= CHUNK_SIZE:
+                writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+                rows = []
+                yield drain()
+        if rows:
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+        writer.close()
+        yield drain()
+    finally:
+        await cursor.close()
@@ -9,6 +9,11 @@ import sqlite3
 import matplotlib.pyplot as plt
 from datetime import datetime
 import os
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+import sketches
 
 
 @asset
@@ -20,11 +25,27 @@ def get_sales_data():
     df['scraped_timestamp'] = pd.to_datetime(df['scraped_timestamp'])
     return df
 
+def sketch_histograms(df, bins):
+    """Histogram bins per field from the sketches kept at ingest, instead of the full columns,
+    over the platforms and days in df so they match the plots drawn from fact_sales"""
+    scope = sketches.scope(df['platform'], df['scraped_timestamp'].min(), df['scraped_timestamp'].max())
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    try:
+        return {field: sketches.distribution(client['datashop'], field, bins=count, **scope)['overall']['histogram']
+                for field, count in bins.items()}
+    finally:
+        client.close()
+
+def plot_histogram(histogram, **kwargs):
+    plt.bar([bucket['min'] for bucket in histogram], [bucket['count'] for bucket in histogram],
+            width=[bucket['max'] - bucket['min'] for bucket in histogram], align='edge', **kwargs)
+
 @asset(deps=[get_sales_data])
 def create_plots():
     """Generate analysis plots"""
     df = get_sales_data()
     plot_files = {}
+    histograms = sketch_histograms(df, {'rating': 20, 'price': 30})
     
     # Platform distribution
     # Phân bố nền tảng
@@ -41,10 +62,10 @@ def create_plots():
 
     # Phân bố điểm đánh giá
     plt.figure(figsize=(10, 7))
-    df['rating'].plot(kind='hist', bins=20, 
-                        color='#66b3ff', 
-                        edgecolor='black',
-                        title="Phân Bố Điểm Đánh Giá Sản Phẩm")
+    plot_histogram(histograms['rating'],
+                   color='#66b3ff',
+                   edgecolor='black')
+    plt.title("Phân Bố Điểm Đánh Giá Sản Phẩm")
     plt.xlabel('Điểm Đánh Giá')
     plt.ylabel('Số Lượng Sản Phẩm')
     plt.tight_layout()
@@ -54,10 +75,10 @@ def create_plots():
 
     # Phân phối giá
     plt.figure(figsize=(10, 7))
-    df['salePrice'].plot(kind='hist', bins=30, 
-                            color='#99ff99', 
-                            edgecolor='black',
-                            title="Phân Phối Giá Sản Phẩm")
+    plot_histogram(histograms['price'],
+                   color='#99ff99',
+                   edgecolor='black')
+    plt.title("Phân Phối Giá Sản Phẩm")
     plt.xlabel('Giá Sản Phẩm (VNĐ)')
     plt.ylabel('Số Lượng Sản Phẩm')
     plt.tight_layout()
@@ -67,7 +88,8 @@ def create_plots():
 
     # Price distribution
     plt.figure(figsize=(8, 6))
-    df['salePrice'].plot(kind='hist', bins=30, title="Phân phối giá sản phẩm")
+    plot_histogram(histograms['price'])
+    plt.title("Phân phối giá sản phẩm")
     plt.xlabel('Price')
     plt.savefig('price_dist.png')
     plt.close()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+from pymongo import ASCENDING
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from cache import ensure_ingest_log, record_ingest
+from platforms import ITEM_ID_FIELDS, PLATFORMS, get_item_id, parse_timestamp
+import matching
+import price_changes
+import price_history_daily
+import price_points
+import registry
+import reviews
+import search
+import sketches
+
+def prepare_snapshot(document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize a scraped snapshot before it is written to MongoDB
+    """
+    if 'scraped_timestamp' in document:
+        document['scraped_timestamp'] = parse_timestamp(document['scraped_timestamp'])
+    return document
+
+def ensure_indexes(db) -> None:
+    """
+    Create the indexes that back item lookups and date-range queries
+    """
+    for platform, id_field in ITEM_ID_FIELDS.items():
+        db[platform].create_index([(id_field, ASCENDING), ('scraped_timestamp', ASCENDING)])
+        db[platform].create_index([('scraped_timestamp', ASCENDING)])
+
+def ensure_collections(db) -> None:
+    """
+    Create every collection and index that ingest writes to
+    """
+    ensure_indexes(db)
+    price_points.ensure_collection(db)
+    registry.ensure_collection(db)
+    reviews.ensure_collection(db)
+    search.ensure_collection(db)
+    matching.ensure_collection(db)
+    price_changes.ensure_collection(db)
+    sketches.ensure_collection(db)
+    ensure_ingest_log(db)
+
+def ingest_snapshots(db, platform: str, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Insert snapshots for one platform and return the number written
+    """
+    if platform not in PLATFORMS:
+        raise ValueError(f"Unsupported platform: {platform}")
+
+    batch = [prepare_snapshot(document) for document in documents]
+    if not batch:
+        return 0
+
+    db[platform].insert_many(batch, ordered=False)
+    # Reads the registry's previous prices, so it runs before the registry update
+    price_changes.record_changes(db, platform, batch)
+    registry.record_snapshots(db, platform, batch)
+    price_points.write_price_points(db, platform, batch)
+    search.index_titles(db, platform, batch)
+    matching.match_snapshots(db, platform, batch)
+    if platform == 'lazada':
+        reviews.write_reviews(db, platform, batch)
+    # Reads the stored review totals, so it runs after Lazada's reviews are written
+    sketches.record_snapshots(db, platform, batch)
+    record_ingest(db, platform, [get_item_id(platform, document) for document in batch])
+    return len(batch)
+
+def read_snapshot_files(data_dir: Path) -> List[Dict[str, Any]]:
+    """
+    Load every JSON snapshot saved by `save_data` in a platform folder
+    """
+    documents = []
+    for json_file in sorted(data_dir.glob('*.json')):
+        if not json_file.is_file():
+            continue
+        with open(json_file, 'r', encoding='utf-8') as f:
+            documents.append(json.load(f))
+    return documents
+
+def ingest_reviews(db, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Store Shopee/Tiki review responses and split them into per-review documents
+    """
+    batch = list(documents)
+    if not batch:
+        return 0
+
+    db[reviews.SOURCE_COLLECTION].insert_many(batch, ordered=False)
+    for document in batch:
+        platform = reviews.review_platform(document)
+        if platform is not None:
+            reviews.write_reviews(db, platform, [document])
+    record_ingest(db, 'review', [document.get('id') for document in batch])
+    return len(batch)
+
+def read_review_files(data_dir: Path) -> List[Dict[str, Any]]:
+    """
+    Load review responses named `<platform>_<item id>.json`, tagging each with its item id
+    """
+    documents = []
+    for json_file in sorted(data_dir.glob('*.json')):
+        if not json_file.is_file():
+            continue
+        with open(json_file, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        document.setdefault('id', json_file.stem.split('_')[-1])
+        document['file_name'] = json_file.name
+        documents.append(document)
+    return documents
+
+def ingest_directory(db, platform: str, data_dir: Path, batch_size: int = 500) -> int:
+    """
+    Load a platform (or review) folder into MongoDB in batches
+    """
+    if platform == 'review':
+        documents, ingest = read_review_files(data_dir), ingest_reviews
+    else:
+        documents = read_snapshot_files(data_dir)
+        ingest = lambda db, batch: ingest_snapshots(db, platform, batch)
+
+    total = 0
+    for start in range(0, len(documents), batch_size):
+        total += ingest(db, documents[start:start + batch_size])
+        logging.info(f"Ingested {total}/{len(documents)} {platform} documents from {data_dir}")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Load scraped snapshots into MongoDB")
+    parser.add_argument('platform', choices=PLATFORMS + ('review',),
+                        help="Snapshot collection, or `review` for Shopee/Tiki review responses")
+    parser.add_argument('data_dir', type=Path)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+    ensure_collections(db)
+    ingest_directory(db, args.platform, args.data_dir, args.batch_size)
+    price_history_daily.refresh(db)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""
+Load testing for backendv2: seed MongoDB with generated snapshots, then
+drive the API with a weighted route mix and report per-route throughput
+and latency percentiles.
+
+    python -m loadtest seed --items 2000 --days 90
+    python -m loadtest run --url http://localhost:8000 --concurrency 32 --duration 60
+"""
@@ -0,0 +1,69 @@
+import argparse
+import json
+import logging
+import sys
+
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from database import DATABASE
+from platforms import PLATFORMS
+from loadtest.run import DEFAULT_MIX, ROUTES, format_report, run
+from loadtest.seed import seed
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description="Seed MongoDB and load test backendv2")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help="Ingest generated snapshots")
+    # No default: seeding writes thousands of fake products, so the target is always named
+    seed_parser.add_argument('--uri', required=True,
+                             help="MongoDB to seed, the one the API under test reads (never production)")
+    seed_parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                             help="Platform to seed (repeatable, default: all)")
+    seed_parser.add_argument('--items', type=int, default=1000, help="Generated products, each listed on every platform")
+    seed_parser.add_argument('--days', type=int, default=30, help="Daily snapshots per listing")
+    seed_parser.add_argument('--batch-size', type=int, default=500)
+    seed_parser.add_argument('--seed', type=int, default=0, help="Random seed")
+
+    run_parser = commands.add_parser('run', help="Drive the API and report latency per route")
+    run_parser.add_argument('--url', default='http://localhost:8000')
+    run_parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f"Weighted routes, `name=weight,...` from: {', '.join(ROUTES)}")
+    run_parser.add_argument('--concurrency', type=int, default=16, help="Clients with one request in flight each")
+    run_parser.add_argument('--duration', type=float, default=30, help="Measured seconds")
+    run_parser.add_argument('--warmup', type=float, default=5, help="Unmeasured seconds before the measurement")
+    run_parser.add_argument('--timeout', type=float, default=30)
+    run_parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    run_parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    run_parser.add_argument('--max-p95', type=float,
+                            help="Exit with status 1 if any route's p95 exceeds this many ms")
+    run_parser.add_argument('--max-error-rate', type=float, default=0.01,
+                            help="Exit with status 1 if any route's error rate exceeds this fraction")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    if args.command == 'seed':
+        client = MongoClient(args.uri, server_api=ServerApi('1'))
+        seed(client[DATABASE], args.platform or PLATFORMS, args.items, args.days, args.batch_size,
+             random_seed=args.seed)
+        return
+
+    rows = run(args.url, args.mix, args.concurrency, args.duration, args.warmup, args.timeout, args.seed)
+    print(json.dumps(rows, indent=2) if args.json else format_report(rows))
+
+    failed = [
+        route for route, row in rows.items()
+        if (args.max_p95 is not None and row['p95_ms'] > args.max_p95)
+        or row['errors'] > args.max_error_rate * row['requests']
+    ]
+    if failed:
+        logging.error(f"Thresholds exceeded for: {', '.join(sorted(failed))}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from platforms import PLATFORMS
+
+DEFAULT_MIX = 'product=40,price-history=25,reviews=15,products=10,search=8,summary=2'
+SEARCH_TERMS = ('iphone', 'macbook', 'tivi', 'laptop', 'may giat', 'dien thoai', 'pc', 'samsung')
+# Ids sampled per platform to spread requests over
+SAMPLE_SIZE = 1000
+
+# Request = (method, path, query parameters, JSON body)
+Request = Tuple[str, str, Optional[Dict[str, Any]], Optional[Any]]
+Ids = Dict[str, List[Any]]
+
+def random_item(rng: random.Random, ids: Ids) -> Tuple[str, Any]:
+    platform = rng.choice([platform for platform in ids if ids[platform]])
+    return platform, rng.choice(ids[platform])
+
+def product_request(rng: random.Random, ids: Ids) -> Request:
+    platform, item_id = random_item(rng, ids)
+    return 'GET', f'/product/{platform}/{item_id}', None, None
+
+def price_history_request(rng: random.Random, ids: Ids) -> Request:
+    platform, item_id = random_item(rng, ids)
+    return 'GET', f'/price-history/{platform}/{item_id}', None, None
+
+def reviews_request(rng: random.Random, ids: Ids) -> Request:
+    platform, item_id = random_item(rng, ids)
+    return 'GET', f'/product-reviews/{platform}/{item_id}', None, None
+
+def products_request(rng: random.Random, ids: Ids) -> Request:
+    return 'GET', f'/products/{rng.choice(PLATFORMS)}', {'limit': 100}, None
+
+def search_request(rng: random.Random, ids: Ids) -> Request:
+    return 'GET', '/search', {'q': rng.choice(SEARCH_TERMS)}, None
+
+def summary_request(rng: random.Random, ids: Ids) -> Request:
+    return 'GET', '/analytics/summary', None, None
+
+def batch_request(rng: random.Random, ids: Ids) -> Request:
+    items = [random_item(rng, ids) for _ in range(20)]
+    return 'POST', '/products/batch', None, {'items': [{'platform': p, 'id': i} for p, i in items]}
+
+# Route names usable in --mix
+ROUTES: Dict[str, Callable[[random.Random, Ids], Request]] = {
+    'product': product_request,
+    'price-history': price_history_request,
+    'reviews': reviews_request,
+    'products': products_request,
+    'search': search_request,
+    'summary': summary_request,
+    'batch': batch_request,
+}
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parse `route=weight,...` into relative weights
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in ROUTES:
+            raise ValueError(f"Unknown route {name!r}, use: {', '.join(ROUTES)}")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("The mix needs at least one route with a positive weight")
+    return weights
+
+def discover_ids(session: requests.Session, base_url: str) -> Ids:
+    """
+    Sample item ids from the API's own listings
+    """
+    ids = {}
+    for platform in PLATFORMS:
+        response = session.get(f'{base_url}/products/{platform}', params={'limit': SAMPLE_SIZE})
+        if response.status_code == 404:
+            ids[platform] = []
+            continue
+        response.raise_for_status()
+        ids[platform] = response.json()['product_ids']
+    if not any(ids.values()):
+        raise ValueError(f"{base_url} lists no products; seed the database first")
+    return ids
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+class Recorder:
+    """
+    Latencies and errors per route, shared by the worker threads
+    """
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, route: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        rows = {}
+        with self.lock:
+            series = {route: sorted(values) for route, values in self.latencies.items()}
+            series['all'] = sorted(value for values in self.latencies.values() for value in values)
+            errors = dict(self.errors, all=sum(self.errors.values()))
+        for route, ordered in series.items():
+            rows[route] = {
+                'requests': len(ordered),
+                'errors': errors.get(route, 0),
+                'rps': len(ordered) / elapsed,
+                'p50_ms': percentile(ordered, 0.50) * 1000,
+                'p95_ms': percentile(ordered, 0.95) * 1000,
+                'p99_ms': percentile(ordered, 0.99) * 1000,
+                'max_ms': (ordered[-1] if ordered else float('nan')) * 1000,
+            }
+        return rows
+
+def worker(base_url: str, ids: Ids, weights: Dict[str, float], deadline: float, warmup_until: float,
+           recorder: Recorder, seed: int, timeout: float) -> None:
+    """
+    Closed loop: one request in flight per worker until the deadline
+    """
+    rng = random.Random(seed)
+    names, relative = list(weights), list(weights.values())
+    with requests.Session() as session:
+        # Accept compressed bodies like a browser would
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        while time.monotonic() < deadline:
+            route = rng.choices(names, weights=relative)[0]
+            method, path, params, body = ROUTES[route](rng, ids)
+            started = time.perf_counter()
+            try:
+                # Not streamed, so the body is downloaded before request() returns and is part of the latency
+                response = session.request(method, base_url + path, params=params, json=body, timeout=timeout)
+                ok = response.status_code < 500
+            except requests.RequestException:
+                ok = False
+            if time.monotonic() >= warmup_until:
+                recorder.record(route, time.perf_counter() - started, ok)
+
+def run(base_url: str, mix: str = DEFAULT_MIX, concurrency: int = 16, duration: float = 30,
+        warmup: float = 5, timeout: float = 30, seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """
+    Drive the API with `concurrency` closed-loop clients and report per-route latency
+    """
+    base_url = base_url.rstrip('/')
+    weights = parse_mix(mix)
+    with requests.Session() as session:
+        ids = discover_ids(session, base_url)
+
+    recorder = Recorder()
+    started = time.monotonic()
+    warmup_until = started + warmup
+    deadline = warmup_until + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(worker, base_url, ids, weights, deadline, warmup_until, recorder, seed + number, timeout)
+            for number in range(concurrency)
+        ]
+        for future in futures:
+            future.result()
+    # Measured window: workers finish their last request after the deadline
+    return recorder.summary(time.monotonic() - warmup_until)
+
+def format_report(rows: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'route':<15}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"]
+    for route in sorted(rows, key=lambda route: (route == 'all', route)):
+        row = rows[route]
+        lines.append(
+            f"{route:<15}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,17 @@
+import logging
+from datetime import datetime
+from typing import Dict, Sequence
+
+import synthetic
+
+def seed(db, platforms: Sequence[str], items: int, days: int, batch_size: int = 500,
+         random_seed: int = 0) -> Dict[str, int]:
+    """
+    Ingest generated snapshots and reviews through the normal ingest path,
+    so every derived collection (registry, price points, search, matches,
+    reviews) is populated as in production
+    """
+    records = synthetic.generate(platforms, items, days, datetime.now().replace(microsecond=0), random_seed)
+    written = synthetic.write_mongo(db, records, batch_size)
+    logging.info(f"Seeded {', '.join(f'{count} {name}' for name, count in sorted(written.items()))}")
+    return written
@@ -5,6 +5,8 @@ import json
 from pathlib import Path
 
 from config import *
+import ingest
+import price_history_daily
 
 uri = URI
 
@@ -22,7 +24,7 @@ client = MongoClient(uri, server_api=ServerApi('1'))
 # # ----- Check collections in the Database -----
 # print(client['datashop'].list_collection_names())
 db = client['datashop']
-collection = db['shopee']
+platform = 'shopee'
 # Loading or Opening the json file
 # with open('./data/shopee/5873954476_2024-11-14.json', 'r', encoding='utf-8') as file:
 #     data = json.load(file)
@@ -30,14 +32,18 @@ collection = db['shopee']
 
 data_dir = Path(r'D:\FIA1471\data\shopee')
 
+# Through ingest, so price points, the registry, search, matching, sketches
+# and the change feed are written along with the snapshots
+ingest.ensure_collections(db)
 for json_file in data_dir.glob('*.json'):
     if json_file.is_file():
         with open(json_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            collection.insert_one(data)
+            ingest.ingest_snapshots(db, platform, [data])
             print(f'Inserted data from {json_file.name} into MongoDB.')
     else:
         print(f'Tệp {json_file.name} không tồn tại hoặc không phải là tệp thông thường.')
+price_history_daily.refresh(db)
 
 
 #     # Insert data and get the result
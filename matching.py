@@ -0,0 +1,378 @@
+import argparse
+import hashlib
+import logging
+import os
+import random
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from platforms import BRAND_FIELDS, PLATFORMS, get_brand, get_item_id, get_title, parse_timestamp
+from price_points import SNAPSHOT_PROJECTIONS, primary_point
+import search
+
+COLLECTION = 'product_matches'
+
+# 20 bands of 3 rows: titles with Jaccard similarity 0.5 become candidates
+# with probability ~0.93, 0.6 ~0.99, at 0.2 only ~0.15
+NUM_PERM = 60
+BANDS = 20
+ROWS = NUM_PERM // BANDS
+# Estimated Jaccard similarity a candidate needs to join a group. The same
+# product on two platforms scores 0.6-1.0 once titles are normalized;
+# different products of one brand stay under 0.2 unless their specs
+# conflict, which rules the pair out whatever the score
+MATCH_THRESHOLD = float(os.environ.get('MATCH_THRESHOLD', 0.5))
+# Bumped whenever features or bands change, so reruns re-sign unchanged titles
+FEATURES_VERSION = 2
+
+# Universal hashes (a * x + b) mod p standing in for random permutations;
+# seeded so signatures stay comparable across runs
+MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20241118)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+# Listing boilerplate and product-type words shared by unrelated products
+STOP_WORDS = {
+    'hang', 'chinh', 'vn', 'vna', 'a', 'moi', 'nguyen', 'seal', 'bao', 'hanh', 'thang',
+    'phan', 'phoi', 'boi', 'mien', 'phi', 'van', 'chuyen', 'toan', 'quoc', 'freeship', 'gia', 're',
+    'tot', 'chat', 'luong', 'cao', 'nhap', 'khau', 'official', 'store', 'chuan', 'the', 'va', 'cho',
+    'da', 'kich', 'hoat', 'dien', 'tu', 'thoai', 'may', 'tinh', 'xach', 'tay', 'chip', 'ssd', 'ram',
+    'lazada', 'shopee', 'tiki', 'laptop', 'tivi', 'smart', 'tai', 'nghe',
+}
+IGNORED_BRANDS = {'', 'no brand', 'oem', 'khac'}
+
+# Bracketed promotion tags, "(Sale Tết từ 20H 05.01)" or "[DUY NHẤT 26-28.11]";
+# brackets without these words ("(2020)", "(4GB/128GB)") are part of the name
+BRACKETED = re.compile(r'[\[(]([^\[\]()]*)[\])]')
+PROMO_WORDS = {'sale', 'sieu', 'duy', 'tet', 'tiec', 'giang', 'brand', 'day', 'blackfriday', 'blackfirday',
+               'freeship', 'tang', 'qua', 'giam', 'san', 'deal', 'flash', 'voucher', 'mua'}
+# "Bảo hành 12 tháng" would otherwise read as a model number
+WARRANTY = re.compile(r'\bbao hanh (?:\w+ )?\d+ thang\b')
+# "13.3" would fold to two words
+DECIMAL = re.compile(r'(\d)[.,](\d)')
+UNITS = {'inch': 'inch', 'inches': 'inch', 'kg': 'kg', 'hp': 'hp', 'w': 'w', 'mah': 'mah', 'hz': 'hz', 'l': 'l'}
+UNIT = re.compile(r'\b(\d+(?:p\d+)?) (' + '|'.join(UNITS) + r')\b')
+# Storage and memory name a variant (SKU) of a listing, not a different product
+CAPACITY = re.compile(r'^\d+(?:p\d+)?(?:gb|tb|mb|g)$')
+YEAR = re.compile(r'^(?:19|20)\d\d$')
+NUMBER = re.compile(r'^\d+(?:p\d+)?$')
+MEASURE = re.compile(r'^(\d+)(?:p\d+)?(' + '|'.join(sorted(set(UNITS.values()))) + r')$')
+
+def normalize_brand(brand: Optional[str]) -> Optional[str]:
+    folded = search.fold(brand)
+    return None if folded in IGNORED_BRANDS else folded
+
+def strip_promotions(title: str) -> str:
+    def replace(match: re.Match) -> str:
+        words = search.fold(match.group(1)).split()
+        return ' ' if any(word in PROMO_WORDS for word in words) else f" {match.group(1)} "
+    return BRACKETED.sub(replace, title)
+
+def title_words(title: str, brand: Optional[str]) -> List[str]:
+    """
+    Fold a title to the words that name the product.
+
+    Promotion tags, boilerplate, the brand (matched on its own) and
+    storage/memory sizes are dropped; "13.3-inch" becomes "13p3inch".
+    """
+    folded = search.fold(DECIMAL.sub(r'\1p\2', strip_promotions(title)))
+    folded = WARRANTY.sub(' ', folded)
+    folded = UNIT.sub(lambda match: match.group(1) + UNITS[match.group(2)], folded)
+    brand_words = set((normalize_brand(brand) or '').split())
+    return [word for word in folded.split()
+            if word not in STOP_WORDS and word not in brand_words and not CAPACITY.match(word)]
+
+def spec_class(word: str) -> Optional[str]:
+    """
+    Kind of a spec token: year, bare number, measure (by unit) or model code
+    """
+    if not any(char.isdigit() for char in word):
+        return None
+    if YEAR.match(word):
+        return 'year'
+    if NUMBER.match(word):
+        return 'number'
+    measure = MEASURE.match(word)
+    if measure:
+        return measure.group(2)
+    return 'code'
+
+def specs(words: Iterable[str]) -> Dict[str, Set[str]]:
+    classes: Dict[str, Set[str]] = {}
+    for word in words:
+        kind = spec_class(word)
+        if kind is None:
+            continue
+        if kind not in ('year', 'number', 'code'):
+            # Sizes are rounded differently per listing: 13 inch and 13.3 inch are one screen
+            word = MEASURE.match(word).group(1)
+        classes.setdefault(kind, set()).add(word)
+    return classes
+
+def same_spec(first: str, second: str) -> bool:
+    # Model codes often carry a regional suffix: UA65DU8000 vs UA65DU8000KXXV
+    return first == second or (min(len(first), len(second)) >= 5 and
+                               (first.startswith(second) or second.startswith(first)))
+
+def specs_conflict(first: Dict[str, Set[str]], second: Dict[str, Set[str]]) -> bool:
+    """
+    Whether two titles name different models: both give a spec of the same
+    kind and no value is shared (iPhone 15 vs 16, M1 vs M2, 55 vs 65 inch).
+    A spec only one title gives does not count against the match.
+    """
+    return any(
+        kind in second and not any(same_spec(value, other) for value in values for other in second[kind])
+        for kind, values in first.items()
+    )
+
+def features(words: List[str], brand: Optional[str]) -> Set[str]:
+    """
+    Shingle a title's words, weighting spec tokens and brand.
+
+    Tokens containing digits (m1, 15, 13p3inch, fv1410s4w1) are added a
+    second time under a `spec:` prefix since they tell models apart.
+    """
+    shingles = set(words)
+    shingles.update(f"spec:{word}" for word in words if any(char.isdigit() for char in word))
+    brand = normalize_brand(brand)
+    if brand:
+        shingles.add(f"brand:{brand}")
+    return shingles
+
+def stable_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def signature(shingles: Set[str]) -> Optional[List[int]]:
+    """
+    MinHash signature: the minimum of each hash function over the shingles
+    """
+    if not shingles:
+        return None
+    hashes = [stable_hash(shingle) for shingle in shingles]
+    return [min((a * value + b) % MERSENNE_PRIME for value in hashes) for a, b in PERMUTATIONS]
+
+def band_keys(sig: List[int]) -> List[str]:
+    """
+    LSH bucket keys; items sharing any key are compared
+    """
+    keys = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(repr(rows).encode('ascii'), digest_size=8).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+def similarity(first: List[int], second: List[int]) -> float:
+    """
+    Estimated Jaccard similarity of two signatures
+    """
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_PERM
+
+def ensure_collection(db) -> None:
+    db[COLLECTION].create_index('bands')
+    db[COLLECTION].create_index('global_id')
+    db[COLLECTION].create_index([('platform', ASCENDING), ('item_id', ASCENDING)], unique=True)
+
+def match_key(platform: str, item_id) -> str:
+    return f"{platform}:{item_id}"
+
+def assign(item: Dict[str, Any], candidates: Iterable[Dict[str, Any]]) -> Optional[str]:
+    """
+    Global id of the most similar candidate of the same brand whose specs
+    do not conflict with the item's, if it is similar enough
+    """
+    brand_key = normalize_brand(item['brand'])
+    item_specs = specs(title_words(item['title'], item['brand']))
+    best, best_score = None, MATCH_THRESHOLD
+    for candidate in candidates:
+        candidate_brand = normalize_brand(candidate.get('brand'))
+        if brand_key and candidate_brand and brand_key != candidate_brand:
+            continue
+        score = similarity(item['signature'], candidate['signature'])
+        if score < best_score:
+            continue
+        if specs_conflict(item_specs, specs(title_words(candidate.get('title') or '', candidate.get('brand')))):
+            continue
+        best, best_score = candidate, score
+    return best['global_id'] if best is not None else None
+
+def match_items(db, platform: str, items: Dict[Any, Tuple[str, Optional[str]]]) -> int:
+    """
+    Assign each item to the group of its most similar candidate, or start a new group.
+
+    Items whose title and brand did not change keep their global id. The
+    batch costs one read of the existing assignments, one read of every
+    candidate sharing a band with any item, and one bulk write per collection.
+    """
+    keys = {match_key(platform, item_id): item_id for item_id in items}
+    existing = {
+        document['_id']: document
+        for document in db[COLLECTION].find(
+            {'_id': {'$in': list(keys)}}, {'title': 1, 'brand': 1, 'global_id': 1, 'version': 1}
+        )
+    }
+
+    kept, pending = 0, []
+    for key, item_id in keys.items():
+        title, brand = items[item_id]
+        current = existing.get(key, {})
+        if (current.get('global_id') and current.get('title') == title and current.get('brand') == brand
+                and current.get('version') == FEATURES_VERSION):
+            kept += 1
+            continue
+        sig = signature(features(title_words(title, brand), brand))
+        if sig is None:
+            continue
+        pending.append({'_id': key, 'item_id': item_id, 'title': title, 'brand': brand,
+                        'signature': sig, 'bands': band_keys(sig)})
+
+    # Candidates by band; items assigned earlier in the batch are added as they go
+    buckets: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    if pending:
+        for candidate in db[COLLECTION].find(
+            {'bands': {'$in': sorted({band for item in pending for band in item['bands']})},
+             'global_id': {'$exists': True}},
+            {'title': 1, 'brand': 1, 'signature': 1, 'bands': 1, 'global_id': 1}
+        ):
+            for band in candidate.get('bands') or []:
+                buckets.setdefault(band, {})[candidate['_id']] = candidate
+
+    matches, search_updates = [], []
+    matched_at = datetime.utcnow()
+    for item in pending:
+        candidates = {
+            candidate['_id']: candidate
+            for band in item['bands']
+            for candidate in buckets.get(band, {}).values()
+            if candidate['_id'] != item['_id']
+        }
+        global_id = (assign(item, candidates.values())
+                     or existing.get(item['_id'], {}).get('global_id')
+                     or str(ObjectId()))
+        item['global_id'] = global_id
+        for band in item['bands']:
+            buckets.setdefault(band, {})[item['_id']] = item
+
+        matches.append(UpdateOne(
+            {'_id': item['_id']},
+            {'$set': {
+                'platform': platform,
+                'item_id': item['item_id'],
+                'title': item['title'],
+                'brand': item['brand'],
+                'signature': item['signature'],
+                'bands': item['bands'],
+                'global_id': global_id,
+                'version': FEATURES_VERSION,
+                'matched_at': matched_at,
+            }},
+            upsert=True
+        ))
+        # Lets /search results link straight to /compare
+        search_updates.append(UpdateOne({'_id': item['_id']}, {'$set': {'global_id': global_id}}))
+
+    if matches:
+        db[COLLECTION].bulk_write(matches, ordered=False)
+        db[search.COLLECTION].bulk_write(search_updates, ordered=False)
+    return kept + len(pending)
+
+def price_update(platform: str, document: Dict[str, Any]) -> Optional[UpdateOne]:
+    """
+    Record the current price of an item, keeping the one from its newest snapshot
+    """
+    point = primary_point(platform, document)
+    if point is None:
+        return None
+
+    newer = {'$gte': [point['timestamp'], {'$ifNull': ['$scraped_timestamp', datetime.min]}]}
+    fields = {'price': point['price'], 'stock': point['stock'], 'scraped_timestamp': point['timestamp']}
+    item_id = point['meta']['item_id']
+    return UpdateOne(
+        {'_id': match_key(platform, item_id)},
+        [{'$set': {
+            'platform': {'$literal': platform},
+            'item_id': {'$literal': item_id},
+            **{name: {'$cond': [newer, {'$literal': value}, f'${name}']} for name, value in fields.items()},
+        }}],
+        upsert=True
+    )
+
+def match_snapshots(db, platform: str, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Match the items of freshly ingested snapshots and record their current prices
+    """
+    latest: Dict[Any, Dict[str, Any]] = {}
+    operations = []
+    for document in documents:
+        operation = price_update(platform, document)
+        if operation is not None:
+            operations.append(operation)
+
+        item_id = get_item_id(platform, document)
+        timestamp = parse_timestamp(document.get('scraped_timestamp'))
+        if item_id is None or not isinstance(timestamp, datetime):
+            continue
+        current = latest.get(item_id)
+        if current is None or parse_timestamp(current.get('scraped_timestamp')) <= timestamp:
+            latest[item_id] = document
+
+    if operations:
+        db[COLLECTION].bulk_write(operations, ordered=False)
+
+    items = {}
+    for item_id, document in latest.items():
+        title = get_title(platform, document)
+        if title:
+            items[item_id] = (title, get_brand(platform, document))
+    return match_items(db, platform, items) if items else 0
+
+def backfill(db, platform: str, batch_size: int = 500) -> int:
+    """
+    Match every item already stored; unchanged items are skipped on reruns
+    """
+    ensure_collection(db)
+    projection = {**SNAPSHOT_PROJECTIONS[platform], **search.TITLE_PROJECTIONS[platform], BRAND_FIELDS[platform]: 1}
+    matched = 0
+    batch = []
+    for document in db[platform].find({}, projection, batch_size=batch_size).sort('scraped_timestamp', 1):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            matched += match_snapshots(db, platform, batch)
+            logging.info(f"{platform}: {matched} items matched")
+            batch = []
+    matched += match_snapshots(db, platform, batch)
+    logging.info(f"{platform}: matching finished, {matched} items matched")
+    return matched
+
+def main():
+    parser = argparse.ArgumentParser(description="Link the same product across platforms with MinHash/LSH")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Snapshot collection to match (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Forget every assignment first; global ids are reissued")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    if args.rebuild:
+        db[COLLECTION].drop()
+        db[search.COLLECTION].update_many({}, {'$unset': {'global_id': ''}})
+
+    for platform in args.platform or PLATFORMS:
+        backfill(db, platform, args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import logging
+import time
+
+from pymongo import UpdateOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from ingest import ensure_indexes
+from platforms import PLATFORMS, parse_timestamp
+
+MIGRATION_NAME = 'scraped_timestamp_to_date'
+
+def checkpoint_id(platform: str) -> str:
+    return f"{MIGRATION_NAME}:{platform}"
+
+def migrate_platform(db, platform: str, batch_size: int = 1000, pause: float = 0.0, restart: bool = False) -> int:
+    """
+    Convert string scraped_timestamp values of one collection into BSON dates.
+
+    Documents are visited in _id order and the last converted _id is stored
+    in the `migrations` collection after every batch, so an interrupted run
+    resumes where it stopped. Each update is guarded on the original string
+    value, which keeps the migration safe while ingest keeps writing.
+    """
+    collection = db[platform]
+    checkpoints = db['migrations']
+
+    if restart:
+        checkpoints.delete_one({'_id': checkpoint_id(platform)})
+
+    checkpoint = checkpoints.find_one({'_id': checkpoint_id(platform)}) or {}
+    if checkpoint.get('done'):
+        logging.info(f"{platform}: already migrated")
+        return 0
+
+    last_id = checkpoint.get('last_id')
+    converted = checkpoint.get('converted', 0)
+
+    query = {'scraped_timestamp': {'$type': 'string'}}
+    remaining = collection.count_documents(query if last_id is None else {**query, '_id': {'$gt': last_id}})
+    logging.info(f"{platform}: {remaining} documents to convert ({converted} converted previously)")
+
+    processed = 0
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query['_id'] = {'$gt': last_id}
+
+        batch = list(
+            collection.find(batch_query, {'scraped_timestamp': 1})
+            .sort('_id', 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+
+        operations = []
+        for document in batch:
+            try:
+                value = parse_timestamp(document['scraped_timestamp'])
+            except ValueError:
+                logging.warning(f"{platform}: unparseable scraped_timestamp on {document['_id']}")
+                continue
+            operations.append(UpdateOne(
+                {'_id': document['_id'], 'scraped_timestamp': document['scraped_timestamp']},
+                {'$set': {'scraped_timestamp': value}}
+            ))
+
+        if operations:
+            result = collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]['_id']
+        processed += len(batch)
+        checkpoints.update_one(
+            {'_id': checkpoint_id(platform)},
+            {'$set': {'last_id': last_id, 'converted': converted, 'done': False}},
+            upsert=True
+        )
+        logging.info(f"{platform}: {processed}/{remaining} ({processed * 100 // max(remaining, 1)}%)")
+
+        if pause:
+            time.sleep(pause)
+
+    checkpoints.update_one(
+        {'_id': checkpoint_id(platform)},
+        {'$set': {'done': True, 'converted': converted}},
+        upsert=True
+    )
+    logging.info(f"{platform}: finished, {converted} documents converted")
+    return converted
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert scraped_timestamp strings to BSON dates")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Collection to migrate (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--pause', type=float, default=0.0,
+                        help="Seconds to sleep between batches to limit load on a live cluster")
+    parser.add_argument('--restart', action='store_true',
+                        help="Ignore saved progress and start from the first document")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    for platform in args.platform or PLATFORMS:
+        migrate_platform(db, platform, args.batch_size, args.pause, args.restart)
+
+    ensure_indexes(db)
+
+if __name__ == "__main__":
+    main()
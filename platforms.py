@@ -0,0 +1,99 @@
+from datetime import datetime
+from typing import Any, Dict, Optional, Union
+
+PLATFORMS = ('lazada', 'shopee', 'tiki')
+
+# Location of the platform item id inside each snapshot collection
+ITEM_ID_FIELDS = {
+    'lazada': 'responseBody.itemId',
+    'shopee': 'responseBody.data.item.item_id',
+    'tiki': 'id',
+}
+
+# Location of the product title inside each snapshot collection
+TITLE_FIELDS = {
+    'lazada': 'responseBody.title',
+    'shopee': 'responseBody.data.item.title',
+    'tiki': 'name',
+}
+
+# Location of the brand name inside each snapshot collection
+BRAND_FIELDS = {
+    'lazada': 'responseBody.brandName',
+    'shopee': 'responseBody.data.item.brand',
+    'tiki': 'brand.name',
+}
+
+# Location of the category id inside each snapshot collection
+CATEGORY_FIELDS = {
+    'lazada': 'responseBody.categoryId',
+    'shopee': 'responseBody.data.item.cat_id',
+    'tiki': 'categories.id',
+}
+
+def parse_timestamp(value: Any) -> Any:
+    """
+    Convert an ISO-8601 scraped_timestamp string into a datetime.
+
+    The scrapers write naive local timestamps; they are kept naive so the
+    stored BSON date matches what `$toDate` produced for the old strings.
+    """
+    if isinstance(value, str):
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        return datetime.fromisoformat(value)
+    return value
+
+def get_item_id(platform: str, document: Dict[str, Any]) -> Optional[Union[str, int]]:
+    """
+    Extract the platform item id from a raw snapshot
+    """
+    if platform == 'lazada':
+        return document.get('responseBody', {}).get('itemId')
+    elif platform == 'shopee':
+        return document.get('responseBody', {}).get('data', {}).get('item', {}).get('item_id')
+    elif platform == 'tiki':
+        return document.get('id')
+    return None
+
+def get_title(platform: str, document: Dict[str, Any]) -> Optional[str]:
+    """
+    Extract the product title from a raw snapshot
+    """
+    if platform == 'lazada':
+        return document.get('responseBody', {}).get('title')
+    elif platform == 'shopee':
+        return document.get('responseBody', {}).get('data', {}).get('item', {}).get('title')
+    elif platform == 'tiki':
+        return document.get('name')
+    return None
+
+def get_brand(platform: str, document: Dict[str, Any]) -> Optional[str]:
+    """
+    Extract the brand name from a raw snapshot
+    """
+    if platform == 'lazada':
+        return document.get('responseBody', {}).get('brandName')
+    elif platform == 'shopee':
+        return document.get('responseBody', {}).get('data', {}).get('item', {}).get('brand')
+    elif platform == 'tiki':
+        return (document.get('brand') or {}).get('name')
+    return None
+
+def get_category(platform: str, document: Dict[str, Any]) -> Optional[Union[str, int]]:
+    """
+    Extract the category id from a raw snapshot
+    """
+    if platform == 'lazada':
+        return document.get('responseBody', {}).get('categoryId')
+    elif platform == 'shopee':
+        return document.get('responseBody', {}).get('data', {}).get('item', {}).get('cat_id')
+    elif platform == 'tiki':
+        return (document.get('categories') or {}).get('id')
+    return None
+
+def parse_item_id(item_id: Union[str, int]) -> Union[str, int]:
+    """
+    Item ids are stored as integers; path parameters arrive as strings
+    """
+    return int(item_id) if isinstance(item_id, str) and item_id.isdigit() else item_id
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+import registry
+from platforms import parse_item_id
+from price_points import primary_point
+
+COLLECTION = 'price_changes'
+
+# Capped, so the feed keeps only recent history for reconnecting clients
+PRICE_CHANGES_SIZE_MB = int(os.environ.get('PRICE_CHANGES_SIZE_MB', 64))
+# Events buffered per subscriber; a client that falls further behind is cut off
+SSE_BUFFER = int(os.environ.get('SSE_BUFFER', 256))
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 500))
+# Comment lines sent on idle streams so proxies keep them open
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', 15))
+# Events replayed at most to a client resuming with Last-Event-ID
+REPLAY_LIMIT = 1000
+TAIL_RETRY_SECONDS = 1.0
+
+def ensure_collection(db) -> None:
+    try:
+        db.create_collection(COLLECTION, capped=True, size=PRICE_CHANGES_SIZE_MB * 1024 * 1024)
+    except CollectionInvalid:
+        pass
+
+def change_percent(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if not old or new is None:
+        return None
+    return round((new - old) / old * 100, 2)
+
+def detect_changes(platform: str, documents: Iterable[Dict[str, Any]],
+                   previous: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Price and stock moves of each item, walking its snapshots in time order
+    from the state the registry held before this batch.
+
+    Snapshots older than the registry's last_seen are late arrivals and
+    change nothing. Items seen for the first time produce an event with no
+    old price.
+    """
+    points: Dict[Any, List[Dict[str, Any]]] = {}
+    for document in documents:
+        point = primary_point(platform, document)
+        if point is not None:
+            points.setdefault(point['meta']['item_id'], []).append(point)
+
+    events = []
+    for item_id, item_points in points.items():
+        state = previous.get(registry.registry_key(platform, item_id)) or {}
+        price, stock, last_seen = state.get('price'), state.get('stock'), state.get('last_seen')
+        known = bool(state)
+        for point in sorted(item_points, key=lambda point: point['timestamp']):
+            if last_seen is not None and point['timestamp'] <= last_seen:
+                continue
+            if not known or point['price'] != price or point['stock'] != stock:
+                events.append({
+                    'platform': platform,
+                    'item_id': item_id,
+                    'old_price': price,
+                    'new_price': point['price'],
+                    'old_stock': stock,
+                    'new_stock': point['stock'],
+                    'change_pct': change_percent(price, point['price']),
+                    'scraped_timestamp': point['timestamp'],
+                })
+            price, stock, last_seen, known = point['price'], point['stock'], point['timestamp'], True
+    return events
+
+def record_changes(db, platform: str, documents: List[Dict[str, Any]]) -> int:
+    """
+    Append the changes in freshly ingested snapshots to the feed.
+
+    Must run before the registry takes the batch, since the registry holds
+    the prices being changed from.
+    """
+    keys = list({registry.registry_key(platform, point['meta']['item_id'])
+                 for point in (primary_point(platform, document) for document in documents) if point})
+    if not keys:
+        return 0
+    previous = {
+        entry['_id']: entry
+        for entry in db[registry.COLLECTION].find({'_id': {'$in': keys}}, {'price': 1, 'stock': 1, 'last_seen': 1})
+    }
+    events = detect_changes(platform, documents, previous)
+    if events:
+        db[COLLECTION].insert_many(events)
+    return len(events)
+
+def encode_default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def format_event(event: Dict[str, Any]) -> bytes:
+    """
+    One SSE message; the id lets EventSource resume with Last-Event-ID
+    """
+    data = {key: value for key, value in event.items() if key != '_id'}
+    return b'id: %s\nevent: price-change\ndata: %s\n\n' % (
+        str(event['_id']).encode('ascii'), orjson.dumps(data, default=encode_default)
+    )
+
+def format_reset(last_id: ObjectId) -> bytes:
+    """
+    Sent instead of a replay too long to send; its id moves the client's Last-Event-ID past the gap
+    """
+    return b'id: %s\nevent: reset\ndata: %s\n\n' % (
+        str(last_id).encode('ascii'),
+        orjson.dumps({'detail': f"More than {REPLAY_LIMIT} events missed, reload current prices"})
+    )
+
+OVERFLOW_MESSAGE = b'event: overflow\ndata: {"detail": "Too far behind, reconnect to resume"}\n\n'
+KEEPALIVE_MESSAGE = b': keepalive\n\n'
+
+# Queued in place of events once a subscriber's buffer overflowed
+OVERFLOW = object()
+
+class Subscriber:
+    """
+    One open stream: its filters and a bounded buffer of matching events
+    """
+    def __init__(self, platforms: Optional[Set[str]] = None, items: Optional[Set[Tuple[str, Any]]] = None,
+                 min_change: float = 0.0, buffer: int = SSE_BUFFER):
+        self.platforms = platforms
+        self.items = items
+        self.min_change = min_change
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.platforms and event['platform'] not in self.platforms:
+            return False
+        if self.items and (event['platform'], event['item_id']) not in self.items:
+            return False
+        if self.min_change:
+            # New items and stock-only moves have no price change to compare
+            return abs(event.get('change_pct') or 0) >= self.min_change
+        return True
+
+    def query(self) -> Dict[str, Any]:
+        """
+        The filters of `matches` as a MongoDB query
+        """
+        conditions: List[Dict[str, Any]] = []
+        if self.platforms:
+            conditions.append({'platform': {'$in': sorted(self.platforms)}})
+        if self.items:
+            conditions.append({'$or': [{'platform': platform, 'item_id': item_id} for platform, item_id in self.items]})
+        if self.min_change:
+            conditions.append({'$or': [{'change_pct': {'$gte': self.min_change}},
+                                       {'change_pct': {'$lte': -self.min_change}}]})
+        return {'$and': conditions} if conditions else {}
+
+    def push(self, event: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop the backlog and tell the client; it resumes from its last id
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+def parse_items(items: Optional[str]) -> Optional[Set[Tuple[str, Any]]]:
+    """
+    Parse `platform:id,platform:id` item filters
+    """
+    if not items:
+        return None
+    parsed = set()
+    for item in items.split(','):
+        platform, _, item_id = item.strip().partition(':')
+        if not item_id:
+            raise ValueError(f"Invalid item {item!r}, use platform:id")
+        parsed.add((platform, parse_item_id(item_id)))
+    return parsed
+
+class ChangeBroadcaster:
+    """
+    Tails the capped price_changes collection once per worker and fans the
+    events out to every subscriber whose filters match
+    """
+    def __init__(self, db, max_subscribers: int = SSE_MAX_SUBSCRIBERS):
+        self.db = db
+        self.max_subscribers = max_subscribers
+        self.subscribers: Set[Subscriber] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def subscribe(self, subscriber: Subscriber) -> bool:
+        if len(self.subscribers) >= self.max_subscribers:
+            return False
+        self.subscribers.add(subscriber)
+        return True
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        for subscriber in list(self.subscribers):
+            if subscriber.matches(event):
+                subscriber.push(event)
+
+    async def run(self) -> None:
+        started, last_id = False, None
+        while True:
+            try:
+                if not started:
+                    # Subscribers only get events stored from now on
+                    started, last_id = True, await self.latest_id()
+                query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+                # A tailable cursor on an empty collection dies at once; retry below
+                async for event in self.db[COLLECTION].find(query, cursor_type=CursorType.TAILABLE_AWAIT):
+                    last_id = event['_id']
+                    self.publish(event)
+            except PyMongoError as e:
+                logging.warning(f"Tailing {COLLECTION} failed: {e}")
+            await asyncio.sleep(TAIL_RETRY_SECONDS)
+
+    async def latest_id(self) -> Optional[ObjectId]:
+        latest = await self.db[COLLECTION].find_one({}, {'_id': 1}, sort=[('$natural', -1)])
+        return latest['_id'] if latest else None
+
+    async def replay(self, subscriber: Subscriber, after: ObjectId) -> Optional[List[Dict[str, Any]]]:
+        """
+        Matching events stored after a client's last id, oldest first, or
+        None when there are more than REPLAY_LIMIT of them
+        """
+        query = {'_id': {'$gt': after}, **subscriber.query()}
+        # One extra event tells an over-long replay apart without reading all of it
+        events = await self.db[COLLECTION].find(query).sort('$natural', 1).limit(REPLAY_LIMIT + 1).to_list()
+        return events if len(events) <= REPLAY_LIMIT else None
+
+async def event_stream(broadcaster: ChangeBroadcaster, subscriber: Subscriber, last_event_id: Optional[ObjectId]):
+    """
+    SSE body: replayed events after Last-Event-ID, or a reset when too many
+    were missed, then live events until the client disconnects or falls behind
+    """
+    try:
+        last_id = None
+        if last_event_id is not None:
+            events = await broadcaster.replay(subscriber, last_event_id)
+            if events is None:
+                last_id = await broadcaster.latest_id()
+                yield format_reset(last_id)
+            for event in events or []:
+                last_id = event['_id']
+                yield format_event(event)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_MESSAGE
+                continue
+            if event is OVERFLOW:
+                yield OVERFLOW_MESSAGE
+                return
+            # The subscriber was registered before the replay, so live events may repeat it
+            if last_id is not None and event['_id'] <= last_id:
+                continue
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
@@ -0,0 +1,187 @@
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, DeleteOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from cache import record_ingest
+from config import URI
+from price_points import COLLECTION as PRICE_POINTS, TOUCHED_COLLECTION
+
+COLLECTION = 'price_history_daily'
+STATE_ID = 'price_history_daily'
+
+def ensure_collection(db) -> None:
+    """
+    Create the unique key $merge matches on; it also serves /price-history range reads
+    """
+    db[COLLECTION].create_index(
+        [('platform', ASCENDING), ('item_id', ASCENDING), ('day', ASCENDING)],
+        unique=True
+    )
+
+def start_of_day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def group_days(points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Daily rows of a primary series built in Python, like GROUP_STAGES: the first point of each day
+    """
+    rows: Dict[datetime, Dict[str, Any]] = {}
+    for point in sorted(points, key=lambda point: point['timestamp']):
+        day = start_of_day(point['timestamp'])
+        rows.setdefault(day, {
+            'day': day,
+            'sku_id': point['meta']['sku_id'],
+            'price': point['price'],
+            'stock': point['stock'],
+        })
+    return list(rows.values())
+
+# Touched days regrouped per aggregation
+REFRESH_BATCH = 1000
+
+GROUP_STAGES = [
+    {
+        "$sort": {
+            "timestamp": 1
+        }
+    },
+    {
+        "$group": {
+            "_id": {
+                "platform": "$meta.platform",
+                "item_id": "$meta.item_id",
+                "day": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}}
+            },
+            "sku_id": {"$first": "$meta.sku_id"},
+            "price": {"$first": "$price"},
+            "stock": {"$first": "$stock"},
+            "min_price": {"$min": "$price"},
+            "max_price": {"$max": "$price"},
+            "last_price": {"$last": "$price"},
+            "points": {"$sum": 1}
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,
+            "platform": "$_id.platform",
+            "item_id": "$_id.item_id",
+            "day": "$_id.day",
+            "sku_id": 1,
+            "price": 1,
+            "stock": 1,
+            "min_price": 1,
+            "max_price": 1,
+            "last_price": 1,
+            "points": 1,
+            "refreshed_at": "$$NOW"
+        }
+    },
+    {
+        "$merge": {
+            "into": COLLECTION,
+            "on": ["platform", "item_id", "day"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }
+    }
+]
+
+def touched_match(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Primary points of exactly the touched (platform, item, day) entries
+    """
+    items: Dict[Tuple[str, datetime], List[Any]] = {}
+    for entry in entries:
+        items.setdefault((entry['platform'], entry['day']), []).append(entry['item_id'])
+    return {'primary': True, '$or': [
+        {
+            'meta.platform': platform,
+            'meta.item_id': {'$in': item_ids},
+            'timestamp': {'$gte': day, '$lt': day + timedelta(days=1)},
+        }
+        for (platform, day), item_ids in items.items()
+    ]}
+
+def clear_touched(db, entries: List[Dict[str, Any]]) -> None:
+    """
+    Drop regrouped entries, keeping those marked again since they were read
+    """
+    if entries:
+        db[TOUCHED_COLLECTION].bulk_write(
+            [DeleteOne({'_id': entry['_id'], 'seq': entry['seq']}) for entry in entries], ordered=False
+        )
+
+def refresh(db, full: bool = False) -> int:
+    """
+    Regroup the days that got new price points since the last refresh.
+
+    Ingest queues every (platform, item, day) it writes primary points for,
+    whenever they were scraped, so late scrapes and platforms loaded out of
+    order are regrouped like fresh ones. One pass takes the queue in key
+    order; entries marked again while it runs stay for the next pass. Use
+    `full` to rebuild every day, e.g. after points were written outside
+    ingest and the backfill.
+    """
+    ensure_collection(db)
+    touched = db[TOUCHED_COLLECTION]
+    regrouped = 0
+
+    if full:
+        entries = list(touched.find({}, {'seq': 1}))
+        db[PRICE_POINTS].aggregate([{"$match": {'primary': True}}] + GROUP_STAGES, allowDiskUse=True)
+        clear_touched(db, entries)
+        regrouped = len(entries)
+    else:
+        after = None
+        while True:
+            query = {'_id': {'$gt': after}} if after is not None else {}
+            entries = list(touched.find(query).sort('_id', 1).limit(REFRESH_BATCH))
+            if not entries:
+                break
+            db[PRICE_POINTS].aggregate([{"$match": touched_match(entries)}] + GROUP_STAGES, allowDiskUse=True)
+            clear_touched(db, entries)
+            regrouped += len(entries)
+            after = entries[-1]['_id']
+
+    db['materialized_views'].update_one(
+        {'_id': STATE_ID},
+        {'$set': {'refreshed_at': datetime.utcnow(), 'regrouped': regrouped, 'full': full}},
+        upsert=True
+    )
+    # Lets cache invalidators without change streams drop stale histories
+    record_ingest(db, None, [], source=COLLECTION)
+    logging.info(f"{COLLECTION}: {'rebuilt' if full else 'refreshed'}, {regrouped} item days regrouped")
+    return regrouped
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the price_history_daily materialized view")
+    parser.add_argument('--full', action='store_true',
+                        help="Rebuild every day instead of only those with new price points")
+    parser.add_argument('--every', type=float, default=0,
+                        help="Keep running and refresh every N seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    refresh(db, full=args.full)
+    while args.every > 0:
+        time.sleep(args.every)
+        try:
+            refresh(db)
+        except Exception as e:
+            logging.error(f"{COLLECTION}: refresh failed: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from platforms import PLATFORMS, get_item_id, parse_timestamp
+
+COLLECTION = 'price_points'
+# (platform, item, day) of primary points written since price_history_daily last regrouped them
+TOUCHED_COLLECTION = 'price_points_touched'
+
+# Snapshot fields needed to build price points, used to keep backfill reads small
+SNAPSHOT_PROJECTIONS = {
+    'lazada': {
+        'scraped_timestamp': 1,
+        'responseBody.itemId': 1,
+        'responseBody.skus.skuId': 1,
+        'responseBody.skus.salePrice': 1,
+        'responseBody.skus.stock': 1,
+    },
+    'shopee': {
+        'scraped_timestamp': 1,
+        'responseBody.data.item.item_id': 1,
+        'responseBody.data.item.price': 1,
+        'responseBody.data.item.stock': 1,
+        'responseBody.data.item.models.model_id': 1,
+        'responseBody.data.item.models.price': 1,
+        'responseBody.data.item.models.stock': 1,
+    },
+    'tiki': {
+        'scraped_timestamp': 1,
+        'id': 1,
+        'sku': 1,
+        'price': 1,
+        'stock_item.qty': 1,
+    },
+}
+
+# Shopee reports prices in units of 1/100000 VND
+SHOPEE_PRICE_SCALE = 100000
+
+def ensure_collection(db) -> None:
+    """
+    Create the price_points time-series collection and its query index
+    """
+    try:
+        db.create_collection(
+            COLLECTION,
+            timeseries={'timeField': 'timestamp', 'metaField': 'meta', 'granularity': 'hours'}
+        )
+    except CollectionInvalid:
+        pass
+
+    db[COLLECTION].create_index([
+        ('meta.platform', ASCENDING),
+        ('meta.item_id', ASCENDING),
+        ('timestamp', ASCENDING),
+    ])
+
+def make_point(platform: str, item_id, sku_id, timestamp: datetime, price, stock, primary: bool) -> Dict[str, Any]:
+    return {
+        'meta': {'platform': platform, 'item_id': item_id, 'sku_id': sku_id},
+        'timestamp': timestamp,
+        'price': price,
+        'stock': stock,
+        # The series shown by /price-history: Lazada's first SKU, the item price elsewhere
+        'primary': primary,
+    }
+
+def extract_price_points(platform: str, document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turn one raw snapshot into (platform, item, sku, timestamp, price, stock) points
+    """
+    item_id = get_item_id(platform, document)
+    timestamp = parse_timestamp(document.get('scraped_timestamp'))
+    if item_id is None or not isinstance(timestamp, datetime):
+        return []
+
+    points = []
+    if platform == 'lazada':
+        skus = document.get('responseBody', {}).get('skus') or []
+        for position, sku in enumerate(skus):
+            points.append(make_point(
+                platform, item_id, sku.get('skuId'), timestamp,
+                sku.get('salePrice'), sku.get('stock'), position == 0
+            ))
+
+    elif platform == 'shopee':
+        item = document.get('responseBody', {}).get('data', {}).get('item', {})
+        if item.get('price') is not None:
+            points.append(make_point(
+                platform, item_id, None, timestamp,
+                item['price'] / SHOPEE_PRICE_SCALE, item.get('stock'), True
+            ))
+        for model in item.get('models') or []:
+            if model.get('price') is None:
+                continue
+            points.append(make_point(
+                platform, item_id, model.get('model_id'), timestamp,
+                model['price'] / SHOPEE_PRICE_SCALE, model.get('stock'), False
+            ))
+
+    elif platform == 'tiki':
+        stock_item = document.get('stock_item') or {}
+        points.append(make_point(
+            platform, item_id, document.get('sku'), timestamp,
+            document.get('price'), stock_item.get('qty'), True
+        ))
+
+    return points
+
+def primary_point(platform: str, document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The point of a snapshot's primary series, i.e. its headline price
+    """
+    for point in extract_price_points(platform, document):
+        if point['primary']:
+            return point
+    return None
+
+def point_key(item_id, sku_id, timestamp: datetime) -> Tuple[Any, Any, datetime]:
+    """
+    Identify a point as stored: BSON dates are naive UTC with millisecond precision
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return item_id, sku_id, timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+def existing_points(db, platform: str, points: List[Dict[str, Any]]) -> Set[Tuple[Any, Any, datetime]]:
+    """
+    Keys of the given points that are already stored, read through the (platform, item, timestamp) index
+    """
+    if not points:
+        return set()
+    stored = db[COLLECTION].find(
+        {
+            'meta.platform': platform,
+            'meta.item_id': {'$in': list({point['meta']['item_id'] for point in points})},
+            'timestamp': {'$in': list({point['timestamp'] for point in points})},
+        },
+        {'_id': 0, 'meta': 1, 'timestamp': 1}
+    )
+    return {point_key(point['meta']['item_id'], point['meta'].get('sku_id'), point['timestamp']) for point in stored}
+
+def write_price_points(db, platform: str, documents: Iterable[Dict[str, Any]], skip_existing: bool = False) -> int:
+    """
+    Append the price points of freshly ingested snapshots.
+
+    With `skip_existing` points already stored for the same item, SKU and
+    timestamp are left out, so re-reading snapshots never duplicates them.
+    """
+    points = [point for document in documents for point in extract_price_points(platform, document)]
+    if skip_existing:
+        stored = existing_points(db, platform, points)
+        points = [point for point in points
+                  if point_key(point['meta']['item_id'], point['meta']['sku_id'], point['timestamp']) not in stored]
+    if points:
+        db[COLLECTION].insert_many(points, ordered=False)
+        mark_touched(db, points)
+    return len(points)
+
+def mark_touched(db, points: Iterable[Dict[str, Any]]) -> int:
+    """
+    Queue the days whose primary series got new points, in whatever order
+    they were scraped, for price_history_daily to regroup.
+
+    `seq` grows on every mark, so a refresh only clears entries that were
+    not marked again while it ran.
+    """
+    touched = {
+        (point['meta']['platform'], point['meta']['item_id'],
+         point['timestamp'].replace(hour=0, minute=0, second=0, microsecond=0))
+        for point in points if point['primary']
+    }
+    operations = [
+        UpdateOne(
+            {'_id': f"{platform}:{item_id}:{day.date().isoformat()}"},
+            {'$set': {'platform': platform, 'item_id': item_id, 'day': day}, '$inc': {'seq': 1}},
+            upsert=True
+        )
+        for platform, item_id, day in touched
+    ]
+    if operations:
+        db[TOUCHED_COLLECTION].bulk_write(operations, ordered=False)
+    return len(operations)
+
+def backfill_id(platform: str) -> str:
+    """
+    _id of a platform's backfill checkpoint in `migrations`; /price-history reads its `done` flag
+    """
+    return f"price_points_backfill:{platform}"
+
+def backfill(db, platform: str, batch_size: int = 500, restart: bool = False) -> int:
+    """
+    Build price points for snapshots stored before ingest wrote them.
+
+    The first run records an ObjectId cutoff; only snapshots inserted before
+    it are backfilled, since newer ones already got their points at ingest.
+    Progress is checkpointed in `migrations` so the backfill can resume.
+    Points that are already stored are skipped, so a batch interrupted
+    before its checkpoint or a `restart` does not write them twice.
+    """
+    checkpoints = db['migrations']
+    checkpoint_id = backfill_id(platform)
+
+    if restart:
+        checkpoints.delete_one({'_id': checkpoint_id})
+
+    checkpoint = checkpoints.find_one({'_id': checkpoint_id})
+    if checkpoint is None:
+        checkpoint = {'_id': checkpoint_id, 'cutoff': ObjectId(), 'last_id': None, 'written': 0, 'done': False}
+        checkpoints.insert_one(checkpoint)
+    if checkpoint.get('done'):
+        logging.info(f"{platform}: price points already backfilled")
+        return 0
+
+    ensure_collection(db)
+    last_id = checkpoint.get('last_id')
+    written = checkpoint.get('written', 0)
+
+    while True:
+        id_range = {'$lt': checkpoint['cutoff']}
+        if last_id is not None:
+            id_range['$gt'] = last_id
+
+        batch = list(
+            db[platform].find({'_id': id_range}, SNAPSHOT_PROJECTIONS[platform])
+            .sort('_id', 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+
+        written += write_price_points(db, platform, batch, skip_existing=True)
+        last_id = batch[-1]['_id']
+        checkpoints.update_one({'_id': checkpoint_id}, {'$set': {'last_id': last_id, 'written': written}})
+        logging.info(f"{platform}: {written} price points written (last snapshot {last_id})")
+
+    checkpoints.update_one({'_id': checkpoint_id}, {'$set': {'done': True}})
+    logging.info(f"{platform}: backfill finished, {written} price points written")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the price_points time-series collection")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Snapshot collection to backfill (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--restart', action='store_true',
+                        help="Discard saved progress and cutoff and re-read every snapshot; stored points are kept, not duplicated")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    for platform in args.platform or PLATFORMS:
+        backfill(db, platform, args.batch_size, args.restart)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+
+# Seconds; Prometheus client defaults plus a 30s bucket for exports
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0)
+
+# Phases reported in Server-Timing, in display order
+PHASES = ('db', 'serialize', 'encode')
+
+class RequestProfile:
+    """
+    Time spent by one request in each phase
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.db_commands = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        entries = []
+        for phase in PHASES:
+            if phase in self.phases:
+                entry = f"{phase};dur={self.phases[phase] * 1000:.1f}"
+                if phase == 'db':
+                    entry += f';desc="{self.db_commands} commands"'
+                entries.append(entry)
+        entries.append(f"app;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('current_profile', default=None)
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Attribute the time spent in the block to a phase of the current request, if any
+    """
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram keyed by a tuple of label values
+    """
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], List] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, values: Tuple[str, ...], seconds: float) -> None:
+        with self.lock:
+            counts, total = self.series.get(values, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, seconds)] += 1
+            self.series[values] = (counts, total + seconds)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {values: (list(counts), total) for values, (counts, total) in self.series.items()}
+        for values, (counts, total) in sorted(series.items()):
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to handle a request, by route template',
+    ('method', 'route', 'status')
+)
+PHASE_LATENCY = Histogram(
+    'http_request_phase_seconds', 'Time spent per request in each phase',
+    ('route', 'phase')
+)
+MONGO_LATENCY = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command round trips, by command',
+    ('command',)
+)
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in (REQUEST_LATENCY, PHASE_LATENCY, MONGO_LATENCY):
+        lines += histogram.render()
+    return '\n'.join(lines) + '\n'
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Charges MongoDB round trips to the request that issued them.
+
+    The async driver publishes command events from the awaiting task, so the
+    request's context variable is visible here.
+    """
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self.record(event)
+
+    def failed(self, event) -> None:
+        self.record(event)
+
+    def record(self, event) -> None:
+        seconds = event.duration_micros / 1e6
+        MONGO_LATENCY.observe((event.command_name,), seconds)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add('db', seconds)
+            profile.db_commands += 1
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles every HTTP request.
+
+    Adds a Server-Timing header (db, serialize, encode and total app time up
+    to the first response byte) and records the full latency per route.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get('path'))
+        token = current_profile.set(profile)
+        status = ['500']
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+                headers = MutableHeaders(raw=message.setdefault('headers', []))
+                headers.append('Server-Timing', profile.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            # Set by the router once a route matched; unmatched paths share one series
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUEST_LATENCY.observe((scope['method'], route, status[0]), profile.elapsed())
+            for name, seconds in profile.phases.items():
+                PHASE_LATENCY.observe((route, name), seconds)
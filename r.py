@@ -5,17 +5,63 @@ import plotly.express as px
 import pandas as pd
 import sqlite3
 import numpy as np
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+import sketches
 
 # Create Dash app
 app = dash.Dash(__name__)
 
-# Connect to database and get data
-con = sqlite3.connect('e-com.sqlite')
-df = pd.read_sql_query("SELECT * FROM fact_sales;", con)
-con.close()
+def load_sales():
+    """Read the fact_sales columns the panels use; the trend and scatter panels plot every row"""
+    con = sqlite3.connect('e-com.sqlite')
+    df = pd.read_sql_query(
+        "SELECT itemId, platform, salePrice, scraped_timestamp, total_reviews, rating FROM fact_sales;", con
+    )
+    con.close()
+
+    # Convert timestamp to datetime
+    df['scraped_timestamp'] = pd.to_datetime(df['scraped_timestamp'])
+    return df
+
+def sketch_figures(df):
+    """Distribution panels from the sketches kept at ingest instead of full columns,
+    limited to the platforms and days in df so every panel shows the same items"""
+    scope = sketches.scope(df['platform'], df['scraped_timestamp'].min(), df['scraped_timestamp'].max())
+    with MongoClient(URI, server_api=ServerApi('1')) as client:
+        db = client['datashop']
+        return {
+            'rating': sketch_histogram(db, scope, 'rating', 20, "Phân bố điểm đánh giá"),
+            'price': sketch_histogram(db, scope, 'price', 20, "Phân phối giá sản phẩm"),
+            'price_box': sketch_box(db, scope, 'price', "Phân phối giá theo nền tảng"),
+            'total_reviews': sketch_histogram(db, scope, 'total_reviews', 20, "Phân bố số lượng đánh giá"),
+        }
 
-# Convert timestamp to datetime
-df['scraped_timestamp'] = pd.to_datetime(df['scraped_timestamp'])
+def sketch_histogram(db, scope, field, bins, title):
+    """Histogram of a field from its merged sketches"""
+    histogram = sketches.distribution(db, field, bins=bins, **scope)['overall']['histogram']
+    return go.Figure(
+        go.Bar(
+            x=[(bucket['min'] + bucket['max']) / 2 for bucket in histogram],
+            y=[bucket['count'] for bucket in histogram],
+            width=[bucket['max'] - bucket['min'] for bucket in histogram]
+        ),
+        layout={'title': title, 'xaxis_title': field, 'yaxis_title': 'count', 'bargap': 0}
+    )
+
+def sketch_box(db, scope, field, title):
+    """Box plot per platform from sketch quartiles; whiskers reach the min and max"""
+    summary = sketches.distribution(db, field, fractions=(0.25, 0.5, 0.75), bins=1, **scope)
+    figure = go.Figure(layout={'title': title, 'xaxis_title': 'platform', 'yaxis_title': field})
+    for platform, stats in summary['platforms'].items():
+        q1, median, q3 = stats['quantiles'].values()
+        figure.add_trace(go.Box(
+            x=[platform], name=platform, q1=[q1], median=[median], q3=[q3],
+            lowerfence=[stats['min']], upperfence=[stats['max']]
+        ))
+    return figure
 
 # Common styles
 CARD_STYLE = {
@@ -32,7 +78,7 @@ HEADER_STYLE = {
     'fontSize': '18px'
 }
 
-def create_tab1_layout():
+def create_tab1_layout(df, figures):
     """Create layout for Overview tab"""
     return html.Div([
         html.H1('Tổng quan', style={
@@ -98,12 +144,7 @@ def create_tab1_layout():
                 html.Div([
                     html.H3("Phân bố đánh giá", style=HEADER_STYLE),
                     dcc.Graph(
-                        figure=px.histogram(
-                            df, 
-                            x='rating',
-                            nbins=20,
-                            title="Phân bố điểm đánh giá"
-                        ),
+                        figure=figures['rating'],
                         config={'displayModeBar': False}
                     )
                 ], style=CARD_STYLE)
@@ -111,7 +152,7 @@ def create_tab1_layout():
         ], style={'maxWidth': '1200px', 'margin': '0 auto'})
     ])
 
-def create_tab2_layout():
+def create_tab2_layout(df, figures):
     """Create layout for Price Analysis tab"""
     # Create price trend figure
     price_trend = go.Figure()
@@ -180,12 +221,7 @@ def create_tab2_layout():
                 html.Div([
                     html.H3("Phân phối khoảng giá", style=HEADER_STYLE),
                     dcc.Graph(
-                        figure=px.histogram(
-                            df,
-                            x='salePrice',
-                            nbins=20,
-                            title="Phân phối giá sản phẩm"
-                        ),
+                        figure=figures['price'],
                         config={'displayModeBar': False}
                     )
                 ], style=CARD_STYLE)
@@ -203,12 +239,7 @@ def create_tab2_layout():
                 html.Div([
                     html.H3("So sánh giá theo nền tảng", style=HEADER_STYLE),
                     dcc.Graph(
-                        figure=px.box(
-                            df,
-                            x='platform',
-                            y='salePrice',
-                            title="Phân phối giá theo nền tảng"
-                        ),
+                        figure=figures['price_box'],
                         config={'displayModeBar': False}
                     )
                 ], style=CARD_STYLE)
@@ -216,7 +247,7 @@ def create_tab2_layout():
         ], style={'maxWidth': '1200px', 'margin': '0 auto'})
     ])
 
-def create_tab3_layout():
+def create_tab3_layout(df, figures):
     """Create layout for Review Analysis tab"""
     return html.Div([
         html.H1('Phân tích đánh giá', style={
@@ -277,12 +308,7 @@ def create_tab3_layout():
                 html.Div([
                     html.H3("Phân bố số lượng đánh giá", style=HEADER_STYLE),
                     dcc.Graph(
-                        figure=px.histogram(
-                            df,
-                            x='total_reviews',
-                            nbins=20,
-                            title="Phân bố số lượng đánh giá"
-                        ),
+                        figure=figures['total_reviews'],
                         config={'displayModeBar': False}
                     )
                 ], style=CARD_STYLE)
@@ -290,23 +316,28 @@ def create_tab3_layout():
         ], style={'maxWidth': '1200px', 'margin': '0 auto'})
     ])
 
-# Create the app layout with tabs
-app.layout = html.Div([
-    html.H1('Báo cáo phân tích E-commerce', style={
-        'textAlign': 'center',
-        'color': '#1976D2',
-        'marginTop': '20px'
-    }),
-    
-    dcc.Tabs([
-        dcc.Tab(label='Tổng quan', children=create_tab1_layout()),
-        dcc.Tab(label='Phân tích giá', children=create_tab2_layout()),
-        dcc.Tab(label='Phân tích đánh giá', children=create_tab3_layout())
-    ], style={
-        'margin': '20px',
-        'fontFamily': 'Arial'
-    })
-])
+def serve_layout():
+    """Create the app layout with tabs; Dash calls it on each page load, so importing r.py reads nothing"""
+    df = load_sales()
+    figures = sketch_figures(df)
+    return html.Div([
+        html.H1('Báo cáo phân tích E-commerce', style={
+            'textAlign': 'center',
+            'color': '#1976D2',
+            'marginTop': '20px'
+        }),
+        
+        dcc.Tabs([
+            dcc.Tab(label='Tổng quan', children=create_tab1_layout(df, figures)),
+            dcc.Tab(label='Phân tích giá', children=create_tab2_layout(df, figures)),
+            dcc.Tab(label='Phân tích đánh giá', children=create_tab3_layout(df, figures))
+        ], style={
+            'margin': '20px',
+            'fontFamily': 'Arial'
+        })
+    ])
+
+app.layout = serve_layout
 
 if __name__ == '__main__':
     app.run_server(debug=True, host='localhost', port=8050)
\ No newline at end of file
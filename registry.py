@@ -0,0 +1,122 @@
+import argparse
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from platforms import PLATFORMS, get_item_id, parse_timestamp
+from price_points import SNAPSHOT_PROJECTIONS, primary_point
+
+COLLECTION = 'products'
+
+# Projection served entirely from the (platform, item_id) index
+ID_PROJECTION = {'_id': 0, 'platform': 1, 'item_id': 1}
+ID_SORT = [('platform', ASCENDING), ('item_id', ASCENDING)]
+
+def ensure_collection(db) -> None:
+    """
+    Create the index behind the id listings; (platform, item_id) is unique per item
+    """
+    db[COLLECTION].create_index(ID_SORT, unique=True)
+
+def registry_key(platform: str, item_id) -> str:
+    return f"{platform}:{item_id}"
+
+def snapshot_update(platform: str, document: Dict[str, Any]) -> Optional[UpdateOne]:
+    """
+    Fold one stored snapshot into its item's registry entry.
+
+    first_seen/last_seen only widen and the latest pointer and price only
+    move to newer snapshots, so updates can be applied in any order and
+    replaying them changes nothing.
+    """
+    item_id = get_item_id(platform, document)
+    timestamp = parse_timestamp(document.get('scraped_timestamp'))
+    if item_id is None or not isinstance(timestamp, datetime) or '_id' not in document:
+        return None
+
+    point = primary_point(platform, document) or {}
+    newer = {'$gte': [timestamp, {'$ifNull': ['$last_seen', datetime.min]}]}
+    latest = {
+        'snapshot_id': document['_id'],
+        'price': point.get('price'),
+        'stock': point.get('stock'),
+    }
+    return UpdateOne(
+        {'_id': registry_key(platform, item_id)},
+        [{'$set': {
+            'platform': {'$literal': platform},
+            'item_id': {'$literal': item_id},
+            'first_seen': {'$min': [{'$ifNull': ['$first_seen', timestamp]}, timestamp]},
+            'last_seen': {'$max': ['$last_seen', timestamp]},
+            **{name: {'$cond': [newer, {'$literal': value}, f'${name}']} for name, value in latest.items()},
+        }}],
+        upsert=True
+    )
+
+def record_snapshots(db, platform: str, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Update the registry with snapshots that were just inserted (they carry their _id)
+    """
+    operations = [operation for operation in (snapshot_update(platform, document) for document in documents) if operation]
+    if operations:
+        db[COLLECTION].bulk_write(operations, ordered=False)
+    return len(operations)
+
+def page_filter(platform: Optional[str], after: Optional[Any]) -> Dict[str, Any]:
+    """
+    Keyset filter over (platform, item_id) for one platform, or for all after a (platform, id) cursor
+    """
+    if platform is not None:
+        query: Dict[str, Any] = {'platform': platform}
+        if after is not None:
+            query['item_id'] = {'$gt': after}
+        return query
+    if after is None:
+        return {}
+    after_platform, after_id = after
+    return {'$or': [
+        {'platform': after_platform, 'item_id': {'$gt': after_id}},
+        {'platform': {'$gt': after_platform}},
+    ]}
+
+def backfill(db, platform: str, batch_size: int = 500) -> int:
+    """
+    Register every stored snapshot; safe to rerun
+    """
+    ensure_collection(db)
+    written = 0
+    batch: List[Dict[str, Any]] = []
+    for document in db[platform].find({}, SNAPSHOT_PROJECTIONS[platform], batch_size=batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            written += record_snapshots(db, platform, batch)
+            logging.info(f"{platform}: {written} snapshots registered")
+            batch = []
+    written += record_snapshots(db, platform, batch)
+    logging.info(f"{platform}: registry backfill finished, {written} snapshots registered")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the products registry from stored snapshots")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Snapshot collection to register (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    for platform in args.platform or PLATFORMS:
+        backfill(db, platform, args.batch_size)
+
+if __name__ == "__main__":
+    main()
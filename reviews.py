@@ -0,0 +1,233 @@
+import argparse
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from platforms import PLATFORMS, get_item_id, parse_item_id, parse_timestamp
+from serialization import decode_cursor, encode_cursor
+
+COLLECTION = 'reviews'
+
+# Collection holding the raw Shopee/Tiki review API responses, one per product
+SOURCE_COLLECTION = 'review'
+
+# Page orders for /product-reviews; review_id breaks ties so the order is total.
+# Each one is a (possibly reversed) prefix scan of an index from ensure_collection.
+SORTS = {
+    'newest': [('created_at', DESCENDING), ('review_id', DESCENDING)],
+    'oldest': [('created_at', ASCENDING), ('review_id', ASCENDING)],
+    'highest': [('rating', DESCENDING), ('created_at', DESCENDING), ('review_id', DESCENDING)],
+    'lowest': [('rating', ASCENDING), ('created_at', ASCENDING), ('review_id', ASCENDING)],
+}
+
+# Fields returned by the API; platform and item_id are already in the request
+REVIEW_FIELDS = ['review_id', 'rating', 'created_at', 'title', 'content', 'author', 'images', 'likes']
+PAGE_PROJECTION = {'_id': 0, **{field: 1 for field in REVIEW_FIELDS}}
+
+# Parts of the raw Shopee/Tiki responses kept as the /product-reviews summary
+# (rating breakdown, totals); the reviews themselves are served a page at a time
+SUMMARY_PROJECTIONS = {
+    'shopee': {'data.ratings': 0},
+    'tiki': {'data': 0},
+}
+LAZADA_SUMMARY_PROJECTION = {'responseBody.ratingCountByScore': 1}
+
+def ensure_collection(db) -> None:
+    """
+    Create the indexes behind review pages and idempotent re-ingest
+    """
+    db[COLLECTION].create_index(
+        [('platform', ASCENDING), ('item_id', ASCENDING), ('review_id', ASCENDING)],
+        unique=True
+    )
+    db[COLLECTION].create_index(
+        [('platform', ASCENDING), ('item_id', ASCENDING), ('created_at', ASCENDING), ('review_id', ASCENDING)]
+    )
+    db[COLLECTION].create_index(
+        [('platform', ASCENDING), ('item_id', ASCENDING), ('rating', ASCENDING),
+         ('created_at', ASCENDING), ('review_id', ASCENDING)]
+    )
+
+def from_epoch(seconds: Any) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(seconds) if isinstance(seconds, (int, float)) else None
+
+def make_review(platform: str, item_id, review_id, rating, created_at, content,
+                author=None, title=None, images=None, likes=None) -> Dict[str, Any]:
+    return {
+        'platform': platform,
+        'item_id': item_id,
+        'review_id': review_id,
+        'rating': rating,
+        'created_at': created_at,
+        'title': title,
+        'content': content,
+        'author': author,
+        'images': images or [],
+        'likes': likes,
+    }
+
+def review_platform(document: Dict[str, Any]) -> Optional[str]:
+    """
+    Tell a Shopee get_ratings response from a Tiki reviews response
+    """
+    data = document.get('data')
+    if isinstance(data, dict) and 'ratings' in data:
+        return 'shopee'
+    if isinstance(data, list):
+        return 'tiki'
+    return None
+
+def extract_reviews(platform: str, document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Split a Lazada snapshot or a Shopee/Tiki review response into one document per review
+    """
+    reviews = []
+    if platform == 'lazada':
+        item_id = get_item_id(platform, document)
+        for review in document.get('responseBody', {}).get('reviews') or []:
+            reviews.append(make_review(
+                platform, review.get('itemId', item_id), review.get('reviewRateId'),
+                review.get('rating'), parse_timestamp(review.get('reviewedAt')),
+                review.get('reviewContent'), author=review.get('reviewerName'),
+                images=[image.get('url') for image in review.get('images') or []],
+                likes=review.get('likeCount')
+            ))
+
+    elif platform == 'shopee':
+        item_id = parse_item_id(document.get('id'))
+        for review in (document.get('data') or {}).get('ratings') or []:
+            reviews.append(make_review(
+                platform, review.get('itemid', item_id), review.get('cmtid'),
+                review.get('rating_star'), from_epoch(review.get('ctime')),
+                review.get('comment'), author=review.get('author_username'),
+                images=review.get('images'), likes=review.get('like_count')
+            ))
+
+    elif platform == 'tiki':
+        item_id = parse_item_id(document.get('id'))
+        for review in document.get('data') or []:
+            reviews.append(make_review(
+                platform, review.get('product_id', item_id), review.get('id'),
+                review.get('rating'), from_epoch(review.get('created_at')),
+                review.get('content'), author=(review.get('created_by') or {}).get('name'),
+                title=review.get('title'),
+                images=[image.get('full_path') for image in review.get('images') or []],
+                likes=review.get('thank_count')
+            ))
+
+    return [review for review in reviews if review['item_id'] is not None and review['review_id'] is not None]
+
+def write_reviews(db, platform: str, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Upsert the reviews found in freshly ingested documents.
+
+    Lazada snapshots repeat the same reviews day after day, so reviews are
+    keyed by (platform, item_id, review_id) and re-ingesting is a no-op.
+    """
+    operations = [
+        UpdateOne(
+            {'platform': review['platform'], 'item_id': review['item_id'], 'review_id': review['review_id']},
+            {'$set': review},
+            upsert=True
+        )
+        for document in documents
+        for review in extract_reviews(platform, document)
+    ]
+    if operations:
+        db[COLLECTION].bulk_write(operations, ordered=False)
+    return len(operations)
+
+def keyset_filter(sort: List[Tuple[str, int]], values: List[Any]) -> Dict[str, Any]:
+    """
+    Match the reviews that come after `values` in `sort` order
+    """
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {name: value for (name, _), value in zip(sort[:position], values[:position])}
+        value = values[position]
+        # Nulls (and missing fields) sort before every value ascending, so after every value descending
+        if value is None:
+            if direction == DESCENDING:
+                continue
+            clause[field] = {'$ne': None}
+        elif direction == DESCENDING:
+            clauses.append({**clause, field: None})
+            clause[field] = {'$lt': value}
+        else:
+            clause[field] = {'$gt': value}
+        clauses.append(clause)
+    return {'$or': clauses} if clauses else {'_id': {'$exists': False}}
+
+def page_query(platform: str, item_id, sort: str, after: Optional[str]) -> Tuple[Dict[str, Any], List[Tuple[str, int]]]:
+    """
+    Build the filter and sort for one page of an item's reviews
+    """
+    if sort not in SORTS:
+        raise ValueError(f"Invalid sort, use one of: {', '.join(SORTS)}")
+    order = SORTS[sort]
+    query = {'platform': platform, 'item_id': item_id}
+    if after is not None:
+        query.update(keyset_filter(order, decode_cursor(after, len(order))))
+    return query, order
+
+def next_cursor(sort: str, page: List[Dict[str, Any]], limit: int) -> Optional[str]:
+    if len(page) < limit:
+        return None
+    return encode_cursor([page[-1].get(field) for field, _ in SORTS[sort]])
+
+def backfill(db, platforms: Iterable[str], batch_size: int = 500) -> int:
+    """
+    Normalize reviews already stored in Lazada snapshots and the review collection.
+
+    Writes are idempotent upserts, so an interrupted run is simply rerun.
+    """
+    ensure_collection(db)
+    written = 0
+    platforms = list(platforms)
+
+    if 'lazada' in platforms:
+        cursor = db['lazada'].find(
+            {'responseBody.reviews.0': {'$exists': True}},
+            {'responseBody.itemId': 1, 'responseBody.reviews': 1},
+            batch_size=batch_size
+        )
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                written += write_reviews(db, 'lazada', batch)
+                logging.info(f"lazada: {written} reviews written")
+                batch = []
+        written += write_reviews(db, 'lazada', batch)
+
+    for document in db[SOURCE_COLLECTION].find({}, batch_size=batch_size):
+        platform = review_platform(document)
+        if platform in platforms:
+            written += write_reviews(db, platform, [document])
+            logging.info(f"{platform}: {written} reviews written (product {document.get('id')})")
+
+    logging.info(f"Review backfill finished, {written} reviews written")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the per-review reviews collection")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Platform to backfill (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+    backfill(db, args.platform or PLATFORMS, args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import logging
+import re
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import TEXT, UpdateOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from platforms import PLATFORMS, get_item_id, get_title, parse_timestamp
+from serialization import decode_cursor, encode_cursor
+
+COLLECTION = 'product_search'
+
+# Snapshot fields the title index needs
+TITLE_PROJECTIONS = {
+    'lazada': {'scraped_timestamp': 1, 'responseBody.itemId': 1, 'responseBody.title': 1},
+    'shopee': {'scraped_timestamp': 1, 'responseBody.data.item.item_id': 1, 'responseBody.data.item.title': 1},
+    'tiki': {'scraped_timestamp': 1, 'id': 1, 'name': 1},
+}
+
+NON_WORD = re.compile(r'[^0-9a-z]+')
+
+def fold(text: Optional[str]) -> str:
+    """
+    Fold Vietnamese text to lowercase ASCII words: "Điện thoại" -> "dien thoai".
+
+    Tone and vowel marks are combining characters after NFD; đ is a letter
+    of its own and is mapped by hand.
+    """
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = ''.join(char for char in unicodedata.normalize('NFD', text) if not unicodedata.combining(char))
+    return NON_WORD.sub(' ', text.lower()).strip()
+
+def ensure_collection(db) -> None:
+    """
+    Create the text index over folded titles.
+
+    Stemming and stop words are English-specific, so the index uses the
+    `none` language and matches folded words exactly.
+    """
+    db[COLLECTION].create_index(
+        [('folded_title', TEXT)],
+        default_language='none',
+        name='folded_title_text'
+    )
+    db[COLLECTION].create_index('platform')
+
+def title_update(platform: str, document: Dict[str, Any]) -> Optional[UpdateOne]:
+    """
+    Upsert an item's title, keeping the one from its newest snapshot
+    """
+    item_id = get_item_id(platform, document)
+    title = get_title(platform, document)
+    timestamp = parse_timestamp(document.get('scraped_timestamp'))
+    if item_id is None or not title or not isinstance(timestamp, datetime):
+        return None
+
+    # Only newer snapshots replace the title, whatever order loads arrive in
+    newer = {'$gte': [timestamp, {'$ifNull': ['$scraped_timestamp', datetime.min]}]}
+    fields = {
+        'platform': platform,
+        'item_id': item_id,
+        'title': title,
+        'folded_title': fold(title),
+        'scraped_timestamp': timestamp,
+    }
+    return UpdateOne(
+        {'_id': f"{platform}:{item_id}"},
+        [{'$set': {name: {'$cond': [newer, {'$literal': value}, f'${name}']} for name, value in fields.items()}}],
+        upsert=True
+    )
+
+def index_titles(db, platform: str, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Add the titles of freshly ingested snapshots to the search index
+    """
+    operations = [operation for operation in (title_update(platform, document) for document in documents) if operation]
+    if operations:
+        db[COLLECTION].bulk_write(operations, ordered=False)
+    return len(operations)
+
+def text_search(q: str) -> str:
+    """
+    $search string requiring every folded word: $text ORs bare terms but ANDs quoted phrases
+    """
+    return ' '.join(f'"{word}"' for word in fold(q).split())
+
+def search_pipeline(q: str, platform: Optional[str], limit: int, after: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Rank titles containing every word of `q` by text score; `after` resumes below the last (score, _id) returned
+    """
+    match: Dict[str, Any] = {'$text': {'$search': text_search(q)}}
+    if platform is not None:
+        match['platform'] = platform
+
+    pipeline = [
+        {'$match': match},
+        {'$addFields': {'score': {'$meta': 'textScore'}}},
+    ]
+    if after is not None:
+        score, last_id = decode_cursor(after, 2)
+        pipeline.append({'$match': {'$or': [
+            {'score': {'$lt': score}},
+            {'score': score, '_id': {'$gt': last_id}},
+        ]}})
+    pipeline += [
+        {'$sort': {'score': -1, '_id': 1}},
+        {'$limit': limit},
+        {'$project': {'platform': 1, 'item_id': 1, 'title': 1, 'global_id': 1, 'score': 1}},
+    ]
+    return pipeline
+
+def next_cursor(results: List[Dict[str, Any]], limit: int) -> Optional[str]:
+    if len(results) < limit:
+        return None
+    return encode_cursor([results[-1]['score'], results[-1]['_id']])
+
+def backfill(db, platform: str, batch_size: int = 500) -> int:
+    """
+    Index the titles of every stored snapshot; rerunning is harmless
+    """
+    ensure_collection(db)
+    written = 0
+    batch = []
+    for document in db[platform].find({}, TITLE_PROJECTIONS[platform], batch_size=batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            written += index_titles(db, platform, batch)
+            logging.info(f"{platform}: {written} snapshots indexed")
+            batch = []
+    written += index_titles(db, platform, batch)
+    logging.info(f"{platform}: search backfill finished, {written} snapshots indexed")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the product title search index")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Snapshot collection to index (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    for platform in args.platform or PLATFORMS:
+        backfill(db, platform, args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import base64
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import orjson
+from bson import ObjectId, decode
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from fastapi.responses import Response
+
+from profiling import phase
+
+# Collections read with these options return undecoded BSON, so the driver
+# does not build Python objects for documents that are only passed through
+RAW_BSON = CodecOptions(document_class=RawBSONDocument)
+
+def decode_raw(document: Optional[RawBSONDocument]) -> Optional[Dict[str, Any]]:
+    """
+    Decode a raw BSON document into plain dicts in a single C-level pass.
+
+    Responses are not transcoded from BSON to JSON directly: the PDP handlers
+    flatten responseBody first, and no C transcoder ships with PyMongo. This
+    decode is about half of the remaining serialization time.
+    """
+    if document is None:
+        return None
+    with phase('serialize'):
+        return decode(document.raw)
+
+def default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, RawBSONDocument):
+        return decode(obj.raw)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode content straight to JSON bytes; ObjectIds become strings and datetimes ISO-8601
+    """
+    with phase('encode'):
+        return orjson.dumps(content, default=default)
+
+EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    Pack the sort key of the last row on a page into an opaque `after` token
+    """
+    packed = [{'ms': (value - EPOCH) // timedelta(milliseconds=1)} if isinstance(value, datetime) else value
+              for value in values]
+    return base64.urlsafe_b64encode(orjson.dumps(packed)).decode('ascii')
+
+def decode_cursor(token: str, length: int) -> List[Any]:
+    try:
+        packed = orjson.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, orjson.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(packed, list) or len(packed) != length:
+        raise ValueError("Invalid cursor")
+    return [EPOCH + timedelta(milliseconds=value['ms']) if isinstance(value, dict) else value
+            for value in packed]
+
+class PrerenderedJSONResponse(Response):
+    """
+    JSON response whose body is encoded once with orjson.
+
+    Returning it from a handler bypasses FastAPI's jsonable_encoder pass.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
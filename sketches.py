@@ -0,0 +1,398 @@
+import argparse
+import logging
+import math
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from config import URI
+from platforms import CATEGORY_FIELDS, PLATFORMS, get_category, get_item_id, parse_timestamp
+from price_points import SNAPSHOT_PROJECTIONS, primary_point
+import reviews
+
+COLLECTION = 'sketches'
+
+# Fields with a sketch per platform, category and day. Like a fact_sales row,
+# each item counts once per day; total_reviews is its number of stored reviews
+SKETCH_FIELDS = ('price', 'rating', 'total_reviews')
+# Accuracy parameter: rank error is about 1.7/k, and a sketch holds ~3k values
+SKETCH_K = int(os.environ.get('SKETCH_K', 200))
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Concurrent ingests retry a sketch whose version moved underneath them
+UPDATE_ATTEMPTS = 5
+
+RATING_PROJECTIONS = {
+    'lazada': {'responseBody.ratingAverage': 1},
+    'shopee': {'responseBody.data.item.item_rating.rating_star': 1},
+    'tiki': {'rating_average': 1},
+}
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang and Liberty, 2016).
+
+    Values go into level 0; a level that outgrows its capacity is sorted
+    and every other value, from a random offset, moves up one level, where
+    each value stands for twice as many. Capacities shrink geometrically
+    towards the lower levels, so memory stays O(k) however many values are
+    added, and two sketches merge by concatenating their levels.
+    """
+    __slots__ = ('k', 'levels', 'count', 'min', 'max', 'retained', 'max_size')
+
+    def __init__(self, k: int = SKETCH_K, levels: Optional[List[List[float]]] = None, count: int = 0,
+                 minimum: Optional[float] = None, maximum: Optional[float] = None):
+        self.k = k
+        self.levels = levels or [[]]
+        self.count = count
+        self.min = minimum
+        self.max = maximum
+        self.retained = sum(len(items) for items in self.levels)
+        self.max_size = self.total_capacity()
+
+    def capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def total_capacity(self) -> int:
+        return sum(self.capacity(level) for level in range(len(self.levels)))
+
+    def update(self, value: float) -> None:
+        self.levels[0].append(value)
+        self.count += 1
+        self.retained += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.retained >= self.max_size:
+            self.compress()
+
+    def extend(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.update(value)
+
+    def compress(self) -> None:
+        for level in range(len(self.levels)):
+            items = self.levels[level]
+            if len(items) < self.capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self.max_size = self.total_capacity()
+            items.sort()
+            leftover = [items.pop()] if len(items) % 2 else []
+            promoted = items[random.getrandbits(1)::2]
+            self.levels[level + 1] += promoted
+            self.levels[level] = leftover
+            self.retained -= len(items) - len(promoted)
+            if self.retained < self.max_size:
+                break
+
+    def merge(self, other: 'KLLSketch') -> None:
+        if other.count == 0:
+            return
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level] += items
+        self.retained += other.retained
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.max_size = self.total_capacity()
+        while self.retained >= self.max_size:
+            self.compress()
+
+    def weighted(self) -> List[Tuple[float, int]]:
+        """
+        Retained values with the number of values each stands for, in value order
+        """
+        return sorted((value, 1 << level) for level, items in enumerate(self.levels) for value in items)
+
+    def quantiles(self, fractions: Sequence[float]) -> List[Optional[float]]:
+        if self.count == 0:
+            return [None for _ in fractions]
+        items = self.weighted()
+        total = sum(weight for _, weight in items)
+        results = []
+        for fraction in fractions:
+            if fraction <= 0:
+                results.append(self.min)
+                continue
+            if fraction >= 1:
+                results.append(self.max)
+                continue
+            target, seen = fraction * total, 0
+            for value, weight in items:
+                seen += weight
+                if seen >= target:
+                    results.append(value)
+                    break
+        return results
+
+    def histogram(self, bins: int, low: Optional[float] = None, high: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Estimated counts in `bins` equal-width bins between low and high (default min and max)
+        """
+        if self.count == 0:
+            return []
+        low = self.min if low is None else low
+        high = self.max if high is None else high
+        width = (high - low) / bins if high > low else 0
+        counts = [0] * bins
+        for value, weight in self.weighted():
+            if value < low or value > high:
+                continue
+            position = min(int((value - low) / width), bins - 1) if width else 0
+            counts[position] += weight
+        return [
+            {'min': low + width * index, 'max': low + width * (index + 1) if width else high, 'count': count}
+            for index, count in enumerate(counts)
+        ]
+
+    def to_document(self) -> Dict[str, Any]:
+        return {'k': self.k, 'count': self.count, 'min': self.min, 'max': self.max, 'levels': self.levels}
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> 'KLLSketch':
+        return cls(document['k'], [list(items) for items in document['levels']],
+                   document['count'], document['min'], document['max'])
+
+def ensure_collection(db) -> None:
+    db[COLLECTION].create_index([('field', ASCENDING), ('platform', ASCENDING), ('day', ASCENDING)])
+
+def sketch_key(platform: str, category, day: datetime, field: str) -> str:
+    return f"{platform}:{category}:{day.date().isoformat()}:{field}"
+
+def get_rating(platform: str, document: Dict[str, Any]) -> Optional[float]:
+    """
+    Rating average of a raw snapshot
+    """
+    if platform == 'lazada':
+        return document.get('responseBody', {}).get('ratingAverage')
+    elif platform == 'shopee':
+        rating = document.get('responseBody', {}).get('data', {}).get('item', {}).get('item_rating') or {}
+        return rating.get('rating_star')
+    elif platform == 'tiki':
+        return document.get('rating_average')
+    return None
+
+def review_totals(db, platform: str, item_ids: List[Any]) -> Dict[Any, int]:
+    """
+    Stored reviews per item, the total_reviews of fact_sales
+    """
+    cursor = db[reviews.COLLECTION].aggregate([
+        {'$match': {'platform': platform, 'item_id': {'$in': item_ids}}},
+        {'$group': {'_id': '$item_id', 'total': {'$sum': 1}}},
+    ])
+    return {row['_id']: row['total'] for row in cursor}
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def item_values(db, platform: str, documents: Iterable[Dict[str, Any]]) -> Dict[Tuple[Any, datetime, str], Dict[Any, float]]:
+    """
+    The sketched fields of each item and day, grouped by (category, day, field).
+
+    An item scraped several times in a day counts once, with its earliest
+    snapshot of the day, as it does in fact_sales.
+    """
+    first: Dict[Tuple[Any, datetime], Tuple[datetime, Dict[str, Any]]] = {}
+    for document in documents:
+        item_id = get_item_id(platform, document)
+        timestamp = parse_timestamp(document.get('scraped_timestamp'))
+        if item_id is None or not isinstance(timestamp, datetime):
+            continue
+        day = datetime(timestamp.year, timestamp.month, timestamp.day)
+        if (item_id, day) not in first or timestamp < first[item_id, day][0]:
+            first[item_id, day] = (timestamp, document)
+    if not first:
+        return {}
+
+    totals = review_totals(db, platform, list({item_id for item_id, _ in first}))
+    groups: Dict[Tuple[Any, datetime, str], Dict[Any, float]] = {}
+    for (item_id, day), (_, document) in first.items():
+        category = get_category(platform, document)
+        point = primary_point(platform, document) or {}
+        values = (('price', point.get('price')), ('rating', get_rating(platform, document)),
+                  ('total_reviews', totals.get(item_id, 0)))
+        for field, value in values:
+            if is_number(value):
+                groups.setdefault((category, day, field), {})[item_id] = float(value)
+    return groups
+
+def add_values(db, platform: str, category, day: datetime, field: str, values: Dict[Any, float]) -> int:
+    """
+    Fold the values of items not yet in one stored sketch into it, retrying
+    if another ingest wrote it first; returns the number of items added.
+
+    The sketch keeps the ids of the items it holds, so replayed snapshots
+    and backfill reruns are not counted twice.
+    """
+    key = sketch_key(platform, category, day, field)
+    for _ in range(UPDATE_ATTEMPTS):
+        stored = db[COLLECTION].find_one({'_id': key})
+        sketch = KLLSketch.from_document(stored) if stored else KLLSketch()
+        items = list(stored['items']) if stored else []
+        known = set(items)
+        new = [item_id for item_id in values if item_id not in known]
+        if not new:
+            return 0
+        sketch.extend(values[item_id] for item_id in new)
+        document = {'platform': platform, 'category': category, 'day': day, 'field': field,
+                    'items': items + new, **sketch.to_document()}
+        if stored is None:
+            try:
+                db[COLLECTION].insert_one({'_id': key, 'version': 1, **document})
+                return len(new)
+            except DuplicateKeyError:
+                continue
+        result = db[COLLECTION].replace_one(
+            {'_id': key, 'version': stored['version']}, {'version': stored['version'] + 1, **document}
+        )
+        if result.matched_count:
+            return len(new)
+    raise RuntimeError(f"Sketch {key} kept changing during {UPDATE_ATTEMPTS} attempts")
+
+def record_snapshots(db, platform: str, documents: Iterable[Dict[str, Any]]) -> int:
+    """
+    Add freshly ingested snapshots to their platform/category/day sketches;
+    returns the number of item values added
+    """
+    return sum(
+        add_values(db, platform, category, day, field, values)
+        for (category, day, field), values in item_values(db, platform, documents).items()
+    )
+
+def parse_quantiles(quantiles: Optional[str]) -> List[float]:
+    if not quantiles:
+        return list(DEFAULT_QUANTILES)
+    try:
+        fractions = [float(fraction) for fraction in quantiles.split(',') if fraction.strip()]
+    except ValueError:
+        raise ValueError("Quantiles must be comma-separated numbers between 0 and 1")
+    if not fractions or any(not 0 <= fraction <= 1 for fraction in fractions):
+        raise ValueError("Quantiles must be comma-separated numbers between 0 and 1")
+    return fractions
+
+def sketch_filter(field: str, platforms: List[str], categories: Optional[List[Any]],
+                  start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    """
+    Sketches for a field over whole days: the start day is included, and so
+    is the end day unless `end` falls on midnight
+    """
+    if field not in SKETCH_FIELDS:
+        raise ValueError(f"Invalid field, use one of: {', '.join(SKETCH_FIELDS)}")
+    query: Dict[str, Any] = {'field': field, 'platform': {'$in': platforms}}
+    if categories:
+        query['category'] = {'$in': categories}
+    day: Dict[str, Any] = {}
+    if start is not None:
+        day['$gte'] = datetime(start.year, start.month, start.day)
+    if end is not None:
+        day['$lt'] = end
+    if day:
+        query['day'] = day
+    return query
+
+# Leaves out the item ids kept for deduplication
+SKETCH_PROJECTION = {'_id': 0, 'platform': 1, 'k': 1, 'count': 1, 'min': 1, 'max': 1, 'levels': 1}
+
+def describe(sketch: KLLSketch, fractions: List[float], bins: int) -> Dict[str, Any]:
+    return {
+        'count': sketch.count,
+        'min': sketch.min,
+        'max': sketch.max,
+        'quantiles': dict(zip((str(fraction) for fraction in fractions), sketch.quantiles(fractions))),
+        'histogram': sketch.histogram(bins),
+    }
+
+def summarize(documents: Iterable[Dict[str, Any]], fractions: List[float], bins: int) -> Dict[str, Any]:
+    """
+    Merge stored sketches per platform and overall, and read quantiles and
+    histogram bins off the merged sketches
+    """
+    platforms: Dict[str, KLLSketch] = {}
+    for document in documents:
+        sketch = platforms.setdefault(document['platform'], KLLSketch(document['k']))
+        sketch.merge(KLLSketch.from_document(document))
+    overall = KLLSketch()
+    for sketch in platforms.values():
+        overall.merge(sketch)
+    return {
+        'platforms': {platform: describe(sketch, fractions, bins) for platform, sketch in sorted(platforms.items())},
+        'overall': describe(overall, fractions, bins),
+    }
+
+def distribution(db, field: str, platforms: Sequence[str] = PLATFORMS, categories: Optional[List[Any]] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 fractions: Sequence[float] = DEFAULT_QUANTILES, bins: int = 20) -> Dict[str, Any]:
+    """
+    Quantiles and histogram of a field from the stored sketches, for scripts and reports
+    """
+    documents = db[COLLECTION].find(sketch_filter(field, list(platforms), categories, start, end), SKETCH_PROJECTION)
+    return summarize(documents, list(fractions), bins)
+
+def scope(platforms: Iterable[str], first: datetime, last: datetime) -> Dict[str, Any]:
+    """
+    `distribution` arguments covering the platforms and whole days of a set
+    of snapshots, so sketch panels describe the same data as the panels
+    drawn from those snapshots
+    """
+    return {
+        'platforms': sorted(set(platforms)),
+        'start': datetime(first.year, first.month, first.day),
+        'end': datetime(last.year, last.month, last.day) + timedelta(days=1),
+    }
+
+def backfill(db, platform: str, batch_size: int = 500) -> int:
+    """
+    Sketch every stored snapshot. Reruns only add items missing from a
+    day's sketch, so backfill reviews first: their totals are read now
+    """
+    ensure_collection(db)
+    projection = {**SNAPSHOT_PROJECTIONS[platform], **RATING_PROJECTIONS[platform], CATEGORY_FIELDS[platform]: 1}
+    sketched = 0
+    batch = []
+    for document in db[platform].find({}, projection, batch_size=batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            record_snapshots(db, platform, batch)
+            sketched += len(batch)
+            logging.info(f"{platform}: {sketched} snapshots sketched")
+            batch = []
+    record_snapshots(db, platform, batch)
+    sketched += len(batch)
+    logging.info(f"{platform}: sketch backfill finished, {sketched} snapshots sketched")
+    return sketched
+
+def main():
+    parser = argparse.ArgumentParser(description="Build price, rating and review count sketches from stored snapshots")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Snapshot collection to sketch (repeatable, default: all)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--rebuild', action='store_true', help="Drop the platforms' sketches first")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    client = MongoClient(URI, server_api=ServerApi('1'))
+    db = client['datashop']
+
+    platforms = args.platform or PLATFORMS
+    if args.rebuild:
+        db[COLLECTION].delete_many({'platform': {'$in': list(platforms)}})
+
+    for platform in platforms:
+        backfill(db, platform, args.batch_size)
+
+if __name__ == "__main__":
+    main()
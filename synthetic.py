@@ -0,0 +1,541 @@
+import argparse
+import json
+import logging
+import math
+import random
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from platforms import PLATFORMS
+from price_points import SHOPEE_PRICE_SCALE
+import ingest
+import price_history_daily
+
+# Generated item ids start above every real id so they never collide
+FIRST_ITEM_ID = 9_000_000_000_000
+# Ids of one product on different platforms are this far apart
+PLATFORM_ID_STRIDE = 100_000_000_000
+
+# Daily log-price volatility of the random walk
+PRICE_VOLATILITY = 0.015
+# Chance that an item runs a flash sale on an ordinary day
+FLASH_SALE_PROBABILITY = 0.03
+# Demand multiplier while a sale runs
+SALE_DEMAND_MULTIPLIER = 6.0
+# Share of buyers who leave a review
+REVIEW_RATE = 0.08
+# Reviews embedded in a Lazada snapshot and returned per review response
+REVIEWS_PER_PAGE = 5
+REVIEW_RESPONSE_SIZE = 20
+
+# Category, platform category ids, brands, product line, base price (VND) and variant axes
+CATALOG = [
+    {
+        'category': 'Điện thoại Smartphone', 'category_id': 1795,
+        'brands': ['Apple', 'Samsung', 'Xiaomi', 'OPPO', 'Realme', 'POCO'],
+        'products': ['Điện thoại {brand} {series} {number}', '{brand} {series} {number} 5G'],
+        'series': ['Galaxy A', 'Note', 'Reno', 'C', 'iPhone', 'X'],
+        'price': (2_500_000, 35_000_000),
+        'variants': [('Dung lượng', ['128GB', '256GB', '512GB']), ('Màu sắc', ['Đen', 'Trắng', 'Xanh', 'Titan'])],
+    },
+    {
+        'category': 'Laptop', 'category_id': 8095,
+        'brands': ['Apple', 'Dell', 'HP', 'Asus', 'Lenovo', 'Acer'],
+        'products': ['Laptop {brand} {series} {number}', 'Máy tính xách tay {brand} {series} {number}'],
+        'series': ['Inspiron', 'Vivobook', 'IdeaPad', 'Aspire', 'MacBook Air', 'Pavilion'],
+        'price': (9_000_000, 45_000_000),
+        'variants': [('Cấu hình', ['i5/8GB/256GB', 'i5/16GB/512GB', 'i7/16GB/512GB', 'i7/32GB/1TB'])],
+    },
+    {
+        'category': 'Tivi', 'category_id': 4221,
+        'brands': ['Samsung', 'LG', 'Sony', 'TCL', 'Xiaomi'],
+        'products': ['Smart Tivi {brand} 4K {series} {number}', 'Android Tivi {brand} {series} {number}'],
+        'series': ['Crystal UHD', 'NanoCell', 'Bravia', 'QLED', 'OLED'],
+        'price': (5_000_000, 40_000_000),
+        'variants': [('Kích thước', ['43 inch', '50 inch', '55 inch', '65 inch'])],
+    },
+    {
+        'category': 'Máy giặt', 'category_id': 3862,
+        'brands': ['LG', 'Samsung', 'Electrolux', 'Toshiba', 'Panasonic'],
+        'products': ['Máy giặt {brand} Inverter {number} kg {series}'],
+        'series': ['AI DD', 'EcoBubble', 'UltimateCare', 'Greatwaves', 'StainMaster'],
+        'price': (4_500_000, 18_000_000),
+        'variants': [],
+    },
+    {
+        'category': 'Tai nghe', 'category_id': 8318,
+        'brands': ['Apple', 'Sony', 'JBL', 'Samsung', 'Soundcore'],
+        'products': ['Tai nghe Bluetooth {brand} {series} {number}', 'Tai nghe không dây {brand} {series} {number}'],
+        'series': ['AirPods', 'WF', 'Tune', 'Buds', 'Liberty'],
+        'price': (300_000, 7_000_000),
+        'variants': [('Màu sắc', ['Đen', 'Trắng', 'Xanh'])],
+    },
+]
+
+FIRST_NAMES = ['Minh', 'Lan', 'Hùng', 'Thảo', 'Tuấn', 'Ngọc', 'Hải', 'Trang', 'Dũng', 'Linh']
+LAST_NAMES = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Vũ', 'Đặng', 'Bùi']
+REVIEW_TEXTS = {
+    5: ['Sản phẩm tuyệt vời, giao hàng nhanh', 'Hàng chính hãng, đóng gói cẩn thận', 'Rất hài lòng, sẽ ủng hộ shop tiếp'],
+    4: ['Sản phẩm tốt, giao hơi chậm', 'Dùng ổn trong tầm giá'],
+    3: ['Tạm được, chưa như kỳ vọng', 'Chất lượng bình thường'],
+    2: ['Hàng không giống mô tả', 'Giao thiếu phụ kiện'],
+    1: ['Sản phẩm lỗi, đổi trả mất nhiều thời gian', 'Rất thất vọng'],
+}
+
+def poisson(rng: random.Random, mean: float) -> int:
+    """
+    Poisson draw; Knuth's method for small means, a rounded normal above that
+    """
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, int(round(rng.gauss(mean, math.sqrt(mean)))))
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+def is_mega_sale(day: datetime) -> bool:
+    """
+    Double days (11.11, 12.12, ...) and the last Friday of November
+    """
+    black_friday = day.month == 11 and day.weekday() == 4 and day.day > 23
+    return day.day == day.month or black_friday
+
+class Product:
+    """
+    One catalog product; every platform lists it under its own id
+    """
+    def __init__(self, number: int, rng: random.Random):
+        self.number = number
+        entry = rng.choice(CATALOG)
+        self.category = entry['category']
+        self.category_id = entry['category_id']
+        self.brand = rng.choice(entry['brands'])
+        self.title = rng.choice(entry['products']).format(
+            brand=self.brand, series=rng.choice(entry['series']), number=rng.randint(2, 99) * 10 + number % 10
+        )
+        low, high = entry['price']
+        self.list_price = int(round(math.exp(rng.uniform(math.log(low), math.log(high))), -3))
+        self.variants = self.pick_variants(entry['variants'], rng)
+        # Mean 5-star share: most products are well rated, a few are not
+        self.quality = min(max(rng.betavariate(8, 2), 0.2), 0.97)
+        self.demand = math.exp(rng.gauss(1.0, 1.0))
+
+    @staticmethod
+    def pick_variants(axes: List[Tuple[str, List[str]]], rng: random.Random) -> List[Tuple[str, float]]:
+        """
+        SKU fan-out: a subset of the variant combinations, each with its own price offset
+        """
+        combinations = [('', 1.0)]
+        for _, options in axes:
+            chosen = rng.sample(options, rng.randint(1, len(options)))
+            combinations = [
+                (f"{name}, {option}" if name else option, factor * (1 + 0.12 * index))
+                for name, factor in combinations for index, option in enumerate(chosen)
+            ]
+        return combinations
+
+class Listing:
+    """
+    The state of one product on one platform, advanced a day at a time
+    """
+    def __init__(self, platform: str, product: Product, rng: random.Random):
+        self.platform = platform
+        self.product = product
+        self.item_id = FIRST_ITEM_ID + PLATFORMS.index(platform) * PLATFORM_ID_STRIDE + product.number
+        self.shop_id = rng.randint(10_000_000, 999_999_999)
+        self.level = rng.uniform(0.85, 1.05)
+        self.skus = [
+            {
+                'sku_id': self.item_id * 100 + index,
+                'name': name,
+                'factor': factor,
+                'stock': rng.randint(0, 300),
+            }
+            for index, (name, factor) in enumerate(product.variants)
+        ]
+        self.rating_counts = [0, 0, 0, 0, 0]
+        self.sold = rng.randint(0, 2000)
+        self.reviews: List[Dict[str, Any]] = []
+        self.sale_discount = 0.0
+        self.next_review_id = self.item_id * 10_000
+
+    def advance(self, day: datetime, rng: random.Random) -> None:
+        """
+        One day of price moves, sales, restocks and new reviews
+        """
+        self.level = min(max(self.level * math.exp(rng.gauss(0, PRICE_VOLATILITY)), 0.6), 1.2)
+        on_sale = is_mega_sale(day) or rng.random() < FLASH_SALE_PROBABILITY
+        self.sale_discount = rng.uniform(0.1, 0.3) if on_sale else 0.0
+
+        demand = self.product.demand * (SALE_DEMAND_MULTIPLIER if on_sale else 1.0)
+        sold_today = 0
+        for sku in self.skus:
+            sold = min(poisson(rng, demand / len(self.skus)), sku['stock'])
+            sku['stock'] -= sold
+            sold_today += sold
+            if sku['stock'] == 0 and rng.random() < 0.3:
+                sku['stock'] = rng.randint(50, 500)
+        self.sold += sold_today
+
+        for _ in range(poisson(rng, sold_today * REVIEW_RATE)):
+            self.add_review(day + timedelta(seconds=rng.randint(0, 86399)), rng)
+
+    def add_review(self, reviewed_at: datetime, rng: random.Random) -> None:
+        if rng.random() < self.product.quality:
+            rating = 5
+        else:
+            rating = rng.choices([1, 2, 3, 4], weights=[1, 1, 2, 4])[0]
+        self.rating_counts[rating - 1] += 1
+        self.next_review_id += 1
+        self.reviews.append({
+            'review_id': self.next_review_id,
+            'rating': rating,
+            'reviewed_at': reviewed_at,
+            'author': f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}",
+            'content': rng.choice(REVIEW_TEXTS[rating]),
+            'sku': rng.choice(self.skus)['name'],
+            'likes': poisson(rng, 0.5),
+        })
+        # Older reviews are only needed for the rating counts
+        del self.reviews[:-REVIEW_RESPONSE_SIZE]
+
+    def price(self, sku: Dict[str, Any]) -> int:
+        return int(round(self.product.list_price * sku['factor'] * self.level * (1 - self.sale_discount), -3))
+
+    def original_price(self, sku: Dict[str, Any]) -> int:
+        return int(round(self.product.list_price * sku['factor'], -3))
+
+    def rating_average(self) -> float:
+        total = sum(self.rating_counts)
+        return round(sum(score * count for score, count in enumerate(self.rating_counts, 1)) / total, 1) if total else 0.0
+
+    def title(self, day: datetime) -> str:
+        if self.platform == 'lazada' and self.sale_discount:
+            return f"[SALE {day.day}.{day.month}] {self.product.title} - Hàng Chính Hãng"
+        if self.platform == 'tiki':
+            return f"{self.product.title} - Hàng Chính Hãng"
+        return self.product.title
+
+def lazada_snapshot(listing: Listing, timestamp: datetime) -> Dict[str, Any]:
+    product = listing.product
+    return {
+        'url': f"https://www.lazada.vn/products/i{listing.item_id}-s{listing.skus[0]['sku_id']}.html",
+        'status': 'SUCCESS',
+        'responseBody': {
+            'itemId': listing.item_id,
+            'title': listing.title(timestamp),
+            'defaultSkuId': listing.skus[0]['sku_id'],
+            'categoryId': product.category_id,
+            'skus': [
+                {
+                    'skuId': sku['sku_id'],
+                    'itemId': listing.item_id,
+                    'categoryId': product.category_id,
+                    'fields': [{'name': 'Variation', 'optionName': sku['name']}] if sku['name'] else [],
+                    'stock': sku['stock'],
+                    'salePrice': listing.price(sku),
+                    'originalPrice': listing.original_price(sku),
+                }
+                for sku in listing.skus
+            ],
+            'sellerId': listing.shop_id,
+            'sellerName': f"{product.brand} Official Store",
+            'brandName': product.brand,
+            'reviewCount': sum(listing.rating_counts),
+            'ratingCount': sum(listing.rating_counts),
+            'ratingAverage': listing.rating_average(),
+            'ratingCountByScore': {str(score): count for score, count in enumerate(listing.rating_counts, 1)},
+            'reviews': [
+                {
+                    'reviewRateId': review['review_id'],
+                    'itemId': listing.item_id,
+                    'reviewedAt': review['reviewed_at'].isoformat(timespec='milliseconds') + 'Z',
+                    'rating': review['rating'],
+                    'isPurchased': True,
+                    'skuFields': [{'name': 'Variation', 'optionName': review['sku']}] if review['sku'] else [],
+                    'likeCount': review['likes'],
+                    'reviewerName': review['author'],
+                    'reviewContent': review['content'],
+                    'images': [],
+                }
+                for review in reversed(listing.reviews[-REVIEWS_PER_PAGE:])
+            ],
+        },
+        'scraped_timestamp': timestamp.isoformat(),
+    }
+
+def shopee_snapshot(listing: Listing, timestamp: datetime) -> Dict[str, Any]:
+    product = listing.product
+    prices = [listing.price(sku) * SHOPEE_PRICE_SCALE for sku in listing.skus]
+    originals = [listing.original_price(sku) * SHOPEE_PRICE_SCALE for sku in listing.skus]
+    return {
+        'url': f"https://shopee.vn/product-i.{listing.shop_id}.{listing.item_id}",
+        'status': 'SUCCESS',
+        'responseBody': {
+            'bff_meta': None,
+            'error': None,
+            'error_msg': None,
+            'data': {'item': {
+                'item_id': listing.item_id,
+                'shop_id': listing.shop_id,
+                'title': listing.title(timestamp),
+                'brand': product.brand,
+                'cat_id': product.category_id,
+                'currency': 'VND',
+                'categories': [{'catid': product.category_id, 'display_name': product.category, 'no_sub': True}],
+                'item_rating': {
+                    'rating_star': listing.rating_average(),
+                    'rating_count': [sum(listing.rating_counts)] + listing.rating_counts,
+                },
+                'tier_variations': [{'name': 'Phân loại', 'options': [sku['name'] for sku in listing.skus]}]
+                if len(listing.skus) > 1 else [],
+                'models': [
+                    {
+                        'item_id': listing.item_id,
+                        'model_id': sku['sku_id'],
+                        'name': sku['name'],
+                        'price': price,
+                        'stock': sku['stock'],
+                        'normal_stock': sku['stock'],
+                    }
+                    for sku, price in zip(listing.skus, prices)
+                ],
+                'price': min(prices),
+                'price_min': min(prices),
+                'price_max': max(prices),
+                'price_before_discount': min(originals),
+                'raw_discount': int(round(listing.sale_discount * 100)),
+                'stock': sum(sku['stock'] for sku in listing.skus),
+                'normal_stock': sum(sku['stock'] for sku in listing.skus),
+                'historical_sold': listing.sold,
+            }},
+        },
+        'scraped_timestamp': timestamp.isoformat(),
+    }
+
+def tiki_snapshot(listing: Listing, timestamp: datetime) -> Dict[str, Any]:
+    product = listing.product
+    main = listing.skus[0]
+    price, original = listing.price(main), listing.original_price(main)
+    return {
+        'id': listing.item_id,
+        'sku': str(main['sku_id']),
+        'name': listing.title(timestamp),
+        'price': price,
+        'list_price': original,
+        'original_price': original,
+        'discount': original - price,
+        'discount_rate': int(round((1 - price / original) * 100)) if original else 0,
+        'rating_average': listing.rating_average(),
+        'review_count': sum(listing.rating_counts),
+        'all_time_quantity_sold': listing.sold,
+        'quantity_sold': {'text': f"Đã bán {listing.sold}", 'value': listing.sold},
+        'inventory_status': 'available' if main['stock'] else 'out_of_stock',
+        'brand': {'id': zlib.crc32(product.brand.encode('utf-8')) % 1_000_000, 'name': product.brand, 'slug': product.brand.lower()},
+        'categories': {'id': product.category_id, 'name': product.category, 'is_leaf': True},
+        'current_seller': {'id': listing.shop_id, 'sku': str(main['sku_id']), 'name': f"{product.brand} Official", 'price': price},
+        'configurable_products': [
+            {
+                'child_id': sku['sku_id'],
+                'id': sku['sku_id'],
+                'sku': str(sku['sku_id']),
+                'name': f"{product.title} - {sku['name']}",
+                'option1': sku['name'],
+                'price': listing.price(sku),
+                'original_price': listing.original_price(sku),
+                'inventory_status': 'available' if sku['stock'] else 'out_of_stock',
+            }
+            for sku in listing.skus
+        ] if len(listing.skus) > 1 else [],
+        'stock_item': {'max_sale_qty': 1000, 'min_sale_qty': 1, 'preorder_date': None, 'qty': main['stock']},
+        'scraped_timestamp': timestamp.isoformat(),
+    }
+
+SNAPSHOT_BUILDERS = {
+    'lazada': lazada_snapshot,
+    'shopee': shopee_snapshot,
+    'tiki': tiki_snapshot,
+}
+
+def review_response(listing: Listing) -> Optional[Dict[str, Any]]:
+    """
+    A Shopee get_ratings or Tiki reviews response with the newest reviews
+    """
+    newest = list(reversed(listing.reviews))
+    total = sum(listing.rating_counts)
+    if listing.platform == 'shopee':
+        return {
+            'error': 0,
+            'data': {
+                'ratings': [
+                    {
+                        'itemid': listing.item_id,
+                        'shopid': listing.shop_id,
+                        'cmtid': review['review_id'],
+                        'ctime': int(review['reviewed_at'].timestamp()),
+                        'rating_star': review['rating'],
+                        'comment': review['content'],
+                        'author_username': review['author'],
+                        'images': [],
+                        'like_count': review['likes'],
+                    }
+                    for review in newest
+                ],
+                'item_rating_summary': {'rating_total': total, 'rating_count': listing.rating_counts},
+                'has_more': total > len(newest),
+            },
+            'id': listing.item_id,
+        }
+    if listing.platform == 'tiki':
+        return {
+            'stars': {str(score): {'count': count} for score, count in enumerate(listing.rating_counts, 1)},
+            'rating_average': listing.rating_average(),
+            'reviews_count': total,
+            'data': [
+                {
+                    'id': review['review_id'],
+                    'product_id': listing.item_id,
+                    'title': review['content'].split(',')[0],
+                    'content': review['content'],
+                    'status': 'approved',
+                    'rating': review['rating'],
+                    'created_at': int(review['reviewed_at'].timestamp()),
+                    'created_by': {'name': review['author'], 'full_name': review['author']},
+                    'images': [],
+                    'thank_count': review['likes'],
+                }
+                for review in newest
+            ],
+            'paging': {'total': total, 'per_page': REVIEW_RESPONSE_SIZE, 'current_page': 1},
+            'id': listing.item_id,
+        }
+    # Lazada reviews ship inside the snapshots
+    return None
+
+def generate(platforms: Sequence[str], items: int, days: int, end: datetime,
+             seed: int = 0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (collection, document) pairs: one snapshot per listing per day,
+    then its review response for Shopee and Tiki (collection `review`).
+
+    Listings are generated one after another, so memory stays flat however
+    many items are requested; the same seed gives the same data.
+    """
+    rng = random.Random(seed)
+    first_day = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    for number in range(items):
+        product = Product(number, rng)
+        for platform in platforms:
+            listing = Listing(platform, product, rng)
+            for offset in range(days):
+                day = first_day + timedelta(days=offset)
+                listing.advance(day, rng)
+                scraped = day + timedelta(hours=rng.randint(8, 20), seconds=rng.randint(0, 3599),
+                                          microseconds=rng.randint(0, 999999))
+                yield platform, SNAPSHOT_BUILDERS[platform](listing, scraped)
+            response = review_response(listing)
+            if response is not None:
+                yield 'review', response
+
+def write_mongo(db, records: Iterable[Tuple[str, Dict[str, Any]]], batch_size: int = 500,
+                derived: bool = True) -> Dict[str, int]:
+    """
+    Insert generated documents in bulk.
+
+    With `derived` they go through ingest, so the registry, price points,
+    search index, matches and reviews are filled too; without it only the
+    raw collections are written (build the rest with the backfill CLIs).
+    """
+    if derived:
+        ingest.ensure_collections(db)
+    written: Dict[str, int] = {}
+    batches: Dict[str, List[Dict[str, Any]]] = {}
+
+    def flush(collection: str) -> None:
+        batch = batches.pop(collection, [])
+        if not batch:
+            return
+        if not derived:
+            db[collection].insert_many([ingest.prepare_snapshot(document) for document in batch], ordered=False)
+        elif collection == 'review':
+            ingest.ingest_reviews(db, batch)
+        else:
+            ingest.ingest_snapshots(db, collection, batch)
+        written[collection] = written.get(collection, 0) + len(batch)
+        logging.info(f"{collection}: {written[collection]} documents written")
+
+    for collection, document in records:
+        batches.setdefault(collection, []).append(document)
+        if len(batches[collection]) >= batch_size:
+            flush(collection)
+    for collection in list(batches):
+        flush(collection)
+
+    if derived:
+        price_history_daily.refresh(db)
+    return written
+
+def write_files(out_dir: Path, records: Iterable[Tuple[str, Dict[str, Any]]]) -> Dict[str, int]:
+    """
+    Write documents in the layout `save_data` produces: `<platform>/<id>_<date>.json`,
+    and review responses as `review/<platform>/<platform>_<id>.json`
+    """
+    written: Dict[str, int] = {}
+    for collection, document in records:
+        if collection == 'review':
+            platform = 'shopee' if isinstance(document.get('data'), dict) else 'tiki'
+            folder = out_dir / 'review' / platform
+            file_name = f"{platform}_{document['id']}.json"
+        else:
+            folder = out_dir / collection
+            timestamp = datetime.fromisoformat(document['scraped_timestamp'])
+            item_id = document['id'] if collection == 'tiki' else (
+                document['responseBody']['itemId'] if collection == 'lazada'
+                else document['responseBody']['data']['item']['item_id']
+            )
+            file_name = f"{item_id}_{timestamp.date().isoformat()}.json"
+        folder.mkdir(parents=True, exist_ok=True)
+        with open(folder / file_name, 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=4)
+        written[collection] = written.get(collection, 0) + 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Lazada/Shopee/Tiki snapshots and reviews")
+    parser.add_argument('--platform', choices=PLATFORMS, action='append',
+                        help="Platform to generate (repeatable, default: all)")
+    parser.add_argument('--items', type=int, default=1000, help="Catalog products, each listed on every platform")
+    parser.add_argument('--days', type=int, default=30, help="Daily snapshots per listing")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    parser.add_argument('--uri', help="MongoDB to write to; required unless --out is given (never production)")
+    parser.add_argument('--out', type=Path, help="Write JSON files here instead of to MongoDB")
+    parser.add_argument('--raw', action='store_true',
+                        help="Only insert the snapshot and review collections, skipping ingest's derived ones")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    # No default: generated products must never land in the database the API serves by accident
+    if args.out is None and args.uri is None:
+        parser.error("--uri is required when writing to MongoDB")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    records = generate(args.platform or PLATFORMS, args.items, args.days, datetime.now(), args.seed)
+    if args.out is not None:
+        written = write_files(args.out, records)
+    else:
+        client = MongoClient(args.uri, server_api=ServerApi('1'))
+        written = write_mongo(client['datashop'], records, args.batch_size, derived=not args.raw)
+    logging.info(f"Generated {', '.join(f'{count} {name}' for name, count in sorted(written.items()))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,638 @@
+"""
+In-memory stand-ins for the parts of pymongo the modules under test use.
+
+Only the query and update operators the code actually sends are
+implemented; anything else raises so a test never passes by accident.
+"""
+import copy
+from collections.abc import Mapping
+from datetime import datetime
+from types import SimpleNamespace
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+MISSING = object()
+
+def get_path(document, path):
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, Mapping) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+def set_path(document, path, value):
+    *parents, last = path.split('.')
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+def unset_path(document, path):
+    *parents, last = path.split('.')
+    for part in parents:
+        document = document.get(part, {})
+    document.pop(last, None)
+
+def type_order(value):
+    # BSON comparison order for the types these tests store
+    if value is None or value is MISSING:
+        return 0
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, ObjectId):
+        return 5
+    if isinstance(value, bool):
+        return 6
+    if isinstance(value, datetime):
+        return 7
+    raise TypeError(f"Unsupported value {value!r}")
+
+def sort_key(value):
+    return (type_order(value), None if value is None or value is MISSING else value)
+
+def compare(value, operand, test):
+    # Range operators only match values of the operand's type
+    if value is MISSING or value is None or type_order(value) != type_order(operand):
+        return False
+    return test(value, operand)
+
+def equals(value, operand):
+    if operand is None:
+        return value is MISSING or value is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value is not MISSING and value == operand
+
+def match_value(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+        for operator, operand in condition.items():
+            if operator == '$gt' and not compare(value, operand, lambda a, b: a > b):
+                return False
+            if operator == '$gte' and not compare(value, operand, lambda a, b: a >= b):
+                return False
+            if operator == '$lt' and not compare(value, operand, lambda a, b: a < b):
+                return False
+            if operator == '$lte' and not compare(value, operand, lambda a, b: a <= b):
+                return False
+            if operator == '$ne' and equals(value, operand):
+                return False
+            if operator == '$in' and not any(equals(value, item) for item in operand):
+                return False
+            if operator == '$nin' and any(equals(value, item) for item in operand):
+                return False
+            if operator == '$exists' and (value is not MISSING) != bool(operand):
+                return False
+            if operator == '$type':
+                if operand != 'string':
+                    raise NotImplementedError(operand)
+                if not isinstance(value, str):
+                    return False
+            if operator not in ('$gt', '$gte', '$lt', '$lte', '$ne', '$in', '$nin', '$exists', '$type'):
+                raise NotImplementedError(operator)
+        return True
+    return equals(value, condition)
+
+def matches(document, query):
+    for key, condition in (query or {}).items():
+        if key == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key.startswith('$'):
+            raise NotImplementedError(key)
+        elif not match_value(get_path(document, key), condition):
+            return False
+    return True
+
+def include(source, parts, target):
+    # Copy one inclusion path into target, descending into arrays like Mongo does
+    head, rest = parts[0], parts[1:]
+    if not isinstance(source, Mapping) or head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = copy.deepcopy(value)
+    elif isinstance(value, list):
+        items = target.setdefault(head, [{} for _ in value])
+        for item, projected in zip(value, items):
+            include(item, rest, projected)
+    else:
+        include(value, rest, target.setdefault(head, {}))
+
+def project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    projection = dict(projection)
+    include_id = projection.pop('_id', 1)
+    if projection and all(projection.values()):
+        result = {}
+        for path in projection:
+            include(document, path.split('.'), result)
+        if include_id and '_id' in document:
+            result['_id'] = document['_id']
+        return result
+    result = copy.deepcopy(document)
+    for path in projection:
+        unset_path(result, path)
+    if not include_id:
+        result.pop('_id', None)
+    return result
+
+def apply_pipeline(document, pipeline):
+    for stage in pipeline:
+        (name, fields), = stage.items()
+        if name not in ('$set', '$addFields'):
+            raise NotImplementedError(name)
+        values = {path: evaluate(document, expression) for path, expression in fields.items()}
+        for path, value in values.items():
+            set_path(document, path, copy.deepcopy(value))
+
+def apply_update(document, update, inserting=False):
+    if isinstance(update, list):
+        apply_pipeline(document, update)
+        return
+    if not update or not all(key.startswith('$') for key in update):
+        raise NotImplementedError("Replacement documents go through replace_one")
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == '$set':
+                set_path(document, path, copy.deepcopy(value))
+            elif operator == '$setOnInsert':
+                if inserting:
+                    set_path(document, path, copy.deepcopy(value))
+            elif operator == '$unset':
+                unset_path(document, path)
+            elif operator == '$inc':
+                current = get_path(document, path)
+                set_path(document, path, (0 if current is MISSING else current) + value)
+            elif operator == '$max':
+                current = get_path(document, path)
+                if current is MISSING or sort_key(value) > sort_key(current):
+                    set_path(document, path, value)
+            elif operator == '$min':
+                current = get_path(document, path)
+                if current is MISSING or sort_key(value) < sort_key(current):
+                    set_path(document, path, value)
+            elif operator == '$push':
+                current = get_path(document, path)
+                set_path(document, path, (current if current is not MISSING else []) + [value])
+            elif operator == '$addToSet':
+                current = get_path(document, path)
+                current = current if current is not MISSING else []
+                set_path(document, path, current if value in current else current + [value])
+            else:
+                raise NotImplementedError(operator)
+
+def seed_from_query(query):
+    # Equality fields of an upsert's filter go into the inserted document
+    document = {}
+    for key, condition in query.items():
+        if not key.startswith('$') and not (isinstance(condition, dict) and any(k.startswith('$') for k in condition)):
+            set_path(document, key, copy.deepcopy(condition))
+    return document
+
+COMPARISONS = {
+    '$eq': lambda a, b: a == b,
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+def evaluate_operator(document, operator, operand):
+    if operator == '$literal':
+        return operand
+    if operator in ('$min', '$max') and isinstance(operand, list):
+        values = [value for value in (evaluate(document, item) for item in operand) if value is not None]
+        pick = max if operator == '$max' else min
+        return pick(values, key=sort_key) if values else None
+    if operator == '$ifNull':
+        value = evaluate(document, operand[0])
+        return evaluate(document, operand[1]) if value is None else value
+    if operator == '$cond':
+        condition, then, otherwise = operand if isinstance(operand, list) else (
+            operand['if'], operand['then'], operand['else'])
+        return evaluate(document, then if evaluate(document, condition) else otherwise)
+    if operator in COMPARISONS:
+        first, second = (evaluate(document, item) for item in operand)
+        return COMPARISONS[operator](sort_key(first), sort_key(second))
+    raise NotImplementedError(operator)
+
+def evaluate(document, expression):
+    # Field paths, literals and the few operators the modules' pipeline updates use
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = get_path(document, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, dict):
+        if len(expression) == 1 and next(iter(expression)).startswith('$'):
+            (operator, operand), = expression.items()
+            return evaluate_operator(document, operator, operand)
+        if any(key.startswith('$') for key in expression):
+            raise NotImplementedError(expression)
+        # Fields whose path is missing are left out, as in Mongo expression objects
+        return {key: evaluate(document, value) for key, value in expression.items()
+                if not (isinstance(value, str) and value.startswith('$') and get_path(document, value[1:]) is MISSING)}
+    return expression
+
+def sort_documents(documents, order):
+    for field, direction in reversed(list(order.items() if isinstance(order, dict) else order)):
+        documents.sort(key=lambda document: sort_key(get_path(document, field)), reverse=direction < 0)
+    return documents
+
+def accumulate(documents, operator, operand):
+    if operator == '$first':
+        return evaluate(documents[0], operand)
+    if operator == '$last':
+        return evaluate(documents[-1], operand)
+    if operator == '$push':
+        return [evaluate(document, operand) for document in documents]
+    if operator == '$sum':
+        return sum(evaluate(document, operand) or 0 for document in documents)
+    if operator in ('$max', '$min'):
+        values = [value for value in (evaluate(document, operand) for document in documents) if value is not None]
+        pick = max if operator == '$max' else min
+        return pick(values, key=sort_key) if values else None
+    if operator == '$topN':
+        ordered = sort_documents(list(documents), operand['sortBy'])
+        return [evaluate(document, operand['output']) for document in ordered[:operand['n']]]
+    raise NotImplementedError(operator)
+
+def run_pipeline(documents, pipeline):
+    documents = [copy.deepcopy(dict(document)) for document in documents]
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == '$match':
+            documents = [document for document in documents if matches(document, spec)]
+        elif name == '$sort':
+            documents = sort_documents(documents, spec)
+        elif name == '$limit':
+            documents = documents[:spec]
+        elif name == '$skip':
+            documents = documents[spec:]
+        elif name == '$count':
+            documents = [{spec: len(documents)}] if documents else []
+        elif name == '$project':
+            documents = [project(document, spec) if all(value in (0, 1, True, False) for value in spec.values())
+                         else {**({'_id': document.get('_id')} if spec.get('_id', 1) else {}),
+                               **{key: evaluate(document, f'${key}' if value in (1, True) else value)
+                                  for key, value in spec.items() if key != '_id'}}
+                         for document in documents]
+        elif name == '$group':
+            accumulators = {field: next(iter(value.items())) for field, value in spec.items() if field != '_id'}
+            groups = {}
+            for document in documents:
+                key = evaluate(document, spec['_id'])
+                groups.setdefault(repr(key), (key, []))[1].append(document)
+            documents = [
+                {'_id': key, **{field: accumulate(members, operator, operand)
+                                for field, (operator, operand) in accumulators.items()}}
+                for key, members in groups.values()
+            ]
+        else:
+            raise NotImplementedError(name)
+    return documents
+
+class FakeCursor:
+    def __init__(self, documents, projection):
+        self.documents = documents
+        self.projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        keys = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else list(
+            key_or_list.items() if isinstance(key_or_list, dict) else key_or_list)
+        for field, order in reversed(keys):
+            if field == '$natural':
+                # Documents are held in insertion order, like a capped collection
+                if order < 0:
+                    self.documents.reverse()
+                continue
+            self.documents.sort(key=lambda document: sort_key(get_path(document, field)), reverse=order < 0)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def results(self):
+        documents = self.documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [project(document, self.projection) for document in documents]
+
+    def __iter__(self):
+        return iter(self.results())
+
+    def to_list(self, length=None):
+        return self.results()
+
+class FakeCollection:
+    """
+    A collection with a unique _id and optional unique compound keys
+    """
+    def __init__(self, name='collection'):
+        self.name = name
+        self.documents = []
+        self.unique = []
+        self.calls = 0
+
+    # Indexes are not modelled beyond uniqueness
+    def create_index(self, keys, unique=False, **kwargs):
+        if unique and not isinstance(keys, str):
+            self.unique.append([field for field, _ in keys])
+        return 'index'
+
+    def drop(self):
+        self.documents = []
+
+    def check_unique(self, document, ignore=None):
+        for existing in self.documents:
+            if existing is ignore:
+                continue
+            if existing.get('_id') == document.get('_id'):
+                raise DuplicateKeyError("duplicate _id", 11000)
+            for fields in self.unique:
+                if all(get_path(existing, field) == get_path(document, field) for field in fields):
+                    raise DuplicateKeyError(f"duplicate {fields}", 11000)
+
+    def insert_one(self, document):
+        self.calls += 1
+        document.setdefault('_id', ObjectId())
+        self.check_unique(document)
+        self.documents.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        errors = []
+        for index, document in enumerate(documents):
+            document.setdefault('_id', ObjectId())
+            try:
+                self.check_unique(document)
+            except DuplicateKeyError:
+                errors.append({'index': index, 'code': 11000, 'op': document})
+                if ordered:
+                    break
+                continue
+            self.documents.append(copy.deepcopy(document))
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(documents) - len(errors)})
+        return SimpleNamespace(inserted_ids=[document['_id'] for document in documents])
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, batch_size=None, **kwargs):
+        self.calls += 1
+        cursor = FakeCursor([document for document in self.documents if matches(document, filter)], projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.limit(limit)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.calls += 1
+        return FakeCursor(run_pipeline(self.documents, pipeline), None)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        results = self.find(filter, projection, sort=sort, limit=1).results()
+        return results[0] if results else None
+
+    def count_documents(self, query, **kwargs):
+        self.calls += 1
+        return sum(1 for document in self.documents if matches(document, query))
+
+    def distinct(self, field, query=None):
+        self.calls += 1
+        values = []
+        for document in self.documents:
+            value = get_path(document, field)
+            if matches(document, query) and value is not MISSING and value not in values:
+                values.append(value)
+        return values
+
+    def update(self, query, update, upsert, many):
+        matched = [document for document in self.documents if matches(document, query)]
+        if not many:
+            matched = matched[:1]
+        modified = 0
+        for document in matched:
+            before = copy.deepcopy(document)
+            apply_update(document, update)
+            try:
+                self.check_unique(document, ignore=document)
+            except DuplicateKeyError:
+                document.clear()
+                document.update(before)
+                raise
+            modified += document != before
+        upserted_id = None
+        if not matched and upsert:
+            document = seed_from_query(query)
+            apply_update(document, update, inserting=True)
+            document.setdefault('_id', ObjectId())
+            self.check_unique(document)
+            self.documents.append(document)
+            upserted_id = document['_id']
+        return SimpleNamespace(matched_count=len(matched), modified_count=modified, upserted_id=upserted_id)
+
+    def update_one(self, query, update, upsert=False, **kwargs):
+        self.calls += 1
+        return self.update(query, update, upsert, False)
+
+    def update_many(self, query, update, upsert=False, **kwargs):
+        self.calls += 1
+        return self.update(query, update, upsert, True)
+
+    def replace(self, query, replacement, upsert):
+        for index, document in enumerate(self.documents):
+            if matches(document, query):
+                new = copy.deepcopy(replacement)
+                new['_id'] = document['_id']
+                self.check_unique(new, ignore=document)
+                self.documents[index] = new
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            new = {**seed_from_query(query), **copy.deepcopy(replacement)}
+            new.setdefault('_id', ObjectId())
+            self.check_unique(new)
+            self.documents.append(new)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=new['_id'])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    def replace_one(self, query, replacement, upsert=False, **kwargs):
+        self.calls += 1
+        return self.replace(query, replacement, upsert)
+
+    def delete(self, query, many):
+        deleted = 0
+        for document in list(self.documents):
+            if matches(document, query):
+                self.documents.remove(document)
+                deleted += 1
+                if not many:
+                    break
+        return SimpleNamespace(deleted_count=deleted)
+
+    def delete_one(self, query, **kwargs):
+        self.calls += 1
+        return self.delete(query, False)
+
+    def delete_many(self, query, **kwargs):
+        self.calls += 1
+        return self.delete(query, True)
+
+    def bulk_write(self, operations, ordered=True, **kwargs):
+        self.calls += 1
+        result = SimpleNamespace(modified_count=0, upserted_count=0, inserted_count=0, deleted_count=0,
+                                 matched_count=0)
+        errors = []
+        for index, operation in enumerate(operations):
+            try:
+                if isinstance(operation, InsertOne):
+                    document = operation._doc
+                    document.setdefault('_id', ObjectId())
+                    self.check_unique(document)
+                    self.documents.append(copy.deepcopy(document))
+                    result.inserted_count += 1
+                elif isinstance(operation, (UpdateOne, UpdateMany)):
+                    outcome = self.update(operation._filter, operation._doc, operation._upsert,
+                                          isinstance(operation, UpdateMany))
+                    result.matched_count += outcome.matched_count
+                    result.modified_count += outcome.modified_count
+                    result.upserted_count += outcome.upserted_id is not None
+                elif isinstance(operation, ReplaceOne):
+                    outcome = self.replace(operation._filter, operation._doc, operation._upsert)
+                    result.modified_count += outcome.modified_count
+                    result.upserted_count += outcome.upserted_id is not None
+                elif isinstance(operation, (DeleteOne, DeleteMany)):
+                    result.deleted_count += self.delete(operation._filter, isinstance(operation, DeleteMany)).deleted_count
+                else:
+                    raise NotImplementedError(type(operation).__name__)
+            except DuplicateKeyError:
+                errors.append({'index': index, 'code': 11000, 'op': operation})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors})
+        return result
+
+class FakeDB(dict):
+    """
+    A database whose collections spring into existence on first use
+    """
+    def __missing__(self, name):
+        self[name] = FakeCollection(name)
+        return self[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def create_collection(self, name, **kwargs):
+        return self[name]
+
+    def list_collection_names(self):
+        return list(self)
+
+def to_raw(document):
+    return RawBSONDocument(bson.encode(document))
+
+class AsyncCursor:
+    def __init__(self, cursor, raw=False):
+        self.cursor = cursor
+        self.raw = raw
+        self.iterator = None
+
+    def sort(self, *args, **kwargs):
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self.cursor.limit(count)
+        return self
+
+    def skip(self, count):
+        self.cursor.skip(count)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def results(self):
+        results = self.cursor.results()
+        return [to_raw(document) for document in results] if self.raw else results
+
+    async def to_list(self, length=None):
+        return self.results()
+
+    async def close(self):
+        self.closed = True
+
+    def __aiter__(self):
+        self.iterator = iter(self.results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class AsyncCollection:
+    """
+    The AsyncMongoClient view of a FakeCollection; `raw` returns RawBSONDocuments like RAW_BSON reads
+    """
+    def __init__(self, collection, raw=False):
+        self.collection = collection
+        self.raw = raw
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs), self.raw)
+
+    async def find_one(self, *args, **kwargs):
+        document = self.collection.find_one(*args, **kwargs)
+        return to_raw(document) if self.raw and document is not None else document
+
+    async def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self.collection.aggregate(*args, **kwargs), self.raw)
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+class AsyncFakeDB:
+    def __init__(self, db=None, raw=False):
+        self.sync = db if db is not None else FakeDB()
+        self.raw = raw
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.sync[name], self.raw)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('sync', 'raw'):
+            raise AttributeError(name)
+        return self[name]
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from starlette.routing import Route
+
+import admission
+from admission import POOLS, ROUTE_LIMITERS, AdmissionMiddleware, Limiter, limiters_for
+
+def test_id_listings_share_the_cheap_pool():
+    assert limiters_for('/products/all') == [POOLS['cheap']]
+    assert limiters_for('/products/{platform}') == [POOLS['cheap']]
+
+def test_scans_use_the_heavy_pool_behind_their_route_limit():
+    assert limiters_for('/search') == [POOLS['heavy']]
+    assert limiters_for('/analytics/quantiles') == [POOLS['heavy']]
+    assert limiters_for('/export/{platform}') == [ROUTE_LIMITERS['/export/{platform}'], POOLS['heavy']]
+
+def test_exempt_routes_are_never_limited():
+    assert limiters_for('/metrics') == []
+    assert limiters_for('/stream/price-changes') == []
+
+def test_limiter_queues_up_to_its_limit_then_rejects():
+    async def scenario():
+        limiter = Limiter('test', limit=1, queue=1)
+        assert await limiter.acquire(1)
+        waiter = asyncio.ensure_future(limiter.acquire(1))
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        # The queue is full: turned away without waiting
+        assert not await limiter.acquire(1)
+        limiter.release()
+        assert await waiter
+        assert (limiter.active, limiter.waiting, limiter.rejected) == (1, 0, 1)
+
+    asyncio.run(scenario())
+
+def test_limiter_gives_up_after_the_timeout():
+    async def scenario():
+        limiter = Limiter('test', limit=1, queue=4)
+        await limiter.acquire(1)
+        assert not await limiter.acquire(0.01)
+        assert (limiter.active, limiter.waiting, limiter.rejected) == (1, 0, 1)
+
+    asyncio.run(scenario())
+
+async def endpoint(request):
+    pass
+
+def heavy_pool(monkeypatch, queue):
+    limiter = Limiter('heavy', 1, queue)
+    monkeypatch.setitem(POOLS, 'heavy', limiter)
+    monkeypatch.setattr(admission, 'QUEUE_TIMEOUT_SECONDS', 0.01)
+    return limiter
+
+async def call(middleware):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/search', 'headers': []}
+    await middleware(scope, None, send)
+    return messages
+
+def blocking_app(release):
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+    return app
+
+@pytest.mark.parametrize('queue', [0, 1])
+def test_full_queue_or_timeout_answers_503_with_retry_after(monkeypatch, queue):
+    limiter = heavy_pool(monkeypatch, queue)
+
+    async def scenario():
+        release = asyncio.Event()
+        middleware = AdmissionMiddleware(blocking_app(release), [Route('/search', endpoint)])
+        first = asyncio.ensure_future(call(middleware))
+        await asyncio.sleep(0)
+        # Rejected at once with queue=0, after the queue timeout with queue=1
+        rejected = await call(middleware)
+        release.set()
+        return await first, rejected
+
+    served, rejected = asyncio.run(scenario())
+    assert served[0]['status'] == 200
+    assert rejected[0]['status'] == 503
+    assert dict(rejected[0]['headers'])[b'retry-after'] == str(admission.RETRY_AFTER_SECONDS).encode()
+    assert (limiter.active, limiter.waiting, limiter.rejected) == (0, 0, 1)
+
+def test_slot_is_released_when_the_handler_raises(monkeypatch):
+    limiter = heavy_pool(monkeypatch, 0)
+
+    async def app(scope, receive, send):
+        raise RuntimeError("handler failed")
+
+    middleware = AdmissionMiddleware(app, [Route('/search', endpoint)])
+    with pytest.raises(RuntimeError):
+        asyncio.run(call(middleware))
+    assert limiter.active == 0
+    assert not limiter.semaphore.locked()
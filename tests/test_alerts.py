@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+# alerts imports requests for its webhook notifier
+requests = pytest.importorskip('requests')
+
+import alerts
+from alerts import (AlertEngine, FakeDiscountRule, ItemState, NewLowRule, Notifier, PriceAnomalyRule,
+                    PriceDropRule, Rule, StockOutRule)
+from tests.fakes import FakeDB
+
+START = datetime(2025, 1, 1)
+
+def event(number, old_price, new_price, old_stock=10, new_stock=10, day=None):
+    change = round((new_price - old_price) / old_price * 100, 2) if old_price and new_price is not None else None
+    return {'_id': number, 'platform': 'tiki', 'item_id': 1, 'old_price': old_price, 'new_price': new_price,
+            'old_stock': old_stock, 'new_stock': new_stock, 'change_pct': change,
+            'scraped_timestamp': START + timedelta(days=number if day is None else day)}
+
+def state_with(prices):
+    state = ItemState(30)
+    for day, price in enumerate(prices):
+        state.observe(event(day, state.price, price))
+    return state
+
+def test_base_classes_are_abstract():
+    with pytest.raises(TypeError):
+        Rule()
+    with pytest.raises(TypeError):
+        Notifier()
+
+def test_price_drop():
+    rule = PriceDropRule(min_drop_pct=15)
+    assert rule.evaluate(state_with([100]), event(1, 100, 80))
+    assert rule.evaluate(state_with([100]), event(1, 100, 90)) is None
+    assert rule.evaluate(state_with([100]), event(1, 100, 150)) is None
+
+def test_new_low_needs_enough_samples():
+    rule = NewLowRule(min_samples=3)
+    assert rule.evaluate(state_with([100, 90]), event(2, 90, 50)) is None
+    detail = rule.evaluate(state_with([100, 90, 95]), event(3, 95, 85))
+    assert detail['previous_low'] == 90
+    assert rule.evaluate(state_with([100, 90, 95]), event(3, 95, 90)) is None
+
+def test_fake_discount_undoes_a_recent_raise():
+    rule = FakeDiscountRule(raise_pct=10, within_days=30, tolerance_pct=2)
+    state = state_with([100, 100, 130])
+    detail = rule.evaluate(state, event(3, 130, 100))
+    assert (detail['base_price'], detail['peak_price']) == (100, 130)
+    # A cut well below the base is a real discount
+    assert rule.evaluate(state, event(3, 130, 80)) is None
+
+def test_fake_discount_ignores_old_raises():
+    rule = FakeDiscountRule(raise_pct=10, within_days=30)
+    state = state_with([100, 130])
+    assert rule.evaluate(state, event(3, 130, 100, day=90)) is None
+
+def test_stock_out():
+    rule = StockOutRule()
+    assert rule.evaluate(state_with([100]), event(1, 100, 100, old_stock=5, new_stock=0))
+    assert rule.evaluate(state_with([100]), event(1, 100, 100, old_stock=0, new_stock=0)) is None
+
+def test_price_anomaly():
+    rule = PriceAnomalyRule(deviation_pct=40, min_samples=3)
+    state = state_with([100, 105, 95])
+    assert rule.evaluate(state, event(3, 95, 200))['median'] == 100
+    assert rule.evaluate(state, event(3, 95, 120)) is None
+
+def test_stock_only_moves_keep_the_window():
+    state = state_with([100])
+    state.observe(event(1, 100, 100, old_stock=10, new_stock=0))
+    assert len(state.prices) == 1
+
+def test_load_rules_rejects_unknown_rule(tmp_path):
+    path = tmp_path / 'rules.yaml'
+    path.write_text('window: 10\nrules:\n  - rule: price_drop\n    min_drop_pct: 5\n  - rule: nope\n')
+    with pytest.raises(ValueError):
+        alerts.load_rules(str(path))
+    path.write_text('window: 10\nrules:\n  - rule: price_drop\n    min_drop_pct: 5\n')
+    rules, window = alerts.load_rules(str(path))
+    assert window == 10 and rules[0].min_drop_pct == 5
+
+class RecordingNotifier(Notifier):
+    def __init__(self, label='recording', fail=False):
+        self.label = label
+        self.sent = []
+        self.fail = fail
+
+    @property
+    def name(self):
+        return self.label
+
+    def notify(self, alerts):
+        if self.fail:
+            raise RuntimeError("crashed while notifying")
+        self.sent += [alert['_id'] for alert in alerts]
+
+def engine_with(*notifiers, db=None):
+    db = db if db is not None else FakeDB()
+    return AlertEngine(db, [StockOutRule()], list(notifiers)), db
+
+def stored(db):
+    return db[alerts.COLLECTION].find_one({'_id': 'stock_out:1'})
+
+def test_flush_marks_alerts_notified():
+    notifier = RecordingNotifier()
+    engine, db = engine_with(notifier)
+    engine.process(event(1, 100, 100, old_stock=5, new_stock=0))
+    engine.flush()
+    assert notifier.sent == ['stock_out:1']
+    assert stored(db)['notified'] is True
+    assert stored(db)['notified_by'] == ['recording']
+
+def test_alerts_stored_before_a_crash_are_resent():
+    crashing = RecordingNotifier(fail=True)
+    engine, db = engine_with(crashing)
+    engine.process(event(1, 100, 100, old_stock=5, new_stock=0))
+    with pytest.raises(RuntimeError):
+        engine.flush()
+    assert stored(db)['notified'] is False
+
+    notifier = RecordingNotifier()
+    restarted, _ = engine_with(notifier, db=db)
+    restarted.resend()
+    assert notifier.sent == ['stock_out:1']
+    assert stored(db)['notified'] is True
+
+    # The replayed event is a duplicate and is not sent again
+    restarted.process(event(1, 100, 100, old_stock=5, new_stock=0))
+    restarted.flush()
+    assert notifier.sent == ['stock_out:1']
+
+def test_a_failing_notifier_does_not_stop_the_others_or_get_skipped():
+    log, webhook = RecordingNotifier('log'), RecordingNotifier('webhook', fail=True)
+    engine, db = engine_with(log, webhook)
+    engine.process(event(1, 100, 100, old_stock=5, new_stock=0))
+    with pytest.raises(RuntimeError):
+        engine.flush()
+    assert log.sent == ['stock_out:1']
+    assert stored(db)['notified'] is False
+    assert stored(db)['notified_by'] == ['log']
+
+    # On restart only the notifier that missed the alert gets it
+    webhook.fail = False
+    restarted, _ = engine_with(log, webhook, db=db)
+    restarted.resend()
+    assert log.sent == ['stock_out:1']
+    assert webhook.sent == ['stock_out:1']
+    assert stored(db)['notified'] is True
+
+def test_webhook_failures_are_raised(monkeypatch):
+    def post(url, **kwargs):
+        response = requests.Response()
+        response.status_code = 502
+        return response
+
+    monkeypatch.setattr(alerts.requests, 'post', post)
+    with pytest.raises(requests.HTTPError):
+        alerts.WebhookNotifier('http://hooks.invalid/prices').notify([{'_id': 'stock_out:1'}])
+
+def test_email_failures_are_raised(monkeypatch):
+    def refuse(*args, **kwargs):
+        raise ConnectionRefusedError("no SMTP server")
+
+    monkeypatch.setattr(alerts.smtplib, 'SMTP_SSL', refuse)
+    alert = {'rule': 'stock_out', 'platform': 'tiki', 'item_id': 1, 'message': "Out of stock (had 5)"}
+    with pytest.raises(OSError):
+        alerts.EmailNotifier('me@example.com').notify([alert])
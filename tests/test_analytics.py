@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import analytics
+import backendv2
+
+def facet(pipeline):
+    return pipeline[-1]['$facet']
+
+def test_items_are_counted_by_grouping_not_by_a_set():
+    stages = facet(analytics.summary_pipeline(None, None))
+    assert '$addToSet' not in repr(stages)
+    assert stages['overall_items'] == [
+        {'$group': {'_id': {'platform': '$platform', 'item_id': '$item_id'}}},
+        {'$count': 'items'},
+    ]
+    assert stages['platform_items'][1] == {'$group': {'_id': '$_id.platform', 'items': {'$sum': 1}}}
+
+def test_medians_can_be_left_out():
+    assert '$median' in repr(analytics.summary_pipeline(None, None))
+    assert '$median' not in repr(analytics.summary_pipeline(None, None, medians=False))
+
+def test_format_summary_joins_item_counts():
+    row = {
+        'platforms': [{'_id': 'lazada', 'snapshots': 4, 'price': {'mean': 10}},
+                      {'_id': 'tiki', 'snapshots': 2, 'price': {'mean': 20}}],
+        'overall': [{'_id': None, 'snapshots': 6, 'price': {'mean': 13}}],
+        'platform_items': [{'_id': 'tiki', 'items': 1}, {'_id': 'lazada', 'items': 2}],
+        'overall_items': [{'items': 3}],
+    }
+    summary = analytics.format_summary(row)
+    assert summary['platforms']['lazada'] == {'snapshots': 4, 'items': 2, 'price': {'mean': 10}}
+    assert summary['platforms']['tiki']['items'] == 1
+    assert summary['overall'] == {'snapshots': 6, 'items': 3, 'price': {'mean': 13}}
+    assert analytics.format_summary({}) == {'platforms': {}, 'overall': {'snapshots': 0, 'items': 0}}
+
+class OldServer:
+    """
+    A collection on a server without $median
+    """
+    def __init__(self):
+        self.pipelines = []
+
+    async def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        if '$median' in repr(pipeline):
+            raise OperationFailure("Unrecognized accumulator operator: $median", 15952)
+
+        class Cursor:
+            async def to_list(self):
+                return [{'overall': [{'snapshots': 1}], 'overall_items': [{'items': 1}]}]
+        return Cursor()
+
+def test_summary_falls_back_without_medians(monkeypatch):
+    collection = OldServer()
+    monkeypatch.setattr(backendv2, 'db', {analytics.PLATFORMS[0]: collection})
+    summary = asyncio.run(backendv2.load_summary(None, None))
+    assert summary['overall'] == {'snapshots': 1, 'items': 1}
+    assert len(collection.pipelines) == 2
+
+def test_distribution_rejects_unknown_fields():
+    with pytest.raises(ValueError):
+        analytics.distribution_pipeline('title', 10, ['tiki'], None, None)
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+
+import bson
+import orjson
+import pytest
+from bson.raw_bson import RawBSONDocument
+from pydantic import ValidationError
+
+import backendv2
+from backendv2 import BatchItem, BatchRequest
+from tests.fakes import AsyncFakeDB, FakeDB
+
+def store(collection, document):
+    # As the raw_db codec returns it; the fake reads nested fields through the Mapping interface
+    collection.documents.append(RawBSONDocument(bson.encode(document)))
+
+@pytest.fixture
+def db(monkeypatch):
+    sync = FakeDB()
+    for day, price in [(1, 100), (2, 90)]:
+        store(sync['tiki'], {'_id': day, 'id': 7, 'name': 'Tivi', 'price': price,
+                             'scraped_timestamp': datetime(2025, 1, day)})
+    store(sync['lazada'], {'_id': 3, 'responseBody': {'itemId': 9, 'title': 'MacBook'},
+                           'scraped_timestamp': datetime(2025, 1, 1)})
+    for day, price in [(1, 100), (2, 90)]:
+        sync['price_history_daily'].insert_one({'platform': 'tiki', 'item_id': 7, 'day': datetime(2025, 1, day),
+                                                'price': price, 'stock': 1, 'refreshed_at': datetime(2025, 1, 2)})
+    monkeypatch.setattr(backendv2, 'db', AsyncFakeDB(sync))
+    monkeypatch.setattr(backendv2, 'raw_db', AsyncFakeDB(sync))
+    monkeypatch.setattr(backendv2, 'backfilled_platforms', {'tiki'})
+    return sync
+
+def batch(*items):
+    return BatchRequest(items=[BatchItem(platform=platform, id=item_id) for platform, item_id in items])
+
+def post(endpoint, request):
+    return orjson.loads(asyncio.run(endpoint(request)).body)
+
+def test_products_come_back_in_request_order_with_statuses(db):
+    results = post(backendv2.get_products_batch,
+                   batch(('lazada', '9'), ('tiki', 7), ('ebay', 1), ('tiki', '8'), ('tiki', '7')))
+    assert [(result['id'], result['status']) for result in results] == \
+        [('9', 200), (7, 200), (1, 400), ('8', 404), ('7', 200)]
+    assert results[0]['data']['title'] == 'MacBook'
+    # The latest snapshot of the item
+    assert results[1]['data']['price'] == 90 and results[4]['data'] == results[1]['data']
+
+def test_duplicate_ids_are_queried_once(db):
+    assert backendv2.group_batch_ids(batch(('tiki', '7'), ('tiki', 7), ('lazada', '9'), ('ebay', 1)).items) == \
+        {'tiki': [7], 'lazada': [9]}
+
+def test_price_histories_match_the_single_endpoint(db):
+    results = post(backendv2.get_price_history_batch, batch(('tiki', '7'), ('tiki', '8')))
+    single = asyncio.run(backendv2.build_price_history('tiki', '7', None, None))
+    assert results[0]['status'] == 200
+    assert results[0]['data'] == orjson.loads(orjson.dumps(single))
+    assert results[0]['data']['statistics']['latest_price'] == 90
+    assert results[1]['status'] == 404
+
+def test_batch_size_is_bounded():
+    with pytest.raises(ValidationError):
+        BatchRequest(items=[])
+    with pytest.raises(ValidationError):
+        batch(*[('tiki', number) for number in range(backendv2.MAX_BATCH_ITEMS + 1)])
+
+@pytest.fixture
+def review_db(db):
+    for number in range(3):
+        db['reviews'].insert_one({'platform': 'tiki', 'item_id': 7, 'review_id': number, 'rating': 5,
+                                  'created_at': datetime(2025, 1, 1 + number), 'content': f'review {number}'})
+    db['review'].insert_one({'id': '7', 'data': [], 'stars': {'5': 3}})
+    # A summary without stored reviews yet
+    db['review'].insert_one({'id': '8', 'data': [], 'stars': {}})
+    return db
+
+def test_review_items_match_the_single_endpoint(review_db):
+    results = post(backendv2.get_product_reviews_batch, batch(('tiki', '7'), ('tiki', '8'), ('tiki', '9')))
+    single = asyncio.run(backendv2.get_product_reviews('tiki', '7', sort='newest',
+                                                       limit=backendv2.DEFAULT_REVIEW_PAGE_SIZE, after=None))
+    expected = orjson.loads(single.body)
+    assert results[0]['status'] == 200
+    assert results[0]['data'] == expected
+    assert [review['review_id'] for review in expected['reviews']] == [2, 1, 0]
+    assert expected['review']['total_reviews'] == 3
+
+    assert results[1]['status'] == 200
+    assert results[1]['data']['reviews'] == [] and results[1]['data']['review']['total_reviews'] == 0
+    assert results[2]['status'] == 404
+
+def test_lazada_review_summary_comes_from_the_latest_snapshot(db):
+    store(db['lazada'], {'_id': 4, 'responseBody': {'itemId': 9, 'ratingCountByScore': [0, 0, 0, 1, 2]},
+                         'scraped_timestamp': datetime(2025, 1, 2)})
+    results = post(backendv2.get_product_reviews_batch, batch(('lazada', 9)))
+    single = asyncio.run(backendv2.get_product_reviews('lazada', '9', sort='newest',
+                                                       limit=backendv2.DEFAULT_REVIEW_PAGE_SIZE, after=None))
+    assert results[0]['data'] == orjson.loads(single.body)
+    assert results[0]['data']['review'] == {'_id': 9, 'total_reviews': 0, 'rating_summary': [0, 0, 0, 1, 2]}
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from cache import CacheInvalidator, ResponseCache, SingleFlight, change_tags, ingest_log_tags, make_key
+
+
+def test_make_key_sorts_and_drops_missing_params():
+    assert make_key('products', platform='tiki', after=None, limit=10) == 'products?limit=10&platform=tiki'
+
+
+def test_snapshot_insert_invalidates_item_and_lists():
+    change = {
+        'operationType': 'insert',
+        'ns': {'coll': 'tiki'},
+        'fullDocument': {'id': 197665885},
+    }
+    assert change_tags(change) == [
+        'products', 'products:tiki', 'product:tiki:197665885', 'reviews:tiki:197665885'
+    ]
+
+
+def test_derived_collection_updates_invalidate_their_item():
+    for collection in ('products', 'product_search', 'product_matches'):
+        change = {
+            'operationType': 'update',
+            'ns': {'coll': collection},
+            'fullDocument': {'platform': 'lazada', 'item_id': 42},
+        }
+        assert change_tags(change) == ['products', 'products:lazada', 'product:lazada:42', 'reviews:lazada:42']
+
+
+def test_sketch_updates_invalidate_platform_lists():
+    change = {'operationType': 'replace', 'ns': {'coll': 'sketches'}, 'fullDocument': {'platform': 'shopee'}}
+    assert change_tags(change) == ['products', 'products:shopee']
+
+
+def test_derived_collections_are_watched():
+    assert {'products', 'product_search', 'product_matches', 'sketches'} <= set(CacheInvalidator.WATCHED)
+
+
+def test_history_and_review_changes():
+    history = {'operationType': 'insert', 'ns': {'coll': 'price_history_daily'},
+               'fullDocument': {'platform': 'tiki', 'item_id': 1}}
+    review = {'operationType': 'insert', 'ns': {'coll': 'review'}, 'fullDocument': {'id': 7}}
+    assert change_tags(history) == ['history:tiki:1']
+    assert change_tags(review) == ['reviews:shopee:7', 'reviews:tiki:7']
+
+
+def test_unattributable_changes_clear_everything():
+    assert change_tags({'operationType': 'delete', 'ns': {'coll': 'tiki'}}) is None
+    assert change_tags({'operationType': 'insert', 'ns': {'coll': 'tiki'}}) is None
+
+
+def test_ingest_log_tags():
+    assert ingest_log_tags({'source': 'ingest', 'platform': 'tiki', 'item_ids': [1, 2]}) == [
+        'products', 'products:tiki', 'product:tiki:1', 'reviews:tiki:1',
+        'products', 'products:tiki', 'product:tiki:2', 'reviews:tiki:2',
+    ]
+    assert ingest_log_tags({'source': 'price_history_daily', 'platform': None, 'item_ids': []}) == ['history']
+    assert ingest_log_tags({'source': 'ingest', 'platform': 'review', 'item_ids': [7]}) == [
+        'reviews:shopee:7', 'reviews:tiki:7'
+    ]
+
+
+def test_invalidation_evicts_tagged_entries_in_both_levels(tmp_path):
+    async def scenario():
+        cache = ResponseCache(shared_path=str(tmp_path / 'cache.sqlite'))
+        await cache.set('a', b'1', ['products:tiki'])
+        await cache.set('b', b'2', ['products:lazada'])
+        await cache.invalidate(['products:tiki'])
+        assert await cache.get('a') is None
+        assert await cache.get('b') == b'2'
+
+        # A second worker sees the shared level
+        other = ResponseCache(shared_path=str(tmp_path / 'cache.sqlite'))
+        assert await other.get('b') == b'2'
+        assert await other.get('a') is None
+
+    asyncio.run(scenario())
+
+
+def test_results_computed_before_an_invalidation_are_not_stored():
+    async def scenario():
+        cache = ResponseCache(shared_path=None)
+        version = cache.version
+        await cache.invalidate(['products'])
+        await cache.set('a', b'stale', ['products'], version)
+        assert await cache.get('a') is None
+
+    asyncio.run(scenario())
+
+def test_single_flight_runs_one_load_for_concurrent_callers():
+    flight = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'value': 1}
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do('key', load) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [{'value': 1}] * 5
+    assert len(calls) == 1
+    assert flight.collapsed == 4
+    assert flight.flights == {}
+
+def test_single_flight_error_reaches_every_waiter_and_frees_the_key():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("load failed")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do('key', failing) for _ in range(3)), return_exceptions=True)
+        assert flight.flights == {}
+        # The next caller loads again instead of reusing the failure
+        with pytest.raises(ValueError):
+            await flight.do('key', failing)
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 2
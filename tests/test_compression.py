@@ -0,0 +1,70 @@
+import asyncio
+import gzip
+
+import pytest
+
+from compression import CompressionMiddleware, negotiate
+
+ETAG = '"0123456789abcdef"'
+
+def make_app(status, body=b'', content_type='application/json'):
+    async def app(scope, receive, send):
+        headers = [(b'etag', ETAG.encode())]
+        if content_type:
+            headers.append((b'content-type', content_type.encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+    return app
+
+def call(app, accept_encoding, if_none_match=None):
+    scope = {'type': 'http', 'headers': [(b'accept-encoding', accept_encoding.encode())]}
+    if if_none_match:
+        scope['headers'].append((b'if-none-match', if_none_match.encode()))
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(CompressionMiddleware(app, minimum_size=16)(scope, receive, send))
+    start = messages[0]
+    return start['status'], {name.decode(): value.decode() for name, value in start['headers']}, messages[1]
+
+def test_negotiate_prefers_known_codings():
+    assert negotiate('gzip') == 'gzip'
+    assert negotiate('identity') is None
+    assert negotiate(None) is None
+
+def test_compressed_200_has_weak_etag():
+    status, headers, body = call(make_app(200, b'{"a": 1}' * 100), 'gzip')
+    assert status == 200
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['etag'] == 'W/' + ETAG
+    assert gzip.decompress(body['body']) == b'{"a": 1}' * 100
+
+@pytest.mark.parametrize('content_type', ['application/json', None])
+def test_304_carries_the_same_etag_as_the_compressed_200(content_type):
+    _, compressed, _ = call(make_app(200, b'{"a": 1}' * 100), 'gzip')
+    status, headers, body = call(make_app(304, content_type=content_type), 'gzip', compressed['etag'])
+    assert status == 304
+    assert headers['etag'] == compressed['etag']
+    assert 'accept-encoding' in headers['vary'].lower()
+    assert 'content-encoding' not in headers
+    assert body['body'] == b''
+
+def test_uncompressed_responses_keep_strong_etag():
+    _, headers, _ = call(make_app(200, b'{}'), 'gzip')
+    assert headers['etag'] == ETAG
+    _, headers, _ = call(make_app(304), 'identity')
+    assert headers['etag'] == ETAG
+
+def test_304_for_a_body_below_the_threshold_keeps_strong_etag():
+    _, small, _ = call(make_app(200, b'{}'), 'gzip')
+    status, headers, _ = call(make_app(304), 'gzip', small['etag'])
+    assert status == 304
+    assert headers['etag'] == small['etag'] == ETAG
+    # Revalidating several copies: the encoded one decides
+    _, headers, _ = call(make_app(304), 'gzip', f'"other", W/{ETAG}')
+    assert headers['etag'] == 'W/' + ETAG
@@ -0,0 +1,57 @@
+import asyncio
+import importlib
+
+import bson
+import orjson
+import pytest
+from bson.raw_bson import RawBSONDocument
+from pymongo import AsyncMongoClient, monitoring
+
+import backend
+import database
+from tests.fakes import AsyncFakeDB, FakeDB
+
+class Listener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+@pytest.fixture
+def configured(monkeypatch):
+    monkeypatch.setenv('MONGO_MAX_POOL_SIZE', '25')
+    monkeypatch.setenv('MONGO_MIN_POOL_SIZE', '2')
+    monkeypatch.setenv('MONGO_MAX_IDLE_TIME_MS', '30000')
+    monkeypatch.setenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '1500')
+    yield importlib.reload(database)
+    monkeypatch.undo()
+    importlib.reload(database)
+
+def test_pool_is_sized_from_the_environment(configured):
+    listener = Listener()
+    client = configured.create_async_client(event_listeners=[listener])
+    try:
+        assert isinstance(client, AsyncMongoClient)
+        pool = client.options.pool_options
+        assert (pool.max_pool_size, pool.min_pool_size) == (25, 2)
+        assert pool.max_idle_time_seconds == 30
+        assert pool.wait_queue_timeout == 1.5
+        assert listener in client.options.event_listeners
+    finally:
+        asyncio.run(client.close())
+
+def test_product_endpoints_await_the_async_client(monkeypatch):
+    sync = FakeDB()
+    document = {'_id': 1, 'responseBody': {'itemId': 42, 'title': 'MacBook Air M1'}, 'scraped_timestamp': 'x'}
+    # Stored as the raw_db codec returns it
+    sync['lazada'].documents.append(RawBSONDocument(bson.encode(document)))
+    monkeypatch.setattr(backend, 'db', AsyncFakeDB(sync))
+    monkeypatch.setattr(backend, 'raw_db', AsyncFakeDB(sync))
+
+    assert asyncio.run(backend.get_product_list()) == {'product_ids': [42]}
+    response = asyncio.run(backend.get_product_details('42'))
+    assert orjson.loads(response.body) == {'_id': 1, 'itemId': 42, 'title': 'MacBook Air M1', 'scraped_timestamp': 'x'}
@@ -0,0 +1,119 @@
+from diagnostics import operation_shape, summarize_explain
+
+FIND_IXSCAN = {
+    'queryPlanner': {
+        'winningPlan': {
+            'stage': 'FETCH',
+            'inputStage': {'stage': 'IXSCAN', 'indexName': 'platform_1_item_id_1_review_id_1'},
+        },
+        'rejectedPlans': [],
+    },
+    'executionStats': {
+        'nReturned': 20,
+        'totalKeysExamined': 20,
+        'totalDocsExamined': 20,
+        'executionStages': {'stage': 'FETCH', 'nReturned': 20, 'inputStage': {'stage': 'IXSCAN', 'nReturned': 20}},
+    },
+}
+
+FIND_COLLSCAN_SORT = {
+    'queryPlanner': {
+        'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}},
+    },
+    'executionStats': {
+        'nReturned': 5,
+        'totalKeysExamined': 0,
+        'totalDocsExamined': 120000,
+        'executionStages': {'stage': 'SORT', 'nReturned': 5, 'inputStage': {'stage': 'COLLSCAN', 'nReturned': 400}},
+    },
+}
+
+LOOKUP = {
+    'stages': [
+        {'$cursor': {'executionStats': {'nReturned': 10, 'totalDocsExamined': 10, 'totalKeysExamined': 10}}},
+        {'$lookup': {'from': 'reviews'}, 'totalDocsExamined': 40, 'totalKeysExamined': 40},
+    ],
+}
+
+AGGREGATE = {
+    'stages': [
+        {'$cursor': {
+            'queryPlanner': {'winningPlan': {'stage': 'IXSCAN', 'indexName': 'scraped_timestamp_1'}},
+            'executionStats': {'nReturned': 300, 'totalKeysExamined': 300, 'totalDocsExamined': 0},
+        }},
+        {'$group': {'_id': '$item_id'}},
+        {'$sort': {'sortKey': {'_id': 1}}},
+    ],
+}
+
+SHARDED = {
+    'executionStats': {
+        'nReturned': 7,
+        'totalKeysExamined': 30,
+        'totalDocsExamined': 10,
+        'executionStages': {
+            'stage': 'SHARD_MERGE',
+            'shards': [
+                {'executionStages': {'stage': 'IXSCAN', 'indexName': 'a_1'}, 'totalDocsExamined': 4},
+                {'executionStages': {'stage': 'IXSCAN', 'indexName': 'a_1'}, 'totalDocsExamined': 6},
+            ],
+        },
+    },
+}
+
+def test_indexed_find():
+    summary = summarize_explain(FIND_IXSCAN)
+    assert summary['plan_stages'] == ['FETCH', 'IXSCAN']
+    assert summary['indexes'] == ['platform_1_item_id_1_review_id_1']
+    assert summary['returned'] == 20
+    assert summary['docs_examined'] == 20
+    assert summary['keys_examined'] == 20
+    assert not summary['collscan']
+    assert not summary['in_memory_sort']
+
+def test_collection_scan_with_blocking_sort():
+    summary = summarize_explain(FIND_COLLSCAN_SORT)
+    assert summary['collscan']
+    assert summary['in_memory_sort']
+    assert summary['indexes'] == []
+    assert summary['docs_examined'] == 120000
+    # The top-level figure, not the one of the scan below the sort
+    assert summary['returned'] == 5
+
+def test_aggregate_pipeline_stages():
+    summary = summarize_explain(AGGREGATE)
+    assert summary['pipeline_stages'] == ['$cursor', '$group', '$sort']
+    assert summary['indexes'] == ['scraped_timestamp_1']
+    assert summary['returned'] == 300
+    assert not summary['collscan']
+    assert summary['in_memory_sort']
+
+def test_shard_totals_are_not_counted_twice():
+    summary = summarize_explain(SHARDED)
+    assert summary['docs_examined'] == 10
+    assert summary['keys_examined'] == 30
+    assert summary['plan_stages'] == ['IXSCAN', 'SHARD_MERGE']
+
+def test_pipeline_stage_totals_add_up():
+    summary = summarize_explain(LOOKUP)
+    assert summary['docs_examined'] == 50
+    assert summary['keys_examined'] == 50
+
+def test_empty_explain():
+    summary = summarize_explain({})
+    assert summary['returned'] is None
+    assert summary['plan_stages'] == []
+    assert not summary['collscan']
+
+def test_operation_shape_ignores_values():
+    first = operation_shape('find', {'find': 'tiki', 'filter': {'id': 1, 'scraped_timestamp': {'$gte': 1}},
+                                     'sort': {'scraped_timestamp': -1}})
+    second = operation_shape('find', {'find': 'tiki', 'filter': {'scraped_timestamp': {'$lt': 9}, 'id': 2},
+                                      'sort': {'scraped_timestamp': -1}})
+    assert first == second
+    assert first != operation_shape('find', {'find': 'lazada', 'filter': {'id': 1, 'scraped_timestamp': 1}})
+
+def test_aggregate_shape_follows_stages():
+    pipeline = [{'$match': {'platform': 'tiki'}}, {'$group': {'_id': '$item_id'}}]
+    assert operation_shape('aggregate', {'aggregate': 'tiki', 'pipeline': pipeline}) == \
+        ('aggregate', 'tiki', ('$match', '$group'))
@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from starlette.requests import Request
+
+import backendv2
+import registry
+from cache import ResponseCache
+from etag import etag_matches, make_etag
+from tests.fakes import AsyncFakeDB, FakeDB
+
+def request(if_none_match=None):
+    headers = [(b'if-none-match', if_none_match.encode())] if if_none_match else []
+    return Request({'type': 'http', 'method': 'GET', 'path': '/', 'headers': headers})
+
+def test_weak_comparison():
+    etag = make_etag('product', 'tiki', 1)
+    assert etag_matches(request(etag), etag)
+    assert etag_matches(request(f'"other", W/{etag}'), etag)
+    assert etag_matches(request('*'), etag)
+    assert not etag_matches(request('"other"'), etag)
+    assert not etag_matches(request(), etag)
+    assert make_etag('product', 'tiki', 1) == etag != make_etag('product', 'tiki', 2)
+
+@pytest.fixture
+def history(monkeypatch):
+    sync = FakeDB()
+    sync['tiki'].insert_one({'_id': 1, 'id': 7, 'name': 'Tivi', 'scraped_timestamp': datetime(2025, 1, 3, 8)})
+    sync[registry.COLLECTION].insert_one({'_id': 'tiki:7', 'snapshot_id': 1, 'last_seen': datetime(2025, 1, 3, 8)})
+    for day, price in [(1, 100), (2, 90), (3, 80)]:
+        sync['price_history_daily'].insert_one({
+            'platform': 'tiki', 'item_id': 7, 'day': datetime(2025, 1, day), 'price': price, 'stock': 1,
+            'refreshed_at': datetime(2025, 1, 3, 9),
+        })
+    monkeypatch.setattr(backendv2, 'db', AsyncFakeDB(sync))
+    monkeypatch.setattr(backendv2, 'backfilled_platforms', {'tiki'})
+    monkeypatch.setattr(backendv2, 'cache', ResponseCache(shared_path=None))
+    return sync
+
+def get(if_none_match=None):
+    return asyncio.run(backendv2.get_price_history('tiki', '7', request(if_none_match), start=None, end=None))
+
+def test_unchanged_history_is_not_modified(history):
+    first = get()
+    assert first.status_code == 200
+    assert get(first.headers['etag']).status_code == 304
+
+def test_rewriting_an_older_day_changes_the_etag(history, monkeypatch):
+    etag = get().headers['etag']
+
+    # A late scrape regroups day 1; the newest day and the latest snapshot are unchanged
+    history['price_history_daily'].update_one(
+        {'item_id': 7, 'day': datetime(2025, 1, 1)},
+        {'$set': {'price': 70, 'refreshed_at': datetime(2025, 1, 4, 9)}}
+    )
+    monkeypatch.setattr(backendv2, 'cache', ResponseCache(shared_path=None))
+
+    response = get(etag)
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert b'"salePrice":70' in response.body
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+import pytest
+
+import export
+from tests.fakes import AsyncCursor, AsyncFakeDB, FakeDB
+
+def seed(count):
+    db = FakeDB()
+    for number in range(count):
+        db['tiki'].insert_one({'_id': number, 'id': number, 'price': 100 + number,
+                               'scraped_timestamp': datetime(2025, 1, 1 + number)})
+    return db
+
+def collect(stream):
+    async def read():
+        return [chunk async for chunk in stream]
+    return asyncio.run(read())
+
+def export_documents(db, since=None, fields=()):
+    cursor = AsyncCursor(db['tiki'].find(**export.document_query(since, list(fields))))
+    return [orjson.loads(line) for chunk in collect(export.ndjson_stream(cursor)) for line in chunk.splitlines()]
+
+def test_since_resumes_without_repeating_the_last_record():
+    db = seed(3)
+    first = export_documents(db)
+    assert [document['id'] for document in first] == [0, 1, 2]
+
+    db['tiki'].insert_one({'_id': 3, 'id': 3, 'price': 103, 'scraped_timestamp': datetime(2025, 1, 4)})
+    since = datetime.fromisoformat(first[-1]['scraped_timestamp'])
+    assert [document['id'] for document in export_documents(db, since)] == [3]
+
+def test_canonical_pipeline_is_exclusive_and_ordered():
+    since = datetime(2025, 1, 2)
+    match, sort, project = export.canonical_pipeline('tiki', since, ['item_id', 'price'])
+    assert match == {'$match': {'scraped_timestamp': {'$gt': since}}}
+    assert sort == {'$sort': {'scraped_timestamp': 1}}
+    assert project == {'$project': {'_id': 0, 'item_id': '$id', 'price': '$price'}}
+    assert export.canonical_pipeline('tiki', None, [])[0] == {'$match': {}}
+
+def test_ndjson_is_flushed_in_chunks_and_closes_the_cursor(monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 2)
+    cursor = AsyncCursor(seed(5)['tiki'].find({}, {'_id': 0, 'id': 1}))
+    chunks = collect(export.ndjson_stream(cursor))
+    assert [chunk.count(b'\n') for chunk in chunks] == [2, 2, 1]
+    assert cursor.closed
+
+def records_cursor(records):
+    db = FakeDB()
+    for record in records:
+        db['records'].insert_one(dict(record))
+    return db['records'].find({}, {'_id': 0})
+
+def test_arrow_stream_round_trips():
+    pa = pytest.importorskip('pyarrow')
+    records = [{'item_id': number, 'price': 100.0 + number} for number in range(3)]
+    cursor = AsyncCursor(records_cursor(records))
+    table = pa.ipc.open_stream(b''.join(collect(export.arrow_stream(cursor, ['item_id', 'price'])))).read_all()
+    assert table.to_pylist() == records
@@ -0,0 +1,143 @@
+from pathlib import Path
+
+import orjson
+import pytest
+
+import matching
+import search
+from platforms import get_item_id, get_title
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'data'
+
+class FakeCollection:
+    """
+    Just enough of a pymongo collection for match_items, counting round trips
+    """
+    def __init__(self):
+        self.documents = {}
+        self.calls = 0
+
+    def find(self, query, projection=None):
+        self.calls += 1
+        for document in list(self.documents.values()):
+            if '$in' in query.get('_id', {}) and document['_id'] not in query['_id']['$in']:
+                continue
+            if 'bands' in query and not set(query['bands']['$in']) & set(document.get('bands', [])):
+                continue
+            if 'global_id' in query and 'global_id' not in document:
+                continue
+            yield dict(document)
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls += 1
+        for operation in operations:
+            key = operation._filter['_id']
+            if key not in self.documents and not operation._upsert:
+                continue
+            update = operation._doc
+            if isinstance(update, list):
+                # The price pipeline; only its literal fields matter here
+                update = {'$set': {name: value['$literal'] for name, value in update[0]['$set'].items()
+                                   if '$literal' in value}}
+            self.documents.setdefault(key, {'_id': key}).update(update['$set'])
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+def snapshot(platform, item_id):
+    """
+    The newest saved snapshot of an item from urls.yaml that has its title;
+    later Shopee captures are blocked pages or other endpoints
+    """
+    for path in sorted((DATA_DIR / platform).glob(f'{item_id}_*.json'), reverse=True):
+        document = orjson.loads(path.read_bytes())
+        if get_item_id(platform, document) == item_id and get_title(platform, document):
+            return document
+    raise LookupError(f"No usable snapshot of {platform}:{item_id}")
+
+def ingest(db, *items):
+    for platform, item_id in items:
+        matching.match_snapshots(db, platform, [snapshot(platform, item_id)])
+
+def global_id(db, platform, item_id):
+    return db[matching.COLLECTION].documents[matching.match_key(platform, item_id)]['global_id']
+
+@pytest.mark.parametrize('first, second', [
+    (('lazada', 2792189799), ('shopee', 29560903606)),  # iPhone 16 Pro Max
+    (('lazada', 1040858590), ('shopee', 5873954476)),   # MacBook Air M1
+])
+def test_urls_yaml_listings_of_one_product_link(first, second):
+    db = FakeDB()
+    ingest(db, first, second)
+    assert global_id(db, *first) == global_id(db, *second)
+
+def test_iphone_15_does_not_join_iphone_16():
+    db = FakeDB()
+    ingest(db, ('lazada', 2792189799), ('shopee', 29560903606), ('tiki', 271973414))
+    assert global_id(db, 'tiki', 271973414) != global_id(db, 'lazada', 2792189799)
+
+def test_every_urls_yaml_item_gets_one_group():
+    db = FakeDB()
+    items = [(platform, int(path.name.split('_')[0]))
+             for platform in ('lazada', 'shopee', 'tiki')
+             for path in (DATA_DIR / platform).glob('*_*.json')]
+    ingest(db, *sorted(set(items)))
+    groups = {}
+    for document in db[matching.COLLECTION].documents.values():
+        groups.setdefault(document['global_id'], set()).add(document['_id'])
+    linked = sorted(sorted(group) for group in groups.values() if len(group) > 1)
+    assert linked == [
+        ['lazada:1040858590', 'shopee:5873954476'],
+        ['lazada:2792189799', 'shopee:29560903606'],
+    ]
+
+def test_batch_costs_constant_round_trips():
+    db = FakeDB()
+    documents = [snapshot('lazada', 2792189799), snapshot('lazada', 1040858590), snapshot('lazada', 2730432618)]
+    assert matching.match_snapshots(db, 'lazada', documents) == 3
+    # Price updates, existing assignments, candidates, match writes
+    assert db[matching.COLLECTION].calls == 4
+    assert db[search.COLLECTION].calls == 1
+
+def test_unchanged_items_keep_their_id_without_writes():
+    db = FakeDB()
+    document = snapshot('tiki', 271973414)
+    matching.match_snapshots(db, 'tiki', [document])
+    before = global_id(db, 'tiki', 271973414)
+    db[search.COLLECTION].calls = 0
+    assert matching.match_snapshots(db, 'tiki', [document]) == 1
+    assert global_id(db, 'tiki', 271973414) == before
+    assert db[search.COLLECTION].calls == 0
+
+@pytest.mark.parametrize('title, words', [
+    ('(Sale Tết từ 20H 05.01) iPhone 16 Pro Max - Hàng Chính Hãng VN/A', ['iphone', '16', 'pro', 'max']),
+    ('[DUY NHẤT 26-28.11] MacBook Air 2020 13.3 inches M1- Hàng Chính Hãng', ['macbook', 'air', '2020', '13p3inch', 'm1']),
+    ('Điện thoại Samsung Galaxy A05s (4GB/128GB) - Đã kích hoạt bảo hành điện tử', ['galaxy', 'a05s']),
+    ('Apple iPhone 16 Pro Max 256GB, bảo hành 12 tháng', ['iphone', '16', 'pro', 'max']),
+])
+def test_title_words_drop_noise(title, words):
+    brand = 'Samsung' if 'Samsung' in title else 'Apple'
+    assert matching.title_words(title, brand) == words
+
+@pytest.mark.parametrize('first, second, conflict', [
+    ('iPhone 15 Pro Max', 'iPhone 16 Pro Max', True),
+    ('MacBook Air M1', 'MacBook Air M2', True),
+    ('Tivi 55 inch', 'Tivi 65 inch', True),
+    ('Galaxy A05', 'Galaxy A05s', True),
+    ('MacBook Air 13 inch', 'MacBook Air 13.3 inches', False),
+    ('UA65DU8000', 'UA65DU8000KXXV', False),
+    ('iPhone 16 Pro Max', 'iPhone 16 Pro Max 2024', False),
+])
+def test_specs_conflict(first, second, conflict):
+    first_specs = matching.specs(matching.title_words(first, None))
+    second_specs = matching.specs(matching.title_words(second, None))
+    assert matching.specs_conflict(first_specs, second_specs) is conflict
+    assert matching.specs_conflict(second_specs, first_specs) is conflict
+
+def test_signatures_are_stable():
+    shingles = matching.features(['iphone', '16'], 'Apple')
+    assert matching.signature(shingles) == matching.signature(set(shingles))
+    assert len(matching.band_keys(matching.signature(shingles))) == matching.BANDS
+    assert matching.signature(set()) is None
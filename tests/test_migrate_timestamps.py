@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from ingest import prepare_snapshot
+from migrate_timestamps import checkpoint_id, migrate_platform
+from tests.fakes import FakeDB
+
+def seed(db, count):
+    for number in range(count):
+        db['tiki'].insert_one({'_id': number, 'id': number, 'scraped_timestamp': f'2025-01-{number + 1:02d}T08:00:00Z'})
+
+def test_strings_become_dates():
+    db = FakeDB()
+    seed(db, 5)
+    db['tiki'].insert_one({'_id': 5, 'id': 5, 'scraped_timestamp': datetime(2025, 2, 1)})
+    assert migrate_platform(db, 'tiki', batch_size=2) == 5
+    values = [document['scraped_timestamp'] for document in db['tiki'].find({}, sort=[('_id', 1)])]
+    assert values[0] == datetime(2025, 1, 1, 8, tzinfo=timezone.utc)
+    assert all(isinstance(value, datetime) for value in values)
+    assert db['migrations'].find_one({'_id': checkpoint_id('tiki')})['done'] is True
+    assert migrate_platform(db, 'tiki') == 0
+
+def test_interrupted_run_resumes_from_the_checkpoint(monkeypatch):
+    db = FakeDB()
+    seed(db, 5)
+    collection = db['tiki']
+    bulk_write = collection.bulk_write
+    writes = []
+
+    def crash_on_second_batch(operations, **kwargs):
+        writes.append([operation._filter['_id'] for operation in operations])
+        if len(writes) == 2:
+            raise ConnectionError("lost the primary")
+        return bulk_write(operations, **kwargs)
+
+    monkeypatch.setattr(collection, 'bulk_write', crash_on_second_batch)
+    with pytest.raises(ConnectionError):
+        migrate_platform(db, 'tiki', batch_size=2)
+    assert db['migrations'].find_one({'_id': checkpoint_id('tiki')})['last_id'] == 1
+
+    assert migrate_platform(db, 'tiki', batch_size=2) == 5
+    # The second run starts after the last checkpointed batch
+    assert writes[2] == [2, 3]
+    assert all(isinstance(document['scraped_timestamp'], datetime) for document in collection.find())
+
+def test_updates_are_guarded_on_the_original_string(monkeypatch):
+    db = FakeDB()
+    seed(db, 1)
+    collection = db['tiki']
+    bulk_write = collection.bulk_write
+
+    def ingest_rewrites_first(operations, **kwargs):
+        # A concurrent ingest stored a newer value after the batch was read
+        collection.update_one({'_id': 0}, {'$set': {'scraped_timestamp': datetime(2025, 3, 1)}})
+        return bulk_write(operations, **kwargs)
+
+    monkeypatch.setattr(collection, 'bulk_write', ingest_rewrites_first)
+    assert migrate_platform(db, 'tiki') == 0
+    assert collection.find_one({'_id': 0})['scraped_timestamp'] == datetime(2025, 3, 1)
+
+def test_unparseable_values_are_skipped():
+    db = FakeDB()
+    db['tiki'].insert_one({'_id': 0, 'scraped_timestamp': 'yesterday'})
+    assert migrate_platform(db, 'tiki') == 0
+    assert db['tiki'].find_one({'_id': 0})['scraped_timestamp'] == 'yesterday'
+
+def test_prepare_snapshot_parses_the_timestamp():
+    assert prepare_snapshot({'scraped_timestamp': '2025-01-02T03:04:05Z'})['scraped_timestamp'] == \
+        datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert prepare_snapshot({'id': 1}) == {'id': 1}
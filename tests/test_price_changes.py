@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import price_changes
+import registry
+from price_changes import (COLLECTION, ChangeBroadcaster, Subscriber, change_percent, detect_changes, event_stream,
+                           parse_items)
+from tests.fakes import AsyncFakeDB, matches
+
+def tiki(item_id, day, price, qty=10):
+    return {'id': item_id, 'sku': str(item_id), 'price': price, 'stock_item': {'qty': qty},
+            'scraped_timestamp': datetime(2025, 1, day)}
+
+def previous(item_id, price, qty, day):
+    return {registry.registry_key('tiki', item_id): {'price': price, 'stock': qty, 'last_seen': datetime(2025, 1, day)}}
+
+def moves(events):
+    return [(event['item_id'], event['old_price'], event['new_price'], event['old_stock'], event['new_stock'])
+            for event in events]
+
+def test_new_item_has_no_old_price():
+    events = detect_changes('tiki', [tiki(1, 2, 100)], {})
+    assert moves(events) == [(1, None, 100, None, 10)]
+    assert events[0]['change_pct'] is None
+
+def test_unchanged_snapshots_produce_nothing():
+    assert detect_changes('tiki', [tiki(1, 2, 100), tiki(1, 3, 100)], previous(1, 100, 10, 1)) == []
+
+def test_snapshots_are_walked_in_time_order():
+    documents = [tiki(1, 4, 80), tiki(1, 2, 100), tiki(1, 3, 90)]
+    events = detect_changes('tiki', documents, previous(1, 100, 10, 1))
+    assert moves(events) == [(1, 100, 90, 10, 10), (1, 90, 80, 10, 10)]
+    assert [event['change_pct'] for event in events] == [-10.0, -11.11]
+
+def test_late_snapshots_change_nothing():
+    documents = [tiki(1, 2, 50), tiki(1, 5, 100)]
+    assert detect_changes('tiki', documents, previous(1, 100, 10, 3)) == []
+
+def test_stock_only_moves_are_events():
+    events = detect_changes('tiki', [tiki(1, 2, 100, qty=0)], previous(1, 100, 10, 1))
+    assert moves(events) == [(1, 100, 100, 10, 0)]
+    assert events[0]['change_pct'] == 0.0
+
+def test_items_are_independent():
+    documents = [tiki(1, 2, 100), tiki(2, 2, 200)]
+    events = detect_changes('tiki', documents, previous(1, 100, 10, 1))
+    assert moves(events) == [(2, None, 200, None, 10)]
+
+@pytest.mark.parametrize('old, new, expected', [(100, 90, -10.0), (0, 90, None), (None, 90, None), (100, None, None)])
+def test_change_percent(old, new, expected):
+    assert change_percent(old, new) == expected
+
+def test_subscriber_filters():
+    event = {'platform': 'tiki', 'item_id': 1, 'change_pct': -3.0}
+    assert Subscriber().matches(event)
+    assert not Subscriber(platforms={'lazada'}).matches(event)
+    assert Subscriber(items=parse_items('tiki:1')).matches(event)
+    assert not Subscriber(min_change=5).matches(event)
+    assert not Subscriber(min_change=5).matches({**event, 'change_pct': None})
+
+def test_parse_items_rejects_missing_id():
+    with pytest.raises(ValueError):
+        parse_items('tiki')
+
+def test_subscriber_query_matches_like_the_filters():
+    events = [{'platform': platform, 'item_id': item_id, 'change_pct': change}
+              for platform in ('tiki', 'lazada') for item_id in (1, 2) for change in (-8.0, -3.0, 6.0, None)]
+    for subscriber in (Subscriber(), Subscriber(platforms={'lazada'}), Subscriber(items=parse_items('tiki:1,lazada:2')),
+                       Subscriber(platforms={'tiki'}, min_change=5)):
+        assert [matches(event, subscriber.query()) for event in events] == [subscriber.matches(event) for event in events]
+
+def stored_events(count):
+    db = AsyncFakeDB()
+    ids = [ObjectId() for _ in range(count + 1)]
+    db.sync[COLLECTION].insert_many([{'_id': object_id, 'platform': 'tiki', 'item_id': number % 2, 'change_pct': 10.0}
+                                     for number, object_id in enumerate(ids)])
+    return db, ids
+
+def test_replay_sends_missed_matching_events_oldest_first(monkeypatch):
+    monkeypatch.setattr(price_changes, 'REPLAY_LIMIT', 3)
+    db, ids = stored_events(6)
+    replayed = asyncio.run(ChangeBroadcaster(db).replay(Subscriber(items=parse_items('tiki:1')), ids[0]))
+    assert [event['_id'] for event in replayed] == [ids[1], ids[3], ids[5]]
+
+def test_replay_over_the_limit_sends_a_reset(monkeypatch):
+    monkeypatch.setattr(price_changes, 'REPLAY_LIMIT', 3)
+    db, ids = stored_events(4)
+    broadcaster = ChangeBroadcaster(db)
+    subscriber = Subscriber()
+    assert asyncio.run(broadcaster.replay(subscriber, ids[0])) is None
+
+    async def first_message():
+        stream = event_stream(broadcaster, subscriber, ids[0])
+        message = await stream.__anext__()
+        await stream.aclose()
+        return message
+
+    message = asyncio.run(first_message())
+    assert message.startswith(b'id: %s\nevent: reset\n' % str(ids[-1]).encode())
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import price_history_daily
+from price_points import TOUCHED_COLLECTION, COLLECTION as PRICE_POINTS, make_point, mark_touched
+from tests.fakes import FakeDB, matches
+
+def point(item_id, day, hour, primary=True):
+    return make_point('tiki', item_id, None, datetime(2025, 1, day, hour), 100, 1, primary)
+
+def recording_aggregate(db):
+    pipelines = []
+    db[PRICE_POINTS].aggregate = lambda pipeline, **kwargs: pipelines.append(pipeline)
+    return pipelines
+
+def test_mark_touched_queues_each_primary_day_once():
+    db = FakeDB()
+    assert mark_touched(db, [point(1, 1, 8), point(1, 1, 20), point(1, 3, 8), point(2, 1, 8, primary=False)]) == 2
+    mark_touched(db, [point(1, 1, 9)])
+    entries = {entry['_id']: entry['seq'] for entry in db[TOUCHED_COLLECTION].find()}
+    assert entries == {'tiki:1:2025-01-01': 2, 'tiki:1:2025-01-03': 1}
+
+def test_touched_match_selects_exactly_the_touched_days():
+    db = FakeDB()
+    # A late scrape of an older day is queued like a fresh one
+    mark_touched(db, [point(1, 5, 8), point(1, 2, 8), point(2, 2, 8)])
+    query = price_history_daily.touched_match(list(db[TOUCHED_COLLECTION].find()))
+    assert matches(point(1, 2, 23), query)
+    assert matches(point(2, 2, 0), query)
+    assert matches(point(1, 5, 12), query)
+    assert not matches(point(1, 3, 8), query)
+    assert not matches(point(2, 5, 8), query)
+    assert not matches(point(1, 2, 8, primary=False), query)
+
+def test_refresh_regroups_in_batches_and_empties_the_queue(monkeypatch):
+    db = FakeDB()
+    mark_touched(db, [point(item_id, day, 8) for item_id in range(3) for day in (1, 2)])
+    pipelines = recording_aggregate(db)
+    monkeypatch.setattr(price_history_daily, 'REFRESH_BATCH', 4)
+
+    assert price_history_daily.refresh(db) == 6
+    assert len(pipelines) == 2
+    assert all(pipeline[-1]['$merge']['into'] == price_history_daily.COLLECTION for pipeline in pipelines)
+    assert db[TOUCHED_COLLECTION].documents == []
+    assert price_history_daily.refresh(db) == 0
+
+def test_days_marked_during_a_refresh_stay_queued():
+    db = FakeDB()
+    mark_touched(db, [point(1, 1, 8)])
+    entries = list(db[TOUCHED_COLLECTION].find())
+    # Ingest writes the same day again between the read and the clear
+    mark_touched(db, [point(1, 1, 9)])
+    price_history_daily.clear_touched(db, entries)
+    assert [entry['_id'] for entry in db[TOUCHED_COLLECTION].find()] == ['tiki:1:2025-01-01']
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import backendv2
+import price_points
+from tests.fakes import AsyncFakeDB, FakeDB
+
+def tiki_snapshot(day, hour, price):
+    return {'id': 7, 'sku': 'S7', 'name': 'Tivi 55 inch', 'price': price, 'stock_item': {'qty': 3},
+            'scraped_timestamp': datetime(2025, 1, day, hour)}
+
+def seed(db):
+    for day, hour, price in [(1, 8, 100), (1, 20, 90), (2, 8, 80), (3, 8, 85)]:
+        db['tiki'].insert_one(tiki_snapshot(day, hour, price))
+
+def test_restart_does_not_duplicate_points():
+    db = FakeDB()
+    seed(db)
+    assert price_points.backfill(db, 'tiki', batch_size=3) == 4
+    assert price_points.backfill(db, 'tiki') == 0
+    assert price_points.backfill(db, 'tiki', restart=True) == 0
+    assert len(db[price_points.COLLECTION].documents) == 4
+
+def test_interrupted_batch_is_not_written_twice(monkeypatch):
+    db = FakeDB()
+    seed(db)
+    update_one = db['migrations'].update_one
+
+    def crash_before_checkpoint(*args, **kwargs):
+        raise ConnectionError("lost the primary")
+
+    # The first batch is written but its checkpoint is not
+    monkeypatch.setattr(db['migrations'], 'update_one', crash_before_checkpoint)
+    with pytest.raises(ConnectionError):
+        price_points.backfill(db, 'tiki', batch_size=2)
+    monkeypatch.setattr(db['migrations'], 'update_one', update_one)
+
+    assert price_points.backfill(db, 'tiki', batch_size=2) == 2
+    stamps = sorted(point['timestamp'] for point in db[price_points.COLLECTION].documents)
+    assert stamps == sorted(snapshot['scraped_timestamp'] for snapshot in db['tiki'].documents)
+
+def test_point_key_matches_stored_dates():
+    stored = price_points.point_key(7, None, datetime(2025, 1, 1, 8, 0, 0, 123000))
+    assert price_points.point_key(7, None, datetime.fromisoformat('2025-01-01T08:00:00.123456+00:00')) == stored
+
+def test_price_history_reads_snapshots_until_the_backfill_is_done(monkeypatch):
+    sync = FakeDB()
+    seed(sync)
+    monkeypatch.setattr(backendv2, 'db', AsyncFakeDB(sync))
+    monkeypatch.setattr(backendv2, 'backfilled_platforms', set())
+
+    history = asyncio.run(backendv2.get_item_price_history('tiki', '7'))
+    assert [(entry['scraped_timestamp'], entry['salePrice']) for entry in history] == \
+        [('2025-01-01', 100), ('2025-01-02', 80), ('2025-01-03', 85)]
+    assert history[0]['title'] == 'Tivi 55 inch' and history[0]['stock_qty'] == 3
+
+    history = asyncio.run(backendv2.get_item_price_history('tiki', '7', start=datetime(2025, 1, 2, 12)))
+    assert [entry['scraped_timestamp'] for entry in history] == ['2025-01-02', '2025-01-03']
+
+    # Once done, the daily view answers (it is still empty here)
+    price_points.backfill(sync, 'tiki')
+    assert asyncio.run(backendv2.get_item_price_history('tiki', '7')) == []
+    assert backendv2.backfilled_platforms == {'tiki'}
@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import backendv2
+import registry
+from tests.fakes import AsyncFakeDB, FakeDB
+
+REQUEST = Request({'type': 'http', 'method': 'GET', 'path': '/', 'headers': []})
+
+@pytest.fixture
+def db(monkeypatch):
+    sync = FakeDB()
+    for platform, item_id in [('tiki', 3), ('lazada', 2), ('tiki', 1), ('lazada', 1), ('shopee', 5)]:
+        sync[registry.COLLECTION].insert_one({'_id': registry.registry_key(platform, item_id),
+                                              'platform': platform, 'item_id': item_id, 'snapshot_id': item_id,
+                                              'last_seen': datetime(2025, 1, 1)})
+    sync['lazada'].insert_one({'_id': 1, 'scraped_timestamp': datetime(2025, 1, 1),
+                               'responseBody': {'itemId': 1, 'title': 'MacBook', 'skus': [{'salePrice': 10, 'stock': 2}]}})
+    monkeypatch.setattr(backendv2, 'db', AsyncFakeDB(sync))
+    monkeypatch.setattr(backendv2, 'raw_db', AsyncFakeDB(sync, raw=True))
+    return sync
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_all_products_page_across_platforms(db):
+    pages, after = [], None
+    while True:
+        page = run(backendv2.load_all_products_page(2, after))
+        pages.append(page['product_ids'])
+        after = page['next_after']
+        if after is None:
+            break
+    assert pages == [{'lazada': [1, 2]}, {'shopee': [5], 'tiki': [1]}, {'tiki': [3]}]
+
+def test_platform_pages_end_with_a_null_cursor(db):
+    first = run(backendv2.load_platform_products_page('tiki', 1, None))
+    assert (first['product_ids'], first['next_after']) == ([1], 1)
+    second = run(backendv2.load_platform_products_page('tiki', 1, str(first['next_after'])))
+    assert second['product_ids'] == [3]
+    last = run(backendv2.load_platform_products_page('tiki', 1, '3'))
+    assert (last['product_ids'], last['next_after']) == ([], None)
+
+def test_bad_cursor_is_rejected(db):
+    with pytest.raises(ValueError):
+        backendv2.parse_products_cursor('ebay:1')
+    with pytest.raises(ValueError):
+        backendv2.parse_products_cursor('lazada:')
+
+def test_fields_select_from_the_flattened_product(db):
+    response = run(backendv2.get_product_details('lazada', '1', REQUEST, fields='title,skus.salePrice'))
+    assert orjson.loads(response.body) == {'title': 'MacBook', 'skus': [{'salePrice': 10}]}
+    assert backendv2.pdp_projection('lazada', 'title') == {'title': 1, 'responseBody.title': 1, '_id': 0}
+    assert backendv2.pdp_projection('tiki', None) is None
+
+def test_missing_snapshot_is_not_found(db):
+    # The registry points at a snapshot that is not stored
+    with pytest.raises(HTTPException) as error:
+        run(backendv2.get_product_details('tiki', '3', REQUEST, fields=None))
+    assert error.value.status_code == 404
+    with pytest.raises(HTTPException) as error:
+        run(backendv2.get_product_details('lazada', '404', REQUEST, fields=None))
+    assert error.value.status_code == 404
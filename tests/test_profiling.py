@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import profiling
+from profiling import CommandTimer, Histogram, ProfilingMiddleware, RequestProfile, current_profile, phase
+
+def test_phase_charges_the_current_request_only():
+    with phase('serialize'):
+        pass
+
+    profile = RequestProfile('/x')
+    token = current_profile.set(profile)
+    try:
+        with phase('serialize'):
+            pass
+        with phase('serialize'):
+            pass
+    finally:
+        current_profile.reset(token)
+    assert list(profile.phases) == ['serialize']
+    assert profile.phases['serialize'] >= 0
+
+def test_server_timing_lists_phases_in_order_with_total():
+    profile = RequestProfile()
+    profile.add('encode', 0.002)
+    profile.add('db', 0.010)
+    profile.db_commands = 3
+    entries = profile.server_timing().split(', ')
+    assert entries[0] == 'db;dur=10.0;desc="3 commands"'
+    assert entries[1] == 'encode;dur=2.0'
+    assert entries[2].startswith('app;dur=')
+
+def test_command_timer_charges_the_request_and_the_command_series(monkeypatch):
+    histogram = Histogram('mongo', 'test', ('command',))
+    monkeypatch.setattr(profiling, 'MONGO_LATENCY', histogram)
+    profile = RequestProfile()
+    token = current_profile.set(profile)
+    try:
+        CommandTimer().succeeded(SimpleNamespace(command_name='find', duration_micros=4000))
+        CommandTimer().failed(SimpleNamespace(command_name='find', duration_micros=1000))
+    finally:
+        current_profile.reset(token)
+    assert profile.db_commands == 2
+    assert round(profile.phases['db'], 6) == 0.005
+    counts, total = histogram.series[('find',)]
+    assert sum(counts) == 2 and round(total, 6) == 0.005
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('latency', 'Test latency', ('route',), buckets=(0.1, 1.0))
+    histogram.observe(('/a"b',), 0.05)
+    histogram.observe(('/a"b',), 0.5)
+    histogram.observe(('/a"b',), 5.0)
+    assert histogram.render() == [
+        '# HELP latency Test latency',
+        '# TYPE latency histogram',
+        'latency_bucket{route="/a\\"b",le="0.1"} 1',
+        'latency_bucket{route="/a\\"b",le="1.0"} 2',
+        'latency_bucket{route="/a\\"b",le="+Inf"} 3',
+        'latency_sum{route="/a\\"b"} 5.55',
+        'latency_count{route="/a\\"b"} 3',
+    ]
+
+def test_middleware_adds_server_timing_and_records_the_route_template(monkeypatch):
+    requests = Histogram('requests', 'test', ('method', 'route', 'status'))
+    phases = Histogram('phases', 'test', ('route', 'phase'))
+    monkeypatch.setattr(profiling, 'REQUEST_LATENCY', requests)
+    monkeypatch.setattr(profiling, 'PHASE_LATENCY', phases)
+
+    async def app(scope, receive, send):
+        scope['route'] = SimpleNamespace(path='/products/{platform}')
+        with phase('db'):
+            pass
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/products/tiki', 'headers': []}
+    asyncio.run(ProfilingMiddleware(app)(scope, None, send))
+
+    headers = dict(messages[0]['headers'])
+    assert headers[b'server-timing'].startswith(b'db;dur=')
+    assert list(requests.series) == [('GET', '/products/{platform}', '200')]
+    assert list(phases.series) == [('/products/{platform}', 'db')]
+    assert current_profile.get() is None
+
+def test_render_metrics_exposes_every_histogram():
+    text = profiling.render_metrics()
+    for name in ('http_request_duration_seconds', 'http_request_phase_seconds', 'mongodb_command_duration_seconds'):
+        assert f'# TYPE {name} histogram' in text
+    assert text.endswith('\n')
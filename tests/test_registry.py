@@ -0,0 +1,62 @@
+from datetime import datetime
+from itertools import permutations
+
+import registry
+from tests.fakes import FakeDB, matches
+
+def snapshot(number, item_id, day, price):
+    return {'_id': number, 'id': item_id, 'scraped_timestamp': datetime(2025, 1, day), 'sku': f'{item_id}-1',
+            'price': price, 'stock_item': {'qty': 5}}
+
+SNAPSHOTS = [snapshot(1, 7, 2, 100), snapshot(2, 7, 5, 80), snapshot(3, 7, 3, 90)]
+
+def registered(documents):
+    db = FakeDB()
+    registry.ensure_collection(db)
+    for document in documents:
+        registry.record_snapshots(db, 'tiki', [document])
+    return db
+
+def test_updates_apply_in_any_order():
+    entries = [registered(order)[registry.COLLECTION].find_one({'_id': 'tiki:7'}) for order in permutations(SNAPSHOTS)]
+    for entry in entries:
+        assert entry == {'_id': 'tiki:7', 'platform': 'tiki', 'item_id': 7,
+                         'first_seen': datetime(2025, 1, 2), 'last_seen': datetime(2025, 1, 5),
+                         'snapshot_id': 2, 'price': 80, 'stock': 5}
+
+def test_replaying_changes_nothing():
+    db = registered(SNAPSHOTS)
+    before = db[registry.COLLECTION].find_one({'_id': 'tiki:7'})
+    result = db[registry.COLLECTION].bulk_write([registry.snapshot_update('tiki', document) for document in SNAPSHOTS])
+    assert result.modified_count == 0
+    assert db[registry.COLLECTION].find_one({'_id': 'tiki:7'}) == before
+
+def test_snapshots_without_id_or_timestamp_are_skipped():
+    assert registry.snapshot_update('tiki', {'_id': 1, 'scraped_timestamp': datetime(2025, 1, 1)}) is None
+    assert registry.snapshot_update('tiki', {'_id': 1, 'id': 7}) is None
+    assert registry.record_snapshots(FakeDB(), 'tiki', [{'id': 7, 'scraped_timestamp': datetime(2025, 1, 1)}]) == 0
+
+def test_page_filter_for_one_platform():
+    assert registry.page_filter('tiki', None) == {'platform': 'tiki'}
+    query = registry.page_filter('tiki', 7)
+    assert matches({'platform': 'tiki', 'item_id': 8}, query)
+    assert not matches({'platform': 'tiki', 'item_id': 7}, query)
+    assert not matches({'platform': 'shopee', 'item_id': 8}, query)
+
+def test_page_filter_across_platforms_resumes_after_the_cursor():
+    assert registry.page_filter(None, None) == {}
+    query = registry.page_filter(None, ('shopee', 5))
+    assert matches({'platform': 'shopee', 'item_id': 6}, query)
+    assert matches({'platform': 'tiki', 'item_id': 1}, query)
+    assert not matches({'platform': 'shopee', 'item_id': 5}, query)
+    assert not matches({'platform': 'lazada', 'item_id': 9}, query)
+
+def test_backfill_registers_stored_snapshots():
+    db = FakeDB()
+    db['tiki'].insert_many(SNAPSHOTS + [snapshot(4, 8, 1, 50)])
+    assert registry.backfill(db, 'tiki', batch_size=2) == 4
+    entries = {entry['_id']: entry['snapshot_id'] for entry in db[registry.COLLECTION].find()}
+    assert entries == {'tiki:7': 2, 'tiki:8': 4}
+    # Rerunning is safe
+    registry.backfill(db, 'tiki', batch_size=2)
+    assert db[registry.COLLECTION].count_documents({}) == 2
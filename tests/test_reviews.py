@@ -0,0 +1,126 @@
+import functools
+from datetime import datetime
+
+import pytest
+
+from reviews import SORTS, extract_reviews, keyset_filter, next_cursor, page_query
+from serialization import decode_cursor, encode_cursor
+
+
+def compare(first, second):
+    # MongoDB orders null (and missing) before every date and number
+    if first is None or second is None:
+        return (first is not None) - (second is not None)
+    return (first > second) - (first < second)
+
+
+def sort_key(order):
+    def cmp(a, b):
+        for field, direction in order:
+            result = compare(a.get(field), b.get(field)) * direction
+            if result:
+                return result
+        return 0
+    return functools.cmp_to_key(cmp)
+
+
+def matches(document, query):
+    """
+    The subset of MongoDB query semantics keyset_filter produces
+    """
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == '$ne':
+                    if value == operand:
+                        return False
+                elif operator == '$exists':
+                    if (field in document) != operand:
+                        return False
+                elif value is None or operand is None:
+                    # Comparisons never cross types, so null matches neither $lt nor $gt
+                    return False
+                elif operator == '$lt' and not value < operand:
+                    return False
+                elif operator == '$gt' and not value > operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+REVIEWS = [
+    {'review_id': 1, 'rating': 5, 'created_at': datetime(2024, 11, 1)},
+    {'review_id': 2, 'rating': 4, 'created_at': datetime(2024, 11, 1)},
+    {'review_id': 3, 'rating': None, 'created_at': datetime(2024, 11, 3)},
+    {'review_id': 4, 'rating': 5, 'created_at': None},
+    {'review_id': 5, 'rating': None, 'created_at': None},
+    {'review_id': 6, 'rating': 1, 'created_at': datetime(2024, 11, 2)},
+    {'review_id': 7, 'created_at': datetime(2024, 11, 2)},
+    {'review_id': 8, 'rating': 5, 'created_at': datetime(2024, 11, 1)},
+]
+
+
+@pytest.mark.parametrize('sort', list(SORTS))
+@pytest.mark.parametrize('limit', [1, 2, 3])
+def test_pages_reach_every_review_once_in_order(sort, limit):
+    order = SORTS[sort]
+    expected = sorted(REVIEWS, key=sort_key(order))
+
+    seen, after = [], None
+    while True:
+        query, _ = page_query('tiki', 1, sort, after)
+        query = {key: value for key, value in query.items() if key not in ('platform', 'item_id')}
+        page = sorted((review for review in REVIEWS if matches(review, query)), key=sort_key(order))[:limit]
+        seen += page
+        after = next_cursor(sort, page, limit)
+        if after is None:
+            break
+
+    assert [review['review_id'] for review in seen] == [review['review_id'] for review in expected]
+
+
+def test_descending_scan_continues_into_nulls():
+    query = keyset_filter(SORTS['newest'], [datetime(2024, 11, 1), 1])
+    assert {'created_at': None} in query['$or']
+
+
+def test_nothing_follows_the_last_null_of_a_descending_scan():
+    query = keyset_filter([('rating', -1)], [None])
+    assert not matches({'_id': 1, 'rating': None}, query)
+    assert not matches({'_id': 2, 'rating': 5}, query)
+
+
+def test_cursor_round_trip_keeps_datetimes_and_nulls():
+    values = [datetime(2024, 11, 14, 8, 30, 15, 123000), None, 42]
+    assert decode_cursor(encode_cursor(values), 3) == values
+
+
+@pytest.mark.parametrize('token', ['not base64!', encode_cursor([1])])
+def test_malformed_cursors_are_rejected(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token, 2)
+
+
+def test_unknown_sort_is_rejected():
+    with pytest.raises(ValueError):
+        page_query('tiki', 1, 'random', None)
+
+
+def test_extract_tiki_reviews():
+    document = {'id': '197665885', 'data': [
+        {'id': 11, 'rating': 4, 'created_at': 1731571200, 'content': 'Tốt', 'title': 'Hài lòng',
+         'created_by': {'name': 'An'}, 'images': [{'full_path': 'a.jpg'}], 'thank_count': 2},
+        {'rating': 5},
+    ]}
+    [review] = extract_reviews('tiki', document)
+    assert review['item_id'] == 197665885
+    assert review['review_id'] == 11
+    assert review['created_at'] == datetime(2024, 11, 14, 8, 0)
+    assert review['images'] == ['a.jpg']
+    assert review['author'] == 'An'
@@ -0,0 +1,32 @@
+import pytest
+
+import search
+from serialization import decode_cursor
+
+def test_fold_strips_vietnamese_marks():
+    assert search.fold('Điện thoại Samsung Galaxy A05s (4GB/128GB)') == 'dien thoai samsung galaxy a05s 4gb 128gb'
+    assert search.fold(None) == ''
+
+def test_every_word_is_required():
+    assert search.text_search('Điện  thoại') == '"dien" "thoai"'
+    # Quotes typed by the user cannot break out of a phrase
+    assert search.text_search('"iphone" 16') == '"iphone" "16"'
+    match = search.search_pipeline('dien thoai', 'tiki', 20, None)[0]['$match']
+    assert match == {'$text': {'$search': '"dien" "thoai"'}, 'platform': 'tiki'}
+
+def test_pages_resume_below_the_last_score():
+    rows = [{'_id': 'tiki:1', 'score': 2.5}, {'_id': 'tiki:2', 'score': 1.5}]
+    after = search.next_cursor(rows, 2)
+    assert decode_cursor(after, 2) == [1.5, 'tiki:2']
+    assert search.next_cursor(rows, 3) is None
+
+    stages = search.search_pipeline('tivi', None, 2, after)
+    assert stages[2] == {'$match': {'$or': [
+        {'score': {'$lt': 1.5}},
+        {'score': 1.5, '_id': {'$gt': 'tiki:2'}},
+    ]}}
+    assert stages[-2] == {'$limit': 2}
+
+def test_bad_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        search.search_pipeline('tivi', None, 2, 'garbage')
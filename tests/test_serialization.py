@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import bson
+import orjson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+import backendv2
+from serialization import PrerenderedJSONResponse, decode_raw, dumps
+
+def raw(document):
+    return RawBSONDocument(bson.encode(document))
+
+def test_object_ids_and_dates_encode_without_a_default_pass():
+    key = ObjectId()
+    body = dumps({'_id': key, 'at': datetime(2025, 1, 2, 3, 4, 5), 'nested': [{'id': key}]})
+    assert orjson.loads(body) == {'_id': str(key), 'at': '2025-01-02T03:04:05', 'nested': [{'id': str(key)}]}
+
+def test_raw_documents_decode_once():
+    document = {'_id': 1, 'name': 'Tivi', 'stock_item': {'qty': 3}}
+    assert decode_raw(raw(document)) == document
+    assert decode_raw(None) is None
+    # Nested raw documents left in a response are decoded by the encoder
+    assert orjson.loads(dumps({'item': raw(document)})) == {'item': document}
+
+def test_pdp_handlers_flatten_the_response_body():
+    lazada = raw({'_id': 1, 'responseBody': {'itemId': 9, 'title': 'A'}})
+    shopee = raw({'_id': 2, 'responseBody': {'data': {'item': {'item_id': 8, 'title': 'B'}}}})
+    assert backendv2.get_lazada_pdp(lazada) == {'_id': 1, 'itemId': 9, 'title': 'A'}
+    assert backendv2.get_shopee_pdp(shopee) == {'_id': 2, 'item_id': 8, 'title': 'B'}
+    assert backendv2.get_tiki_pdp(raw({'_id': 3, 'id': 7})) == {'_id': 3, 'id': 7}
+
+def test_prerendered_bodies_are_sent_as_is():
+    assert PrerenderedJSONResponse(b'{"a":1}').body == b'{"a":1}'
+    assert PrerenderedJSONResponse({'a': 1}).body == b'{"a":1}'
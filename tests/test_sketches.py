@@ -0,0 +1,150 @@
+import random
+from datetime import datetime
+
+import pytest
+
+import reviews
+import sketches
+from sketches import COLLECTION, KLLSketch, summarize
+from tests.fakes import FakeDB
+
+def rank_error(sketch, values, fraction):
+    ordered = sorted(values)
+    estimate = sketch.quantiles([fraction])[0]
+    rank = sum(1 for value in ordered if value <= estimate) / len(ordered)
+    return abs(rank - fraction)
+
+def weight(sketch):
+    return sum(weight for _, weight in sketch.weighted())
+
+def test_small_sketch_is_exact():
+    sketch = KLLSketch(k=200)
+    sketch.extend(range(1, 101))
+    assert sketch.quantiles([0, 0.5, 1]) == [1, 50, 100]
+    assert (sketch.min, sketch.max, sketch.count) == (1, 100, 100)
+
+def test_compaction_keeps_every_value_counted():
+    random.seed(1)
+    sketch = KLLSketch(k=50)
+    sketch.extend(random.random() for _ in range(20000))
+    assert weight(sketch) == sketch.count == 20000
+    assert sketch.retained < 20000
+
+def test_merge_matches_one_sketch_of_everything():
+    random.seed(2)
+    first_values = [random.gauss(100, 10) for _ in range(30000)]
+    second_values = [random.gauss(150, 20) for _ in range(10000)]
+    first, second = KLLSketch(k=200), KLLSketch(k=200)
+    first.extend(first_values)
+    second.extend(second_values)
+    first.merge(second)
+
+    values = first_values + second_values
+    assert first.count == weight(first) == len(values)
+    assert (first.min, first.max) == (min(values), max(values))
+    for fraction in (0.05, 0.25, 0.5, 0.75, 0.95):
+        assert rank_error(first, values, fraction) < 0.02
+
+def test_merge_is_order_independent_in_totals():
+    random.seed(3)
+    parts = [KLLSketch(k=100) for _ in range(10)]
+    for part in parts:
+        part.extend(random.random() for _ in range(1000))
+    forward, backward = KLLSketch(k=100), KLLSketch(k=100)
+    for part in parts:
+        forward.merge(KLLSketch.from_document(part.to_document()))
+    for part in reversed(parts):
+        backward.merge(KLLSketch.from_document(part.to_document()))
+    assert forward.count == backward.count == 10000
+    assert abs(forward.quantiles([0.5])[0] - backward.quantiles([0.5])[0]) < 0.03
+
+def test_merging_an_empty_sketch_changes_nothing():
+    sketch = KLLSketch()
+    sketch.extend([3, 1, 2])
+    sketch.merge(KLLSketch())
+    assert (sketch.count, sketch.min, sketch.max) == (3, 1, 3)
+    assert KLLSketch().quantiles([0.5]) == [None]
+    assert KLLSketch().histogram(5) == []
+
+def test_document_round_trip():
+    sketch = KLLSketch(k=20)
+    sketch.extend(range(1000))
+    restored = KLLSketch.from_document(sketch.to_document())
+    assert restored.weighted() == sketch.weighted()
+    assert restored.quantiles([0.1, 0.9]) == sketch.quantiles([0.1, 0.9])
+
+def test_histogram_counts_add_up():
+    random.seed(4)
+    sketch = KLLSketch(k=200)
+    sketch.extend(range(10000))
+    histogram = sketch.histogram(10)
+    assert len(histogram) == 10
+    assert sum(bucket['count'] for bucket in histogram) == 10000
+    assert histogram[0]['min'] == 0 and histogram[-1]['max'] == 9999
+    assert all(abs(bucket['count'] - 1000) < 200 for bucket in histogram)
+
+def test_constant_values_fall_in_one_bin():
+    sketch = KLLSketch()
+    sketch.extend([5] * 10)
+    assert [bucket['count'] for bucket in sketch.histogram(3)] == [10, 0, 0]
+
+def test_summarize_merges_per_platform_and_overall():
+    random.seed(5)
+    documents = []
+    for platform, values in (('tiki', range(100)), ('lazada', range(100, 300))):
+        sketch = KLLSketch(k=200)
+        sketch.extend(values)
+        documents.append({'platform': platform, **sketch.to_document()})
+    summary = summarize(documents, [0.5], 4)
+    assert list(summary['platforms']) == ['lazada', 'tiki']
+    assert summary['platforms']['tiki']['count'] == 100
+    assert summary['overall']['count'] == 300
+    assert abs(summary['overall']['quantiles']['0.5'] - 149) <= 3
+
+def test_scope_covers_whole_days():
+    scope = sketches.scope(['tiki', 'lazada', 'tiki'], datetime(2025, 1, 3, 15), datetime(2025, 1, 9, 8))
+    assert scope == {'platforms': ['lazada', 'tiki'], 'start': datetime(2025, 1, 3), 'end': datetime(2025, 1, 10)}
+
+def test_sketch_filter_rejects_unknown_field():
+    with pytest.raises(ValueError):
+        sketches.sketch_filter('stock', ['tiki'], None, None, None)
+
+def tiki(item_id, hour, price, rating=4.5, day=3):
+    return {'_id': f'{item_id}-{day}-{hour}', 'id': item_id, 'sku': str(item_id), 'price': price,
+            'stock_item': {'qty': 1}, 'categories': {'id': 1795}, 'rating_average': rating,
+            'scraped_timestamp': datetime(2025, 1, day, hour)}
+
+def stored_sketch(db, field, day=3):
+    return db[COLLECTION].find_one({'_id': sketches.sketch_key('tiki', 1795, datetime(2025, 1, day), field)})
+
+def test_items_count_once_per_day_with_their_earliest_snapshot():
+    db = FakeDB()
+    db[reviews.COLLECTION].insert_many([{'platform': 'tiki', 'item_id': 1, 'review_id': number} for number in range(3)])
+    sketches.record_snapshots(db, 'tiki', [tiki(1, 20, 300), tiki(1, 8, 100), tiki(2, 9, 200), tiki(1, 9, 5, day=4)])
+
+    price = stored_sketch(db, 'price')
+    assert (price['count'], price['min'], price['max']) == (2, 100, 200)
+    assert sorted(price['items']) == [1, 2]
+    assert stored_sketch(db, 'price', day=4)['count'] == 1
+    # Stored reviews, not the snapshot's own counter; items without reviews count as 0
+    totals = stored_sketch(db, 'total_reviews')
+    assert (totals['count'], totals['min'], totals['max']) == (2, 0, 3)
+
+def test_replayed_snapshots_are_not_counted_twice():
+    db = FakeDB()
+    batch = [tiki(1, 8, 100), tiki(2, 9, 200)]
+    assert sketches.record_snapshots(db, 'tiki', batch) == 6
+    assert sketches.record_snapshots(db, 'tiki', batch) == 0
+    # A later snapshot of a sketched item-day adds nothing; a new item does
+    assert sketches.record_snapshots(db, 'tiki', [tiki(1, 12, 900), tiki(3, 12, 50)]) == 3
+    price = stored_sketch(db, 'price')
+    assert (price['count'], price['min'], price['max'], price['version']) == (3, 50, 200, 2)
+
+def test_backfill_reruns_are_safe():
+    db = FakeDB()
+    db['tiki'].insert_many([tiki(1, 8, 100), tiki(1, 20, 300), tiki(2, 9, 200)])
+    sketches.backfill(db, 'tiki', batch_size=2)
+    sketches.backfill(db, 'tiki', batch_size=2)
+    assert stored_sketch(db, 'price')['count'] == 2
+    summary = sketches.distribution(db, 'price', platforms=['tiki'], fractions=[0.5], bins=2)
+    assert summary['overall']['count'] == 2
@@ -0,0 +1,61 @@
+import json
+from collections import Counter
+from datetime import datetime
+
+import synthetic
+from platforms import PLATFORMS, get_item_id, get_title, parse_timestamp
+from price_points import extract_price_points, primary_point
+
+END = datetime(2025, 3, 1)
+
+def records(seed=0, items=3, days=4):
+    return list(synthetic.generate(PLATFORMS, items, days, END, seed=seed))
+
+def test_same_seed_gives_the_same_data():
+    assert records(seed=7) == records(seed=7)
+    assert records(seed=7) != records(seed=8)
+
+def test_one_snapshot_per_listing_per_day_and_one_review_response():
+    counts = Counter(collection for collection, _ in records(items=3, days=4))
+    assert counts == {'lazada': 12, 'shopee': 12, 'tiki': 12, 'review': 6}
+
+def test_item_ids_are_above_real_ids_and_distinct_per_platform():
+    ids = {}
+    for collection, document in records(items=3):
+        if collection != 'review':
+            ids.setdefault(collection, set()).add(get_item_id(collection, document))
+    for platform, item_ids in ids.items():
+        offset = synthetic.FIRST_ITEM_ID + PLATFORMS.index(platform) * synthetic.PLATFORM_ID_STRIDE
+        assert item_ids == {offset + number for number in range(3)}
+
+def test_snapshots_have_the_scraped_shape():
+    for collection, document in records(items=2, days=3):
+        if collection == 'review':
+            continue
+        timestamp = parse_timestamp(document['scraped_timestamp'])
+        assert datetime(2025, 2, 26) <= timestamp.replace(tzinfo=None) < END
+        assert get_title(collection, document)
+        points = extract_price_points(collection, document)
+        assert points and all(point['price'] > 0 for point in points)
+        assert primary_point(collection, document)['price'] > 0
+        # Stored and written to files as JSON
+        json.dumps(document)
+
+def test_review_responses_match_the_listing():
+    for collection, document in records(items=2, days=30):
+        if collection != 'review':
+            continue
+        if isinstance(document.get('data'), dict):
+            summary = document['data']['item_rating_summary']
+            assert summary['rating_total'] == sum(summary['rating_count'])
+            assert len(document['data']['ratings']) <= synthetic.REVIEW_RESPONSE_SIZE
+        else:
+            assert document['reviews_count'] == sum(star['count'] for star in document['stars'].values())
+            assert len(document['data']) <= synthetic.REVIEW_RESPONSE_SIZE
+
+def test_write_files_uses_the_save_data_layout(tmp_path):
+    written = synthetic.write_files(tmp_path, records(items=1, days=2))
+    assert written == {'lazada': 2, 'shopee': 2, 'tiki': 2, 'review': 2}
+    tiki_id = synthetic.FIRST_ITEM_ID + PLATFORMS.index('tiki') * synthetic.PLATFORM_ID_STRIDE
+    assert (tmp_path / 'review' / 'tiki' / f'tiki_{tiki_id}.json').exists()
+    assert len(list((tmp_path / 'tiki').glob(f'{tiki_id}_*.json'))) == 2